@@ -0,0 +1,124 @@
+"""
+Simulate several workers calling a throttled API through the shared scheduler.
+
+A local HTTP stand-in allows QUOTA requests per second and answers 429 with a
+Retry-After header above it. Worker threads, each with its own ApiScheduler
+(as separate worker processes would have) but sharing one Redis, send requests
+through the scheduler. Reports sustained throughput against the quota, how many
+429s were seen and whether any request was lost.
+
+Uses fakeredis when it is installed, else the Redis at REDIS_URL. Run from the
+repository root:
+    python -m benchmarks.api_scheduler
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+import requests
+from loguru import logger
+
+from src.splitter.api_scheduler import (ApiScheduler, ServiceLimits,
+                                        raise_for_retryable_status)
+from src.splitter.settings import settings
+
+QUOTA = 20
+WORKERS = 4
+THREADS_PER_WORKER = 8
+REQUESTS_PER_WORKER = 100
+LATENCY = 0.05
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """Answers 200 within the per-second quota and 429 above it."""
+
+    lock = threading.Lock()
+    window_start = 0.0
+    window_count = 0
+    throttled = 0
+    served = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            now = time.time()
+            if now - cls.window_start >= 1:
+                cls.window_start, cls.window_count = now, 0
+            cls.window_count += 1
+            allowed = cls.window_count <= QUOTA
+            if allowed:
+                cls.served += 1
+            else:
+                cls.throttled += 1
+        time.sleep(LATENCY)
+        self.send_response(200 if allowed else 429)
+        if not allowed:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def connect_redis() -> redis.Redis:
+    try:
+        import fakeredis
+
+        return fakeredis.FakeRedis()
+    except ImportError:
+        return redis.from_url(settings.REDIS_URL)
+
+
+def post(url: str) -> int:
+    response = requests.post(url, json={})
+    raise_for_retryable_status(response)
+    return response.status_code
+
+
+def run_worker(scheduler: ApiScheduler, url: str) -> int:
+    with ThreadPoolExecutor(THREADS_PER_WORKER) as executor:
+        futures = [
+            executor.submit(scheduler.call, "ocr", post, url)
+            for _ in range(REQUESTS_PER_WORKER)
+        ]
+        return sum(1 for future in futures if future.result() == 200)
+
+
+def main() -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    redis_conn = connect_redis()
+    limits = {
+        "ocr": ServiceLimits(
+            requests_per_second=QUOTA,
+            burst=QUOTA // 2,
+            max_concurrency=THREADS_PER_WORKER,
+            target_latency=1.0,
+        )
+    }
+    schedulers = [ApiScheduler(redis_conn, limits) for _ in range(WORKERS)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(WORKERS) as executor:
+        succeeded = sum(executor.map(run_worker, schedulers, [url] * WORKERS))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    total = WORKERS * REQUESTS_PER_WORKER
+    print(f"{succeeded}/{total} requests succeeded in {elapsed:.1f}s")
+    print(f"throughput {succeeded / elapsed:.1f} req/s against a quota of {QUOTA}")
+    print(f"429 responses: {ThrottlingHandler.throttled}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Grid-search the segmentation strategies on bundles with known documents.
+
+Every strategy in SEGMENTATION_STRATEGIES is run over a grid of split levels,
+and agglomerative clustering also over a grid of alpha. The embedding and page
+distances of a bundle are computed once for the whole agglomerative grid, and
+the merge tree once per alpha, then cut at every threshold. For each strategy
+the best parameters by mean boundary F1 across bundles are listed with the
+defaults, with the F1 within one page, the wall time of a single run with those
+parameters, and its peak memory. Peak memory does not depend on the parameters
+and is traced with tracemalloc in a separate run at the defaults, as tracing
+slows down the timed runs.
+
+Bundles are synthetic by default, or saved embeddings files, each with a JSON
+list of the first page of every true document, counted from 0. Run from the
+repository root:
+    python -m benchmarks.clustering_grid
+    python -m benchmarks.clustering_grid --embeddings a.bin --boundaries a.json
+"""
+
+import csv
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import typer
+
+from benchmarks.metrics import boundary_scores
+from benchmarks.synthetic import make_labeled_embeddings
+from src.splitter.ml_models.clustering import (
+    SEGMENTATION_STRATEGIES, agglomerative_linkage, cut_linkage,
+    pairwise_distances, perform_agglomerative_clustering, perform_segmentation)
+from src.splitter.ml_models.embedding import read_embeddings_file
+
+ALPHAS = (0.5, 0.7, 0.85, 0.95)
+SPLIT_LEVELS = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0)
+DEFAULT_ALPHA = 0.85
+DEFAULT_SPLIT_LEVEL = 2.0
+# (documents, page noise) of each synthetic bundle
+SYNTHETIC_BUNDLES = ((60, 0.8), (60, 1.2), (150, 0.8), (150, 1.2))
+MAX_AGGLOMERATIVE_PAGES = 5000
+TOP_PARAMETERS = 3
+
+# Parameters, page labels and wall time of one run
+Trial = Tuple[Tuple[float, ...], np.ndarray, float]
+
+
+def timed(func: Callable, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(func: Callable, *args) -> int:
+    """Peak bytes allocated while running the function."""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def agglomerative_grid(embeddings: np.ndarray) -> Iterator[Trial]:
+    """Cut one merge tree per alpha at every split level, sharing the distances."""
+    distances, distance_seconds = timed(pairwise_distances, embeddings)
+    for alpha in ALPHAS:
+        tree, tree_seconds = timed(agglomerative_linkage, *distances, alpha)
+        for split_level in SPLIT_LEVELS:
+            labels, cut_seconds = timed(cut_linkage, tree, split_level)
+            # The time a run with these parameters alone would take
+            seconds = distance_seconds + tree_seconds + cut_seconds
+            yield (alpha, split_level), labels, seconds
+
+
+def split_level_grid(strategy: str) -> Callable[[np.ndarray], Iterator[Trial]]:
+    def grid(embeddings: np.ndarray) -> Iterator[Trial]:
+        for split_level in SPLIT_LEVELS:
+            labels, seconds = timed(
+                perform_segmentation, embeddings, strategy, split_level
+            )
+            yield (split_level,), labels, seconds
+
+    return grid
+
+
+def default_run(strategy: str) -> Callable[[np.ndarray], np.ndarray]:
+    if strategy == "agglomerative":
+        return lambda embeddings: perform_agglomerative_clustering(
+            embeddings, DEFAULT_ALPHA, DEFAULT_SPLIT_LEVEL
+        )
+    return lambda embeddings: perform_segmentation(
+        embeddings, strategy, DEFAULT_SPLIT_LEVEL
+    )
+
+
+STRATEGY_GRIDS = {
+    strategy: (
+        agglomerative_grid
+        if strategy == "agglomerative"
+        else split_level_grid(strategy)
+    )
+    for strategy in SEGMENTATION_STRATEGIES
+}
+
+
+def labels_from_first_pages(first_pages: List[int], n_pages: int) -> np.ndarray:
+    """Return the document label of each page from the first page of every document."""
+    starts = np.zeros(n_pages, dtype=int)
+    for page in first_pages:
+        if not 0 <= page < n_pages:
+            raise typer.BadParameter(f"Page {page} is not in a bundle of {n_pages}")
+        starts[page] = 1
+    starts[0] = 0
+    return np.cumsum(starts)
+
+
+def load_bundles(
+    embeddings_files: List[str], boundaries_files: List[str]
+) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """Yield the name, embeddings and true labels of every bundle."""
+    if not embeddings_files:
+        for n_documents, page_noise in SYNTHETIC_BUNDLES:
+            embeddings, labels = make_labeled_embeddings(
+                n_documents=n_documents, page_noise=page_noise, seed=n_documents
+            )
+            yield f"synthetic-{n_documents}-{page_noise}", embeddings, labels
+        return
+
+    if len(embeddings_files) != len(boundaries_files):
+        raise typer.BadParameter("Give one --boundaries file per --embeddings file")
+    for embeddings_file, boundaries_file in zip(embeddings_files, boundaries_files):
+        embeddings = np.asarray(read_embeddings_file(embeddings_file), np.float32)
+        with open(boundaries_file, "r") as f:
+            labels = labels_from_first_pages(json.load(f), len(embeddings))
+        yield embeddings_file, embeddings, labels
+
+
+def main(
+    embeddings: Optional[List[str]] = None,
+    boundaries: Optional[List[str]] = None,
+    output: Optional[str] = None,
+) -> None:
+    """
+    Grid-search the segmentation strategies on labeled bundles.
+
+    Args:
+        embeddings (List[str]): Embeddings files of saved bundles. Synthetic
+            bundles are used when none are given.
+        boundaries (List[str]): JSON list of the first page of every true
+            document, one file per embeddings file, in the same order.
+        output (str): CSV file to write the scores of every run to.
+    """
+    # (F1, F1 +-1, seconds) of each run, by strategy and parameters
+    scores: Dict[str, Dict[Tuple[float, ...], List[Tuple[float, ...]]]] = {}
+    peaks: Dict[str, int] = {}
+    rows = []
+    start = time.perf_counter()
+    for name, page_embeddings, labels in load_bundles(
+        embeddings or [], boundaries or []
+    ):
+        print(f"{name}: {len(page_embeddings)} pages, {labels[-1] + 1} documents")
+        for strategy, grid in STRATEGY_GRIDS.items():
+            if (
+                strategy == "agglomerative"
+                and len(page_embeddings) > MAX_AGGLOMERATIVE_PAGES
+            ):
+                continue
+            peaks[strategy] = max(
+                peaks.get(strategy, 0),
+                peak_memory(default_run(strategy), page_embeddings),
+            )
+            for parameters, predicted, seconds in grid(page_embeddings):
+                f1 = boundary_scores(labels, predicted)["f1"]
+                tolerant_f1 = boundary_scores(labels, predicted, tolerance=1)["f1"]
+                scores.setdefault(strategy, {}).setdefault(parameters, []).append(
+                    (f1, tolerant_f1, seconds)
+                )
+                alpha = parameters[0] if len(parameters) == 2 else ""
+                rows.append(
+                    [name, strategy, alpha, parameters[-1], f1, tolerant_f1, seconds]
+                )
+    print(f"Grid searched in {time.perf_counter() - start:.1f}s\n")
+
+    print(
+        f"{'strategy':>14} {'alpha':>6} {'split':>6} {'F1':>6} {'F1 +-1':>7} "
+        f"{'seconds':>8} {'peak MB':>8}"
+    )
+    for strategy, by_parameters in scores.items():
+        means = {
+            parameters: np.mean(runs, axis=0)
+            for parameters, runs in by_parameters.items()
+        }
+        ranked = sorted(means, key=lambda parameters: -means[parameters][0])
+        default = (
+            (DEFAULT_ALPHA, DEFAULT_SPLIT_LEVEL)
+            if strategy == "agglomerative"
+            else (DEFAULT_SPLIT_LEVEL,)
+        )
+        listed = ranked[:TOP_PARAMETERS]
+        if default not in listed:
+            listed.append(default)
+        for parameters in listed:
+            f1, tolerant_f1, seconds = means[parameters]
+            alpha = f"{parameters[0]:>6}" if len(parameters) == 2 else f"{'-':>6}"
+            note = " (default)" if parameters == default else ""
+            print(
+                f"{strategy:>14} {alpha} {parameters[-1]:>6} {f1:>6.3f} "
+                f"{tolerant_f1:>7.3f} {seconds:>8.3f} "
+                f"{peaks[strategy] / 1e6:>8.1f}{note}"
+            )
+
+    if output:
+        with open(output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["bundle", "strategy", "alpha", "split_level", "f1", "f1_1", "seconds"]
+            )
+            writer.writerows(rows)
+        print(f"\nWrote {len(rows)} runs to {output}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,77 @@
+"""
+Compare the local embedding backend with the OpenAI embeddings API.
+
+Embeds synthetic labeled bundles with each backend and reports embedding time,
+throughput, and the boundary F1 and adjusted Rand index of every segmentation
+strategy on the result. The local backend is run both fitted per job and with a
+model fitted once on a separate stored corpus. The API backend is skipped unless
+OPENAI_API_KEY is set.
+
+Run from the repository root:
+    python -m benchmarks.embedding_backends
+"""
+
+import time
+
+from sklearn.metrics import adjusted_rand_score
+
+from benchmarks.metrics import boundary_scores
+from benchmarks.synthetic import make_labeled_texts
+from src.splitter.ml_models.clustering import (SEGMENTATION_STRATEGIES,
+                                               perform_segmentation)
+from src.splitter.ml_models.embedding_backends import (LocalEmbeddingBackend,
+                                                       OpenAIEmbeddingBackend)
+from src.splitter.settings import settings
+
+BUNDLE_DOCUMENTS = (30, 150, 1000)
+CORPUS_DOCUMENTS = 500
+MAX_AGGLOMERATIVE_PAGES = 1500
+MAX_API_PAGES = 2000
+SPLIT_LEVEL = 2.0
+
+
+def main() -> None:
+    corpus_texts, _ = make_labeled_texts(n_documents=CORPUS_DOCUMENTS, seed=12345)
+    start = time.perf_counter()
+    corpus_backend = LocalEmbeddingBackend(model_path=None).fit(corpus_texts)
+    print(
+        f"Fitted the corpus model on {len(corpus_texts)} pages in "
+        f"{time.perf_counter() - start:.2f}s\n"
+    )
+
+    backends = {
+        "local (job)": LocalEmbeddingBackend(model_path=None),
+        "local (corpus)": corpus_backend,
+    }
+    if settings.OPENAI_API_KEY:
+        backends["openai"] = OpenAIEmbeddingBackend()
+
+    print(
+        f"{'pages':>6} {'backend':>15} {'embed s':>8} {'pages/s':>9} "
+        f"{'strategy':>14} {'F1':>6} {'ARI':>6}"
+    )
+    for n_documents in BUNDLE_DOCUMENTS:
+        texts, labels = make_labeled_texts(n_documents=n_documents, seed=n_documents)
+        for name, backend in backends.items():
+            if name == "openai" and len(texts) > MAX_API_PAGES:
+                continue
+            start = time.perf_counter()
+            embeddings = backend.embed(texts)
+            elapsed = time.perf_counter() - start
+            for strategy in SEGMENTATION_STRATEGIES:
+                if strategy == "agglomerative" and len(texts) > MAX_AGGLOMERATIVE_PAGES:
+                    continue
+                predicted = perform_segmentation(
+                    embeddings, strategy=strategy, split_level=SPLIT_LEVEL
+                )
+                scores = boundary_scores(labels, predicted)
+                print(
+                    f"{len(texts):>6} {name:>15} {elapsed:>8.3f} "
+                    f"{len(texts) / elapsed:>9.0f} {strategy:>14} "
+                    f"{scores['f1']:>6.3f} "
+                    f"{adjusted_rand_score(labels, predicted):>6.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark the embeddings file format against the previous pickle storage.
+
+Reports file size, load time and resident memory growth for each storage dtype
+on a 10k-page synthetic bundle, and the agreement of cluster labels computed
+from quantized embeddings with labels computed from the float32 originals.
+
+Run from the repository root:
+    python -m benchmarks.embedding_storage
+"""
+
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from benchmarks.synthetic import make_labeled_embeddings
+from src.splitter.ml_models.clustering import perform_agglomerative_clustering
+from src.splitter.ml_models.embedding import (STORAGE_DTYPES,
+                                              dequantize_embeddings,
+                                              quantize_embeddings,
+                                              read_embeddings_file,
+                                              write_embeddings_file)
+
+N_PAGES = 10_000
+CLUSTERING_PAGES = 400
+
+
+def resident_memory_mb() -> float:
+    """Current resident set size of this process in MB (Linux only)."""
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def benchmark_storage(embeddings: np.ndarray, directory: str) -> None:
+    pickle_path = os.path.join(directory, "embeddings.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump([np.array(row, dtype=np.float64) for row in embeddings], f)
+
+    rss_before = resident_memory_mb()
+    start = time.perf_counter()
+    with open(pickle_path, "rb") as f:
+        loaded = pickle.load(f)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'pickle':>8}: {os.path.getsize(pickle_path) / 2**20:8.1f} MB on disk, "
+        f"load {elapsed * 1000:8.2f} ms, "
+        f"+{resident_memory_mb() - rss_before:7.1f} MB resident"
+    )
+    del loaded
+
+    for dtype in STORAGE_DTYPES:
+        path = os.path.join(directory, f"embeddings_{dtype}.bin")
+        write_embeddings_file(path, embeddings, dtype=dtype)
+        rss_before = resident_memory_mb()
+        start = time.perf_counter()
+        loaded = read_embeddings_file(path, dequantize=False)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{dtype:>8}: {os.path.getsize(path) / 2**20:8.1f} MB on disk, "
+            f"load {elapsed * 1000:8.2f} ms, "
+            f"+{resident_memory_mb() - rss_before:7.1f} MB resident"
+        )
+        del loaded
+
+
+def benchmark_label_agreement(embeddings: np.ndarray, true_labels: np.ndarray) -> None:
+    reference = perform_agglomerative_clustering(embeddings)
+    print(
+        f"float32 labels vs ground truth: ARI "
+        f"{adjusted_rand_score(true_labels, reference):.4f}"
+    )
+    for dtype in STORAGE_DTYPES[1:]:
+        roundtrip = dequantize_embeddings(*quantize_embeddings(embeddings, dtype))
+        labels = perform_agglomerative_clustering(roundtrip)
+        print(
+            f"{dtype:>8} labels vs float32 labels: ARI "
+            f"{adjusted_rand_score(reference, labels):.4f}, "
+            f"{np.count_nonzero(reference != labels)} pages relabelled"
+        )
+
+
+def main() -> None:
+    embeddings, labels = make_labeled_embeddings(n_documents=N_PAGES // 10)
+    embeddings, labels = embeddings[:N_PAGES], labels[:N_PAGES]
+    print(f"Storage for {len(embeddings)} pages x {embeddings.shape[1]} dimensions")
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark_storage(embeddings, directory)
+
+    print(f"\nCluster label agreement on the first {CLUSTERING_PAGES} pages")
+    benchmark_label_agreement(embeddings[:CLUSTERING_PAGES], labels[:CLUSTERING_PAGES])
+
+
+if __name__ == "__main__":
+    main()
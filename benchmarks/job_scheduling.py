@@ -0,0 +1,209 @@
+"""
+Simulate mixed web load on one FIFO queue and on the size-tiered queues.
+
+The same arrival sequence of jobs, mostly small uploads with occasional medium
+and very large productions, is pushed through RQ queues in Redis and served by
+two worker threads. Each job takes time proportional to its page count. The
+workers dequeue exactly as `TieredWorker` does, with `order_queues` and
+`Queue.dequeue_any`. On the tiers one worker is kept free of large jobs, so a
+production can hold up at most one worker. Reports the median and p95 wait
+until completion of small jobs, and the worst wait of large jobs to show they
+are not starved, for: small uploads alone, mixed load on a single queue, and
+mixed load on the tiers.
+
+Uses fakeredis when it is installed. Otherwise a real Redis is only used when
+BENCHMARK_REDIS_URL names one explicitly, never the application's REDIS_URL.
+Queues there are prefixed with QUEUE_PREFIX, so live workers never pick up the
+simulated jobs, and only the benchmark's own queues and jobs are deleted. Run
+from the repository root:
+    python -m benchmarks.job_scheduling
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import redis
+from loguru import logger
+from rq import Queue
+
+from src.web.job_queues import (order_queues, priority_queue_names,
+                                queue_name_for_pages)
+
+# Keeps the simulated queues apart from the application's on a real Redis
+QUEUE_PREFIX = "benchmark-"
+# Queues of each worker in the tiered run, highest priority first. The second
+# worker never takes large jobs, as `python -m src.web.worker small medium`
+TIERED_WORKER_QUEUES = [["small", "medium", "large"], ["small", "medium"]]
+JOBS = 300
+SECONDS_PER_PAGE = 0.0005
+SECONDS_PER_JOB = 0.01
+LOAD = 0.8
+MAX_WAIT_SECONDS = {
+    QUEUE_PREFIX + "small": None,
+    QUEUE_PREFIX + "medium": 2.0,
+    QUEUE_PREFIX + "large": 5.0,
+}
+SEED = 0
+# Enqueued by path, as RQ refuses functions of the __main__ module
+JOB_FUNCTION = "benchmarks.job_scheduling.simulated_job"
+
+
+def connect_redis() -> redis.Redis:
+    try:
+        import fakeredis
+
+        return fakeredis.FakeRedis()
+    except ImportError:
+        pass
+    url = os.getenv("BENCHMARK_REDIS_URL")
+    if not url:
+        sys.exit(
+            "fakeredis is not installed. Set BENCHMARK_REDIS_URL to a Redis the "
+            "benchmark may use, e.g. redis://localhost:6379/15"
+        )
+    return redis.from_url(url)
+
+
+def simulated_job(page_count: int) -> None:
+    """Stands in for the pipeline. The simulated workers sleep instead of running it."""
+
+
+def make_arrivals(
+    n_jobs: int, small_only: bool = False, seed: int = SEED
+) -> List[Tuple[float, int]]:
+    """Return (arrival offset, page count) pairs with Poisson arrivals."""
+    rng = random.Random(seed)
+    jobs = []
+    for _ in range(n_jobs):
+        kind = rng.random()
+        if small_only or kind < 0.8:
+            jobs.append(rng.randint(1, 20))
+        elif kind < 0.95:
+            jobs.append(rng.randint(21, 300))
+        else:
+            jobs.append(rng.randint(301, 3000))
+    # Arrival rate of the mixed load, so that small-only runs see the same rate
+    mean_service = SECONDS_PER_JOB + SECONDS_PER_PAGE * (
+        0.8 * 10.5 + 0.15 * 160.5 + 0.05 * 1650.5
+    )
+    rate = LOAD * len(TIERED_WORKER_QUEUES) / mean_service
+    offsets, offset = [], 0.0
+    for _ in jobs:
+        offset += rng.expovariate(rate)
+        offsets.append(offset)
+    return list(zip(offsets, jobs))
+
+
+def simulate(
+    connection: redis.Redis, arrivals: List[Tuple[float, int]], tiered: bool
+) -> Dict[int, List[float]]:
+    """Run the arrivals through the queues and return wait times by page count."""
+    names = priority_queue_names() if tiered else ["default"]
+    queues = {name: Queue(QUEUE_PREFIX + name, connection=connection) for name in names}
+    for queue in queues.values():
+        queue.empty()
+    if tiered:
+        worker_queues = [
+            [queues[name] for name in worker_names]
+            for worker_names in TIERED_WORKER_QUEUES
+        ]
+    else:
+        worker_queues = [list(queues.values())] * len(TIERED_WORKER_QUEUES)
+    submitted: Dict[str, Tuple[float, int]] = {}
+    latencies: Dict[int, List[float]] = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def produce():
+        start = time.perf_counter()
+        try:
+            for offset, page_count in arrivals:
+                time.sleep(max(0.0, start + offset - time.perf_counter()))
+                name = queue_name_for_pages(page_count) if tiered else "default"
+                job = queues[name].enqueue(
+                    JOB_FUNCTION, page_count, meta={"page_count": page_count}
+                )
+                with lock:
+                    submitted[job.id] = (time.perf_counter(), page_count)
+        finally:
+            done.set()
+
+    def work(own_queues: List[Queue]):
+        while True:
+            ordered = (
+                order_queues(own_queues, MAX_WAIT_SECONDS) if tiered else own_queues
+            )
+            result: Optional[tuple] = Queue.dequeue_any(
+                ordered, None, connection=connection
+            )
+            if result is None:
+                if done.is_set() and not any(queue.count for queue in queues.values()):
+                    return
+                time.sleep(0.001)
+                continue
+            job, _ = result
+            with lock:
+                submitted_at, page_count = submitted.get(
+                    job.id, (time.perf_counter(), job.meta["page_count"])
+                )
+            time.sleep(SECONDS_PER_JOB + page_count * SECONDS_PER_PAGE)
+            with lock:
+                latencies.setdefault(page_count, []).append(
+                    time.perf_counter() - submitted_at
+                )
+
+    threads = [threading.Thread(target=produce)] + [
+        threading.Thread(target=work, args=(own_queues,))
+        for own_queues in worker_queues
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        # Dequeued jobs are never run by RQ, so their records are deleted here
+        for queue in queues.values():
+            queue.delete(delete_jobs=True)
+        with lock:
+            job_keys = [Queue.job_class.key_for(job_id) for job_id in submitted]
+        if job_keys:
+            connection.delete(*job_keys)
+    return latencies
+
+
+def report(label: str, latencies: Dict[int, List[float]]) -> None:
+    small = np.array([t for pages, ts in latencies.items() if pages <= 20 for t in ts])
+    large = [t for pages, ts in latencies.items() if pages > 300 for t in ts]
+    large_text = f"{max(large):8.2f}s" if large else "       -"
+    print(
+        f"{label:<22} {len(small):>6} {np.median(small):9.3f}s "
+        f"{np.percentile(small, 95):9.3f}s {len(large):>6} {large_text}"
+    )
+
+
+def main() -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    connection = connect_redis()
+    print(f"Redis: {type(connection).__module__}")
+    print(
+        f"{'scenario':<22} {'small':>6} {'median':>10} {'p95':>10} "
+        f"{'large':>6} {'max wait':>9}"
+    )
+    mixed = make_arrivals(JOBS)
+    report(
+        "small only, 1 queue",
+        simulate(connection, make_arrivals(JOBS, small_only=True), False),
+    )
+    report("mixed, 1 queue", simulate(connection, mixed, False))
+    report("mixed, tiered + aging", simulate(connection, mixed, True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Metrics for comparing predicted document splits with ground truth."""
+
+from typing import Dict
+
+import numpy as np
+
+
+def boundary_positions(labels: np.ndarray) -> np.ndarray:
+    """Return the pages that start a new document (excluding the first page)."""
+    labels = np.asarray(labels)
+    return np.flatnonzero(labels[1:] != labels[:-1]) + 1
+
+
+def boundary_scores(
+    true_labels: np.ndarray, predicted_labels: np.ndarray, tolerance: int = 0
+) -> Dict[str, float]:
+    """
+    Precision, recall and F1 of the predicted document boundaries.
+
+    A predicted boundary is correct if a true boundary lies within `tolerance`
+    pages of it, and each true boundary can be matched at most once. Labels need
+    not be contiguous: any change of label between neighbouring pages counts as a
+    boundary, which is how a non-contiguous clustering splits the PDF.
+    """
+    true_boundaries = boundary_positions(true_labels)
+    predicted_boundaries = boundary_positions(predicted_labels)
+    if len(true_boundaries) == 0 and len(predicted_boundaries) == 0:
+        return {"precision": 1.0, "recall": 1.0, "f1": 1.0}
+
+    matched_true = set()
+    true_positives = 0
+    for boundary in predicted_boundaries:
+        distances = np.abs(true_boundaries - boundary)
+        for index in np.flatnonzero(distances <= tolerance):
+            if index not in matched_true:
+                matched_true.add(index)
+                true_positives += 1
+                break
+
+    precision = true_positives / max(len(predicted_boundaries), 1)
+    recall = true_positives / max(len(true_boundaries), 1)
+    f1 = 2 * precision * recall / (precision + recall) if true_positives else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
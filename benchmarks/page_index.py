@@ -0,0 +1,167 @@
+"""
+Measure the page index at a million stored pages on a single core.
+
+Synthetic bundles of 1536-dimensional page embeddings are added one job at a
+time, with the compactions that come with it. The pages of every document share
+a topic direction, as real pages do. A batch of query pages, as a job's pages
+are searched, mixes re-scanned copies of stored pages (slightly perturbed) with
+unseen pages. Reports the add throughput and index size, then for an exact
+search and for IVF searches with several nprobe: the batch latency per query,
+the latency of a single query, the recall of the stored copy as top hit, and the
+unseen pages wrongly matched at PAGE_INDEX_MIN_SIMILARITY. Ends by deleting a
+job and checking its pages are gone.
+
+Needs about 1.6 GB of disk for the int8 shards. Run from the repository root:
+    python -m benchmarks.page_index
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+from threadpoolctl import threadpool_limits
+
+from src.splitter.ml_models.page_index import PageIndex
+from src.splitter.settings import settings
+
+BUNDLES = 1000
+BUNDLE_PAGES = 1000
+DIMENSION = 1536
+TOPICS = 20000
+DOCUMENT_PAGES = 10
+PAGE_NOISE = 0.6
+RESCAN_NOISE = 0.1
+SEEN_QUERIES = 150
+UNSEEN_QUERIES = 50
+IVF_LISTS = 1024
+NPROBES = (4, 16, 64)
+SEED = 0
+
+
+def make_topics() -> np.ndarray:
+    rng = np.random.default_rng(SEED)
+    topics = rng.standard_normal((TOPICS, DIMENSION), dtype=np.float32)
+    return topics / np.linalg.norm(topics, axis=1, keepdims=True)
+
+
+def make_bundle(topics: np.ndarray, bundle: int) -> np.ndarray:
+    """Return the page embeddings of a bundle, the same for the same number."""
+    rng = np.random.default_rng(SEED + 1 + bundle)
+    documents = rng.integers(0, TOPICS, size=BUNDLE_PAGES // DOCUMENT_PAGES)
+    pages = np.repeat(topics[documents], DOCUMENT_PAGES, axis=0)
+    pages += rng.standard_normal(pages.shape, dtype=np.float32) * (
+        PAGE_NOISE / np.sqrt(DIMENSION)
+    )
+    return pages
+
+
+def make_queries(topics: np.ndarray):
+    """Return query pages and the (bundle, page) stored copy of each, or -1."""
+    rng = np.random.default_rng(SEED + BUNDLES + 1)
+    queries, sources = [], []
+    for bundle in rng.choice(BUNDLES, SEEN_QUERIES, replace=False):
+        page = int(rng.integers(BUNDLE_PAGES))
+        queries.append(make_bundle(topics, int(bundle))[page])
+        sources.append((int(bundle), page))
+    queries = np.array(queries)
+    queries += rng.standard_normal(queries.shape, dtype=np.float32) * (
+        RESCAN_NOISE / np.sqrt(DIMENSION)
+    )
+    unseen = topics[rng.integers(0, TOPICS, size=UNSEEN_QUERIES)]
+    unseen = unseen + rng.standard_normal(unseen.shape, dtype=np.float32) * (
+        PAGE_NOISE / np.sqrt(DIMENSION)
+    )
+    sources += [(-1, -1)] * UNSEEN_QUERIES
+    return np.vstack([queries, unseen]).astype(np.float32), np.array(sources)
+
+
+def directory_size(directory: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
+
+
+def report(label: str, index: PageIndex, queries, sources, nprobe: int) -> None:
+    start = time.perf_counter()
+    hits = index.search(queries, nprobe=nprobe)
+    batch_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    index.search(queries[:1], nprobe=nprobe)
+    single_ms = (time.perf_counter() - start) * 1000
+
+    seen = sources[:, 0] >= 0
+    serials = {
+        b.serial: int(b.job_id.split("-")[1]) for b in hits.bundle_records.values()
+    }
+    top_bundles = np.array(
+        [serials.get(int(serial), -1) for serial in hits.bundles[:, 0]]
+    )
+    found = (top_bundles == sources[:, 0]) & (hits.pages[:, 0] == sources[:, 1])
+    false_matches = (hits.scores[~seen, 0] >= settings.PAGE_INDEX_MIN_SIMILARITY).sum()
+    print(
+        f"{label:<14} {batch_ms:>10.2f} {single_ms:>10.1f} "
+        f"{found[seen].mean():>9.3f} {false_matches:>6}/{(~seen).sum()}"
+    )
+
+
+def main() -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    directory = tempfile.mkdtemp(prefix="page_index_")
+    try:
+        with threadpool_limits(limits=1):
+            topics = make_topics()
+            index = PageIndex(directory, "synthetic")
+            start = time.perf_counter()
+            for bundle in range(BUNDLES):
+                index.add(
+                    f"job-{bundle}", f"bundle-{bundle}.pdf", make_bundle(topics, bundle)
+                )
+            elapsed = time.perf_counter() - start
+            pages = BUNDLES * BUNDLE_PAGES
+            print(
+                f"Added {pages} pages in {BUNDLES} jobs in {elapsed:.0f}s "
+                f"({pages / elapsed:.0f} pages/s, with embedding generation), "
+                f"{directory_size(directory) / 1e9:.2f} GB"
+            )
+
+            queries, sources = make_queries(topics)
+            print(f"{len(queries)} queries, {SEEN_QUERIES} of stored pages\n")
+            print(
+                f"{'search':<14} {'ms/query':>10} {'single ms':>10} "
+                f"{'recall@1':>9} {'false':>10}"
+            )
+            report("exact", index, queries, sources, nprobe=0)
+
+            start = time.perf_counter()
+            index.train(IVF_LISTS)
+            print(
+                f"(IVF with {IVF_LISTS} lists trained in {time.perf_counter() - start:.0f}s)"
+            )
+            for nprobe in NPROBES:
+                report(f"IVF nprobe {nprobe}", index, queries, sources, nprobe)
+
+            bundle = int(sources[0, 0])
+            start = time.perf_counter()
+            index.delete(f"job-{bundle}")
+            elapsed = time.perf_counter() - start
+            hits = index.search(queries[:1], nprobe=0)
+            gone = all(
+                hits.bundle_records[int(serial)].job_id != f"job-{bundle}"
+                for serial in hits.bundles[0]
+                if serial >= 0
+            )
+            print(
+                f"\nDeleted job-{bundle} in {elapsed * 1000:.0f} ms, "
+                f"its pages are {'gone' if gone else 'still returned'}"
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark render profiles on a synthetic scanned bundle.
+
+For each profile, reports the time to render the bundle, the bytes that would be
+uploaded to OCR and, when OCR is configured, how closely the OCR text agrees
+with the known page text.
+
+Requires poppler (for pdf2image). Run from the repository root:
+    python -m benchmarks.render_profiles
+"""
+
+import difflib
+import os
+import tempfile
+import time
+from typing import List
+
+from benchmarks.synthetic import make_labeled_texts, make_synthetic_pdf
+from src.splitter.processors.render_profiles import (ADAPTIVE, RENDER_PROFILES,
+                                                     encode_image)
+from src.splitter.processors.text_extractor import TextExtractor
+from src.splitter.settings import settings
+
+N_DOCUMENTS = 8
+
+
+def text_agreement(expected: List[str], actual: List[str]) -> float:
+    """Mean word-level similarity between expected and OCR page texts."""
+    ratios = [
+        difflib.SequenceMatcher(None, e.split(), a.split()).ratio()
+        for e, a in zip(expected, actual)
+    ]
+    return sum(ratios) / len(ratios)
+
+
+def main() -> None:
+    texts, _ = make_labeled_texts(n_documents=N_DOCUMENTS, words_per_page=150)
+    run_ocr = bool(settings.GOOGLE_API_KEY)
+    if not run_ocr:
+        print("GOOGLE_API_KEY is not set, skipping OCR text agreement.")
+
+    with tempfile.TemporaryDirectory() as directory:
+        pdf_path = os.path.join(directory, "bundle.pdf")
+        make_synthetic_pdf(pdf_path, texts)
+        print(f"{len(texts)} pages\n")
+        print(f"{'profile':>8} {'render s':>9} {'upload KB':>10} {'agreement':>10}")
+
+        for profile_name in list(RENDER_PROFILES) + [ADAPTIVE]:
+            extractor = TextExtractor(render_profile=profile_name)
+            start = time.perf_counter()
+            images = extractor.convert_file_to_images(pdf_path)
+            render_seconds = time.perf_counter() - start
+            upload_bytes = sum(len(encode_image(i, profile_name)) for i in images)
+
+            agreement = ""
+            if run_ocr:
+                ocr_texts = [extractor.extract_text_from_images([i]) for i in images]
+                agreement = f"{text_agreement(texts, ocr_texts):.3f}"
+            print(
+                f"{profile_name:>8} {render_seconds:>9.2f} "
+                f"{upload_bytes / 1024:>10.0f} {agreement:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark the segmentation strategies for speed and boundary accuracy.
+
+Runs each strategy at the default split level on synthetic bundles of growing
+size and reports wall time, boundary F1 and the adjusted Rand index against the
+true documents. Agglomerative clustering is skipped for bundles too large for
+its O(n^2) distance matrix.
+
+Run from the repository root:
+    python -m benchmarks.segmentation
+"""
+
+import time
+
+from sklearn.metrics import adjusted_rand_score
+
+from benchmarks.metrics import boundary_scores
+from benchmarks.synthetic import make_labeled_embeddings
+from src.splitter.ml_models.clustering import (SEGMENTATION_STRATEGIES,
+                                               perform_segmentation)
+
+BUNDLE_DOCUMENTS = (20, 60, 150, 1000)
+PAGE_NOISE = (0.8, 1.2)
+MAX_AGGLOMERATIVE_PAGES = 1500
+SPLIT_LEVEL = 2.0
+
+
+def main() -> None:
+    print(
+        f"{'pages':>6} {'noise':>5} {'strategy':>14} {'seconds':>9} "
+        f"{'F1':>6} {'F1 +-1':>7} {'ARI':>6} {'docs':>6}"
+    )
+    for n_documents in BUNDLE_DOCUMENTS:
+        for page_noise in PAGE_NOISE:
+            embeddings, labels = make_labeled_embeddings(
+                n_documents=n_documents, page_noise=page_noise, seed=n_documents
+            )
+            for strategy in SEGMENTATION_STRATEGIES:
+                if (
+                    strategy == "agglomerative"
+                    and len(embeddings) > MAX_AGGLOMERATIVE_PAGES
+                ):
+                    continue
+                start = time.perf_counter()
+                predicted = perform_segmentation(
+                    embeddings, strategy=strategy, split_level=SPLIT_LEVEL
+                )
+                elapsed = time.perf_counter() - start
+                exact = boundary_scores(labels, predicted)
+                tolerant = boundary_scores(labels, predicted, tolerance=1)
+                print(
+                    f"{len(embeddings):>6} {page_noise:>5} {strategy:>14} "
+                    f"{elapsed:>9.3f} {exact['f1']:>6.3f} {tolerant['f1']:>7.3f} "
+                    f"{adjusted_rand_score(labels, predicted):>6.3f} "
+                    f"{len(set(predicted)):>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Synthetic labeled bundles for benchmarking without OCR or API calls."""
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+def make_labeled_embeddings(
+    n_documents: int = 50,
+    min_pages: int = 1,
+    max_pages: int = 20,
+    dimension: int = 1536,
+    page_noise: float = 0.8,
+    topic_overlap: float = 0.4,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate unit-norm page embeddings for a bundle of contiguous documents.
+
+    Each document has a topic direction sharing a common component with every
+    other topic, and every page is its topic plus isotropic noise. This mimics the
+    overlap seen in real page embeddings of a single legal bundle.
+
+    Args:
+        n_documents (int, optional): Number of documents in the bundle.
+        min_pages (int, optional): Minimum pages per document.
+        max_pages (int, optional): Maximum pages per document.
+        dimension (int, optional): Embedding dimension.
+        page_noise (float, optional): Norm of the per-page noise relative to the topic.
+        topic_overlap (float, optional): Cosine similarity between any two topics.
+        seed (int, optional): Random seed.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: float32 embeddings of shape (n_pages, dimension)
+            and the true document label of each page.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(min_pages, max_pages + 1, size=n_documents)
+    labels = np.repeat(np.arange(n_documents), lengths)
+
+    common = rng.standard_normal(dimension)
+    common /= np.linalg.norm(common)
+    topics = rng.standard_normal((n_documents, dimension))
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    topics = np.sqrt(topic_overlap) * common + np.sqrt(1 - topic_overlap) * topics
+    topics = topics.astype(np.float32)
+    noise = rng.standard_normal((len(labels), dimension)).astype(np.float32)
+    noise *= page_noise / np.sqrt(dimension)
+
+    embeddings = topics[labels] + noise
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings, labels
+
+
+TOPIC_VOCABULARIES = {
+    "medical": "patient diagnosis treatment hospital physician clinical injury "
+    "prescription surgery examination symptoms discharge radiology therapy",
+    "affidavit": "affiant sworn deposes states solemnly notary witness "
+    "declaration truth knowledge signed commissioner oath belief",
+    "contract": "agreement party obligations termination clause payment "
+    "consideration breach warranty indemnity schedule execution term",
+    "court": "plaintiff defendant court hearing judgment motion filed order "
+    "jurisdiction counsel appeal registry proceeding docket",
+    "media": "reported newspaper journalist article published headline "
+    "interview broadcast statement press coverage editor source",
+    "employment": "employee employer salary position dismissal leave duties "
+    "performance contract workplace grievance manager entitlement",
+    "insurance": "policy insurer claim premium coverage insured loss assessor "
+    "excess exclusion adjuster settlement underwriting",
+    "correspondence": "dear regards letter enclosed reply sincerely attached "
+    "request confirm advise meeting further writing",
+}
+COMMON_WORDS = "the of and to in that is for on with as by this be at from or are"
+
+
+def make_labeled_texts(
+    n_documents: int = 30,
+    min_pages: int = 1,
+    max_pages: int = 8,
+    words_per_page: int = 120,
+    topic_share: float = 0.5,
+    seed: int = 0,
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Generate page texts for a bundle of contiguous documents with known topics.
+
+    Every page mixes words from its document's topic vocabulary with common words,
+    and consecutive documents never share a topic.
+
+    Args:
+        n_documents (int, optional): Number of documents in the bundle.
+        min_pages (int, optional): Minimum pages per document.
+        max_pages (int, optional): Maximum pages per document.
+        words_per_page (int, optional): Number of words on each page.
+        topic_share (float, optional): Share of topic words on each page.
+        seed (int, optional): Random seed.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The page texts and the true document label
+            of each page.
+    """
+    rng = np.random.default_rng(seed)
+    topics = list(TOPIC_VOCABULARIES)
+    common = np.array(COMMON_WORDS.split())
+    texts, labels = [], []
+    previous_topic = None
+    for document in range(n_documents):
+        topic = rng.choice([t for t in topics if t != previous_topic])
+        previous_topic = topic
+        vocabulary = np.array(TOPIC_VOCABULARIES[topic].split())
+        for _ in range(rng.integers(min_pages, max_pages + 1)):
+            is_topic_word = rng.random(words_per_page) < topic_share
+            words = np.where(
+                is_topic_word,
+                rng.choice(vocabulary, words_per_page),
+                rng.choice(common, words_per_page),
+            )
+            texts.append(" ".join(words))
+            labels.append(document)
+    return texts, np.array(labels)
+
+
+def add_ocr_noise(text: str, seed: int = 0, words_per_line: int = 10) -> str:
+    """
+    Make clean page text look like raw OCR output.
+
+    Breaks the text into lines with some words hyphenated across the break, and
+    adds runs of spaces, ligatures, zero-width characters, dotted rules and lines
+    of stray marks, none of which carry meaning.
+
+    Args:
+        text (str): Clean page text.
+        seed (int, optional): Random seed.
+        words_per_line (int, optional): Words on each line.
+
+    Returns:
+        str: The noisy text, with the same words.
+    """
+    rng = np.random.default_rng(seed)
+    words = text.split()
+    lines, carry = [], []
+    for start in range(0, len(words), words_per_line):
+        line = carry + [
+            word.replace("fi", "\ufb01") if rng.random() < 0.5 else word
+            for word in words[start : start + words_per_line]
+        ]
+        carry = []
+        if start + words_per_line < len(words) and len(line[-1]) > 5:
+            if rng.random() < 0.3:
+                # Hyphenate the last word across the line break
+                cut = len(line[-1]) // 2
+                carry = [line[-1][cut:]]
+                line[-1] = line[-1][:cut] + "-"
+        separator = "   " if rng.random() < 0.3 else " "
+        lines.append(separator.join(line) + ("\u200b" if rng.random() < 0.2 else ""))
+        if rng.random() < 0.15:
+            lines.append(rng.choice(["| ~ ; ,", "' . ` _", "=== |", "-- ~"]))
+        if rng.random() < 0.1:
+            lines.append("." * int(rng.integers(10, 40)))
+    return "\n".join(lines)
+
+
+def make_synthetic_pdf(
+    path: str,
+    texts: List[str],
+    scanned_share: float = 0.3,
+    dpi: int = 150,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Typeset page texts into a PDF of page images, like a scanned bundle.
+
+    A share of the pages gets a gray background gradient and speckle noise to
+    imitate scans, so render profiles see both clean and noisy pages.
+
+    Args:
+        path (str): Destination PDF path.
+        texts (List[str]): One text per page.
+        scanned_share (float, optional): Share of pages that look scanned.
+        dpi (int, optional): Resolution of the page images.
+        seed (int, optional): Random seed.
+
+    Returns:
+        np.ndarray: Whether each page looks scanned.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = np.random.default_rng(seed)
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    font = ImageFont.load_default(size=dpi // 6)
+    line_height = dpi // 4
+    words_per_line = 9
+
+    pages = []
+    scanned = rng.random(len(texts)) < scanned_share
+    for text, is_scanned in zip(texts, scanned):
+        page = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(page)
+        words = text.split()
+        for line_number, start in enumerate(range(0, len(words), words_per_line)):
+            line = " ".join(words[start : start + words_per_line])
+            draw.text((dpi, dpi + line_number * line_height), line, fill=0, font=font)
+
+        if is_scanned:
+            pixels = np.asarray(page, dtype=np.float32)
+            shading = np.linspace(0, 70, width, dtype=np.float32)[None, :]
+            speckle = rng.normal(0, 12, pixels.shape).astype(np.float32)
+            pixels = np.clip(pixels - shading + speckle, 0, 255).astype(np.uint8)
+            page = Image.fromarray(pixels)
+        pages.append(page)
+
+    pages[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=pages[1:])
+    return scanned
@@ -0,0 +1,115 @@
+"""
+Measure what text preparation saves on noisy OCR text, and what it costs.
+
+Synthetic labeled bundles are made to look like raw OCR output, with a few
+very dense pages over the embedding input limit. Reports the page tokens before
+and after normalization, the topic prompt tokens before and after trimming to
+the budget, how many pages are chunked, and the preparation throughput. The
+bundle is embedded with a local model fitted on a separate corpus, from the raw
+texts and from the prepared, chunked and mean-pooled texts, to check that the
+boundary F1 of each segmentation strategy holds.
+
+Token counts are exact when tiktoken is installed and estimated otherwise. Run
+from the repository root:
+    python -m benchmarks.text_preparation
+"""
+
+import sys
+import time
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.metrics import boundary_scores
+from benchmarks.synthetic import add_ocr_noise, make_labeled_texts
+from src.splitter.ml_models.clustering import perform_segmentation
+from src.splitter.ml_models.embedding_backends import LocalEmbeddingBackend
+from src.splitter.processors.text_preparation import (TokenReport, chunk_texts,
+                                                      fit_to_budget,
+                                                      get_token_counter,
+                                                      mean_pool, prepare_texts)
+from src.splitter.settings import settings
+
+BUNDLE_DOCUMENTS = 300
+CORPUS_DOCUMENTS = 500
+DENSE_PAGE_EVERY = 50
+DENSE_PAGE_REPEATS = 80
+STRATEGIES = ("boundary", "optimal")
+SPLIT_LEVEL = 2.0
+
+
+def make_noisy_bundle():
+    """Return noisy page texts and their document labels."""
+    texts, labels = make_labeled_texts(n_documents=BUNDLE_DOCUMENTS, seed=7)
+    # Dense pages, e.g. small-print schedules, far over the embedding input limit
+    texts = [
+        " ".join([text] * DENSE_PAGE_REPEATS) if i % DENSE_PAGE_EVERY == 0 else text
+        for i, text in enumerate(texts)
+    ]
+    noisy = [add_ocr_noise(text, seed=i) for i, text in enumerate(texts)]
+    return noisy, labels
+
+
+def first_pages(labels: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+
+
+def main() -> None:
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    counter = get_token_counter(settings.EMBEDDING_MODEL)
+    topic_counter = get_token_counter(settings.TOPIC_MODEL)
+    print(f"Token counts: {'tiktoken' if counter.exact else 'estimated'}")
+
+    noisy, labels = make_noisy_bundle()
+    report = TokenReport()
+    start = time.perf_counter()
+    prepared = prepare_texts(noisy, report)
+    elapsed = time.perf_counter() - start
+    chunks, owners, weights = chunk_texts(
+        prepared, counter, settings.EMBEDDING_MAX_TOKENS
+    )
+    report.embedding_chunks = len(chunks)
+    report.chunked_pages = int((np.bincount(owners) > 1).sum())
+    for page in first_pages(labels):
+        report.topic_prompt_tokens += topic_counter.count(prepared[page])
+        report.topic_sent_tokens += topic_counter.count(
+            fit_to_budget([prepared[page]], topic_counter, settings.TOPIC_MAX_TOKENS)
+        )
+    print(
+        f"{len(noisy)} pages prepared in {elapsed:.2f}s "
+        f"({len(noisy) / elapsed:.0f} pages/s)"
+    )
+    print(
+        f"page tokens: {report.raw_tokens} raw, {report.normalized_tokens} "
+        f"normalized ({1 - report.normalized_tokens / report.raw_tokens:.1%} saved)"
+    )
+    print(
+        f"topic prompt tokens: {report.topic_prompt_tokens} untrimmed, "
+        f"{report.topic_sent_tokens} sent (budget {settings.TOPIC_MAX_TOKENS})"
+    )
+    print(
+        f"embedding inputs: {report.chunked_pages} pages over "
+        f"{settings.EMBEDDING_MAX_TOKENS} tokens chunked, {len(chunks)} inputs "
+        f"for {len(prepared)} pages"
+    )
+    print(f"tokens saved: {report.tokens_saved}\n")
+
+    corpus, _ = make_labeled_texts(n_documents=CORPUS_DOCUMENTS, seed=12345)
+    backend = LocalEmbeddingBackend(model_path=None).fit(corpus)
+    variants = {
+        "raw": backend.embed(noisy),
+        "prepared": mean_pool(backend.embed(chunks), owners, weights),
+    }
+    print(f"{'texts':>9} {'strategy':>9} {'F1':>6}")
+    for name, embeddings in variants.items():
+        for strategy in STRATEGIES:
+            predicted = perform_segmentation(
+                embeddings, strategy=strategy, split_level=SPLIT_LEVEL
+            )
+            scores = boundary_scores(labels, predicted)
+            print(f"{name:>9} {strategy:>9} {scores['f1']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import openai
+import redis
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .settings import settings
+
+T = TypeVar("T")
+
+# Refills the bucket for the time elapsed since the last call, then takes one
+# token if available. Returns 0 on success, else the seconds until a token is due.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RetryableError(Exception):
+    """An API call failed in a way that is worth retrying, e.g. HTTP 429 or 5xx."""
+
+    def __init__(
+        self,
+        message: str,
+        retry_after: Optional[float] = None,
+        throttled: bool = False,
+    ):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+class ServiceLimits(BaseModel):
+    requests_per_second: float = Field(
+        ..., description="Sustained request rate shared by all workers"
+    )
+    burst: int = Field(..., description="Requests allowed at once above the rate")
+    max_concurrency: int = Field(
+        ..., description="Upper bound on in-flight requests in this process"
+    )
+    target_latency: float = Field(
+        ..., description="Latency in seconds above which concurrency is reduced"
+    )
+
+
+def default_service_limits() -> Dict[str, ServiceLimits]:
+    """Build the limits of each outbound service from the settings."""
+    return {
+        "ocr": ServiceLimits(
+            requests_per_second=settings.OCR_REQUESTS_PER_SECOND,
+            burst=settings.OCR_MAX_CONCURRENCY,
+            max_concurrency=settings.OCR_MAX_CONCURRENCY,
+            target_latency=settings.OCR_TARGET_LATENCY,
+        ),
+        "textract": ServiceLimits(
+            requests_per_second=settings.TEXTRACT_REQUESTS_PER_SECOND,
+            burst=settings.TEXTRACT_MAX_CONCURRENCY,
+            max_concurrency=settings.TEXTRACT_MAX_CONCURRENCY,
+            target_latency=settings.TEXTRACT_TARGET_LATENCY,
+        ),
+        "embedding": ServiceLimits(
+            requests_per_second=settings.EMBEDDING_REQUESTS_PER_SECOND,
+            burst=settings.EMBEDDING_MAX_CONCURRENCY,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            target_latency=settings.EMBEDDING_TARGET_LATENCY,
+        ),
+        "topic": ServiceLimits(
+            requests_per_second=settings.TOPIC_REQUESTS_PER_SECOND,
+            burst=settings.TOPIC_MAX_CONCURRENCY,
+            max_concurrency=settings.TOPIC_MAX_CONCURRENCY,
+            target_latency=settings.TOPIC_TARGET_LATENCY,
+        ),
+    }
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    With a Redis connection the bucket state lives in Redis and is updated by an
+    atomic script, so every worker on every host draws from the same quota.
+    Without one, the bucket is local to this process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        capacity: int,
+        redis_conn: Optional[redis.Redis] = None,
+    ):
+        """Initialize the bucket, refilling `rate` tokens per second up to `capacity`."""
+        self.key = f"api_scheduler:bucket:{name}"
+        self.rate = rate
+        self.capacity = capacity
+        self.redis_conn = redis_conn
+        self._script = (
+            redis_conn.register_script(TOKEN_BUCKET_SCRIPT) if redis_conn else None
+        )
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated = time.time()
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available and return 0, else the seconds to wait."""
+        now = time.time()
+        if self._script is not None:
+            return float(
+                self._script(
+                    keys=[self.key], args=[self.rate, self.capacity, repr(now)]
+                )
+            )
+
+        with self._lock:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """Block until a token has been taken."""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits in-flight requests and adapts the limit with AIMD.
+
+    Every fast success raises the limit by 1/limit (about +1 per round trip), and
+    every throttled or slow response halves it, so concurrency settles just below
+    the point where the service starts pushing back.
+    """
+
+    def __init__(self, max_limit: int, target_latency: float, min_limit: int = 1):
+        """Initialize the limiter, starting at the maximum limit."""
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Block until a request slot is free."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float], throttled: bool) -> None:
+        """Free a slot and adapt the limit to the outcome of the request."""
+        with self._condition:
+            self.in_flight -= 1
+            if throttled or (latency is not None and latency > self.target_latency):
+                self.limit = max(self.min_limit, self.limit / 2)
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class ApiScheduler:
+    """
+    Central scheduler for outbound API calls.
+
+    Each call to a service waits for a token from the service's shared bucket and
+    a slot from its adaptive concurrency limit. Retryable failures are retried
+    with jittered exponential backoff that honors Retry-After.
+    """
+
+    def __init__(
+        self,
+        redis_conn: Optional[redis.Redis] = None,
+        service_limits: Optional[Dict[str, ServiceLimits]] = None,
+        max_retries: int = settings.API_MAX_RETRIES,
+        backoff_base: float = settings.API_BACKOFF_BASE_SECONDS,
+        backoff_max: float = settings.API_BACKOFF_MAX_SECONDS,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Initialize the scheduler with the limits of every service."""
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+        for name, limits in (service_limits or default_service_limits()).items():
+            self.buckets[name] = TokenBucket(
+                name, limits.requests_per_second, limits.burst, redis_conn
+            )
+            self.limiters[name] = AdaptiveConcurrencyLimiter(
+                limits.max_concurrency, limits.target_latency
+            )
+
+    def call(self, service: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call `fn` under the limits of the given service, retrying when allowed.
+
+        Args:
+            service (str): Name of the service, e.g. "ocr", "embedding" or "topic".
+            fn (Callable[..., T]): The function making the request. It should raise
+                RetryableError, or an OpenAI error, for failures worth retrying.
+
+        Returns:
+            T: The return value of `fn`.
+        """
+        bucket = self.buckets[service]
+        limiter = self.limiters[service]
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                error = as_retryable_error(e)
+                limiter.release(None, throttled=error is not None and error.throttled)
+                if error is None or attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, error.retry_after)
+                logger.warning(
+                    f"{service} call failed ({error}), retry {attempt + 1} of "
+                    f"{self.max_retries} in {delay:.1f}s"
+                )
+                self.sleep(delay)
+            else:
+                limiter.release(time.monotonic() - start, throttled=False)
+                return result
+        raise AssertionError("unreachable")
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2**attempt)
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def raise_for_retryable_status(response) -> None:
+    """Raise RetryableError for a throttled (429) or failed (5xx) HTTP response."""
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RetryableError(
+            f"HTTP {response.status_code}",
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            throttled=response.status_code == 429,
+        )
+
+
+def as_retryable_error(error: Exception) -> Optional[RetryableError]:
+    """Return the error as a RetryableError if it is worth retrying, else None."""
+    if isinstance(error, RetryableError):
+        return error
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429 or error.status_code >= 500:
+            return RetryableError(
+                f"HTTP {error.status_code}",
+                retry_after=parse_retry_after(
+                    error.response.headers.get("retry-after")
+                ),
+                throttled=error.status_code == 429,
+            )
+        return None
+    if isinstance(error, openai.APIConnectionError):
+        return RetryableError(str(error))
+    return None
+
+
+_scheduler: Optional[ApiScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ApiScheduler:
+    """Return the process-wide scheduler, sharing its buckets through Redis."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            redis_conn = None
+            if settings.REDIS_URL:
+                try:
+                    redis_conn = redis.from_url(settings.REDIS_URL)
+                    redis_conn.ping()
+                except redis.RedisError as e:
+                    logger.warning(
+                        f"Redis unavailable ({e}), API rate limits are per process."
+                    )
+                    redis_conn = None
+            _scheduler = ApiScheduler(redis_conn)
+        return _scheduler
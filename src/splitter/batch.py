@@ -0,0 +1,205 @@
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .pipeline import Pipeline
+from .processors.ocr_cache import OCRCache
+from .settings import settings
+from .workspace import Workspace
+
+MANIFEST_FILE_NAME = "manifest.jsonl"
+
+
+class BatchFileResult(BaseModel):
+    input_file: str = Field(..., description="The input PDF")
+    status: str = Field(..., description="'ok' or 'failed'")
+    page_count: int = Field(0, description="Pages extracted from the input")
+    document_count: int = Field(0, description="Documents the input was split into")
+    manifest_path: Optional[str] = Field(
+        None, description="The split manifest of the input"
+    )
+    output_files: List[str] = Field(
+        default_factory=list, description="The split documents that were written"
+    )
+    tokens_saved: int = Field(
+        0, description="Model input tokens saved by text preparation"
+    )
+    seconds: float = Field(..., description="Wall time spent on the file")
+    error: Optional[str] = Field(None, description="The error of a failed file")
+
+
+class BatchSummary(BaseModel):
+    files: int = Field(..., description="Input files processed")
+    failed: int = Field(..., description="Files that raised an error")
+    pages: int = Field(..., description="Pages extracted over all files")
+    documents: int = Field(..., description="Split documents over all files")
+    seconds: float = Field(..., description="Wall time of the whole batch")
+    pages_per_second: float = Field(..., description="Aggregate page throughput")
+    manifest_path: str = Field(..., description="The per-file results manifest")
+
+
+def collect_input_files(source: str) -> List[str]:
+    """
+    List the PDFs of a batch.
+
+    The source is either a directory, searched recursively for PDFs, or a
+    manifest file with one PDF path per line. Blank lines and lines starting with
+    '#' are skipped, and relative paths are resolved against the manifest.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            glob.glob(os.path.join(source, "**", "*.pdf"), recursive=True)
+            + glob.glob(os.path.join(source, "**", "*.PDF"), recursive=True)
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    input_files = []
+    with open(source, "r") as f:
+        for line in f:
+            path = line.strip()
+            if path and not path.startswith("#"):
+                input_files.append(os.path.join(base_dir, path))
+    return input_files
+
+
+class BatchRunner:
+    """
+    Runs the pipeline over many PDFs in one process.
+
+    Files share the OCR cache, one page executor for rendering and OCR, and the
+    process-wide OCR and embedding backends and API scheduler, so connection and
+    pool setup is paid once per batch instead of once per file. At most
+    `max_concurrent_files` files are in flight, each in its own workspace under
+    the output directory. A result line is appended to the manifest as soon as
+    each file finishes, so an interrupted batch still records its progress.
+    Without `materialize`, only each file's split manifest is written and the
+    PDFs can be produced later with a `SplitMaterializer`.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        distance_threshold: float,
+        strategy: str = settings.SEGMENTATION_STRATEGY,
+        ocr_backend: str = settings.OCR_BACKEND,
+        embedding_backend: str = settings.EMBEDDING_BACKEND,
+        max_concurrent_files: int = settings.BATCH_MAX_CONCURRENT_FILES,
+        page_workers: int = settings.BATCH_PAGE_WORKERS,
+        materialize: bool = True,
+    ):
+        """Initialize the runner with the pipeline options used for every file."""
+        self.output_dir = output_dir
+        self.distance_threshold = distance_threshold
+        self.strategy = strategy
+        self.ocr_backend = ocr_backend
+        self.embedding_backend = embedding_backend
+        self.max_concurrent_files = max_concurrent_files
+        self.page_workers = page_workers or None
+        self.materialize = materialize
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self._manifest_lock = threading.Lock()
+
+    def run(self, input_files: List[str]) -> BatchSummary:
+        """Process every input file and return the aggregate results."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        open(self.manifest_path, "w").close()
+        ocr_cache = OCRCache() if settings.OCR_CACHE_ENABLED else None
+
+        logger.info(
+            f"Processing {len(input_files)} files, "
+            f"{self.max_concurrent_files} at a time"
+        )
+        start = time.perf_counter()
+        with ThreadPoolExecutor(
+            self.page_workers, thread_name_prefix="pages"
+        ) as page_executor, ThreadPoolExecutor(
+            self.max_concurrent_files, thread_name_prefix="files"
+        ) as file_executor:
+            results = list(
+                file_executor.map(
+                    lambda item: self.process_file(*item, ocr_cache, page_executor),
+                    enumerate(input_files),
+                )
+            )
+        elapsed = time.perf_counter() - start
+        if ocr_cache is not None:
+            ocr_cache.close()
+
+        pages = sum(result.page_count for result in results)
+        summary = BatchSummary(
+            files=len(results),
+            failed=sum(result.status != "ok" for result in results),
+            pages=pages,
+            documents=sum(result.document_count for result in results),
+            seconds=elapsed,
+            pages_per_second=pages / elapsed if elapsed > 0 else 0.0,
+            manifest_path=self.manifest_path,
+        )
+        logger.info(
+            f"Batch done: {summary.files} files ({summary.failed} failed), "
+            f"{summary.pages} pages, {summary.documents} documents in "
+            f"{summary.seconds:.1f}s ({summary.pages_per_second:.2f} pages/s)"
+        )
+        return summary
+
+    def process_file(
+        self,
+        index: int,
+        input_file: str,
+        ocr_cache: Optional[OCRCache],
+        page_executor: ThreadPoolExecutor,
+    ) -> BatchFileResult:
+        """Run the pipeline on one file in its own workspace and record the result."""
+        file_name = os.path.splitext(os.path.basename(input_file))[0]
+        # The index keeps workspaces apart when files in different folders share a name
+        workspace = Workspace.for_job(
+            os.path.join(self.output_dir, f"{index:05d}_{file_name}")
+        )
+        pipeline = Pipeline(
+            input_file,
+            self.distance_threshold,
+            strategy=self.strategy,
+            ocr_backend=self.ocr_backend,
+            embedding_backend=self.embedding_backend,
+            workspace=workspace,
+            ocr_cache=ocr_cache,
+            executor=page_executor,
+        )
+        start = time.perf_counter()
+        try:
+            manifest = pipeline.run()
+            output_files = (
+                pipeline.create_pdf_documents(manifest) if self.materialize else []
+            )
+        except Exception as e:
+            logger.exception(f"Failed to process {input_file}")
+            result = BatchFileResult(
+                input_file=input_file,
+                status="failed",
+                page_count=pipeline.page_count,
+                seconds=time.perf_counter() - start,
+                error=f"{type(e).__name__}: {e}",
+            )
+        else:
+            result = BatchFileResult(
+                input_file=input_file,
+                status="ok",
+                page_count=pipeline.page_count,
+                document_count=len(manifest.documents),
+                manifest_path=workspace.manifest_path,
+                output_files=output_files,
+                tokens_saved=pipeline.token_report.tokens_saved,
+                seconds=time.perf_counter() - start,
+            )
+        workspace.clear_temp()
+
+        with self._manifest_lock:
+            with open(self.manifest_path, "a") as f:
+                f.write(result.model_dump_json() + "\n")
+        return result
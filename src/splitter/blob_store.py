@@ -0,0 +1,269 @@
+import hashlib
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Optional
+
+from loguru import logger
+
+from .settings import settings
+
+
+def copy_stream(
+    source: BinaryIO,
+    destination: BinaryIO,
+    chunk_size: int = settings.BLOB_CHUNK_BYTES,
+    digest: Optional["hashlib._Hash"] = None,
+) -> int:
+    """Copy a stream in fixed-size chunks, feeding the digest, and return the size."""
+    size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return size
+        if digest is not None:
+            digest.update(chunk)
+        destination.write(chunk)
+        size += len(chunk)
+
+
+class BlobStore(ABC):
+    """
+    Key-value storage for files shared by the web app and the workers.
+
+    Uploads and downloads are streamed in chunks, so no file is ever held in
+    memory whole. Content-addressed keys (see `put_content`) are derived from the
+    SHA-256 of the file, so the same file is stored once however often it is put.
+    """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Return whether a blob is stored under the key."""
+
+    @abstractmethod
+    def put_file(self, path: str, key: str) -> str:
+        """Store a local file under the key and return the key."""
+
+    @abstractmethod
+    def get_file(self, key: str, path: str) -> str:
+        """Download the blob to a local path and return the path."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete the blob if it exists."""
+
+    def put_stream(self, stream: BinaryIO, key: str) -> str:
+        """Store the contents of a binary stream under the key."""
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            copy_stream(stream, temp_file)
+        try:
+            return self.put_file(temp_file.name, key)
+        finally:
+            os.remove(temp_file.name)
+
+    def put_content(self, stream: BinaryIO, prefix: str, suffix: str = "") -> str:
+        """
+        Store a stream under a key derived from its content and return the key.
+
+        The stream is hashed while it is spooled to a temporary file, and only
+        uploaded if no blob with the same content is stored yet.
+        """
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            copy_stream(stream, temp_file, digest=digest)
+        key = f"{prefix}/{digest.hexdigest()}{suffix}"
+        try:
+            if self.exists(key):
+                logger.info(f"Blob {key} is already stored.")
+            else:
+                self.put_file(temp_file.name, key)
+        finally:
+            os.remove(temp_file.name)
+        return key
+
+    def get_cached_file(
+        self,
+        key: str,
+        cache_dir: str = settings.BLOB_CACHE_DIR,
+        max_bytes: int = settings.BLOB_CACHE_MAX_BYTES,
+    ) -> str:
+        """
+        Return a local copy of the blob, downloading it only on the first call.
+
+        Only use this for keys that are never overwritten, such as content-
+        addressed keys, as a cached copy is never refreshed. After a download, the
+        least recently used copies are removed until the cache is within
+        `max_bytes`.
+        """
+        path = os.path.join(cache_dir, *key.split("/"))
+        try:
+            # The modification time records the last use for the eviction
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        self.get_file(key, temp_path)
+        os.replace(temp_path, path)
+        evict_cached_files(cache_dir, max_bytes, keep=path)
+        return path
+
+
+def evict_cached_files(cache_dir: str, max_bytes: int, keep: str = "") -> None:
+    """Remove the least recently used files until the cache is within `max_bytes`."""
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            # Downloads in progress are not part of the cache yet
+            if name.endswith(".tmp") or path == keep:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if keep and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        logger.info(f"Evicted {path} from the blob cache")
+        if total <= max_bytes:
+            return
+
+
+class LocalBlobStore(BlobStore):
+    """Blob store in a local directory, for a single host or a shared volume."""
+
+    def __init__(self, root: str = settings.BLOB_STORE_PATH):
+        """Initialize the store with its root directory."""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def put_file(self, path: str, key: str) -> str:
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Copy next to the target and rename, so readers never see a partial blob
+        temp_target = f"{target}.{threading.get_ident()}.tmp"
+        with open(path, "rb") as source, open(temp_target, "wb") as destination:
+            copy_stream(source, destination)
+        os.replace(temp_target, target)
+        return key
+
+    def get_file(self, key: str, path: str) -> str:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(self._path(key), "rb") as source, open(path, "wb") as destination:
+            copy_stream(source, destination)
+        return path
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(BlobStore):
+    """
+    Blob store in an S3 bucket. Requires boto3.
+
+    Any S3-compatible service works, e.g. MinIO or a local stand-in, by setting
+    the endpoint URL. Files larger than the chunk size are transferred as
+    multipart uploads and ranged downloads of that size.
+    """
+
+    def __init__(
+        self,
+        bucket: str = settings.S3_BUCKET,
+        prefix: str = settings.S3_PREFIX,
+        endpoint_url: str = settings.S3_ENDPOINT_URL,
+        chunk_size: int = settings.BLOB_CHUNK_BYTES,
+    ):
+        """Initialize the store with the bucket, key prefix and endpoint."""
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set to use the S3 blob store")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None,
+            region_name=settings.AWS_REGION or None,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunk_size, multipart_chunksize=chunk_size
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def put_file(self, path: str, key: str) -> str:
+        self.client.upload_file(
+            path, self.bucket, self._key(key), Config=self.transfer_config
+        )
+        return key
+
+    def put_stream(self, stream: BinaryIO, key: str) -> str:
+        self.client.upload_fileobj(
+            stream, self.bucket, self._key(key), Config=self.transfer_config
+        )
+        return key
+
+    def get_file(self, key: str, path: str) -> str:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.client.download_file(
+            self.bucket, self._key(key), path, Config=self.transfer_config
+        )
+        return path
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+BLOB_STORES = {"local": LocalBlobStore, "s3": S3BlobStore}
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Return the process-wide blob store selected by BLOB_STORE."""
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            if settings.BLOB_STORE not in BLOB_STORES:
+                raise ValueError(f"Unknown blob store: {settings.BLOB_STORE}")
+            _blob_store = BLOB_STORES[settings.BLOB_STORE]()
+        return _blob_store
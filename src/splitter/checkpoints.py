@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field, ValidationError
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_key(*parts) -> str:
+    """Hash the inputs and parameters of a stage into its checkpoint key."""
+    encoded = json.dumps([str(part) for part in parts]).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def write_json_atomic(path: str, data) -> None:
+    """Write JSON to a temporary file and rename it over the target."""
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class StageCheckpoint(BaseModel):
+    stage: str = Field(..., description="Name of the completed stage")
+    key: str = Field(..., description="Hash of the stage's inputs and parameters")
+    files: Dict[str, str] = Field(
+        ..., description="SHA-256 of every output file of the stage, by path"
+    )
+
+    @property
+    def digest(self) -> str:
+        """Hash of the stage's outputs, used in the key of the stages that follow."""
+        return checkpoint_key(self.key, sorted(self.files.items()))
+
+
+class PageJournal:
+    """
+    Append-only record of the pages whose text has been written.
+
+    Each line holds a page's text file and its SHA-256. A page only counts as
+    done while its file still matches, so a page interrupted while being written
+    is extracted again. The journal belongs to one stage key and is discarded
+    when the key changes.
+    """
+
+    def __init__(self, path: str, key: str):
+        """Open the journal, dropping it if it was written for another key."""
+        self.path = path
+        self.key = key
+        self._lock = threading.Lock()
+        self._pages: Dict[str, str] = {}
+        if os.path.exists(path):
+            self._pages = self._read()
+        if not self._pages:
+            with open(path, "w") as f:
+                f.write(json.dumps({"key": key}) + "\n")
+
+    def _read(self) -> Dict[str, str]:
+        pages = {}
+        with open(self.path, "r") as f:
+            lines = f.read().splitlines()
+        try:
+            if json.loads(lines[0]).get("key") != self.key:
+                return {}
+        except (IndexError, ValueError):
+            return {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line torn by an interrupted write
+                continue
+            pages[entry["path"]] = entry["sha256"]
+        return pages
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def is_done(self, path: str) -> bool:
+        """Return whether the page's text file was recorded and is unchanged."""
+        sha256 = self._pages.get(path)
+        if sha256 is None or not os.path.exists(path):
+            return False
+        return file_sha256(path) == sha256
+
+    def record(self, path: str) -> None:
+        """Record the page's text file as written."""
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._pages[path] = sha256
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"path": path, "sha256": sha256}) + "\n")
+                f.flush()
+
+
+class CheckpointStore:
+    """
+    Checkpoints of the completed stages of a pipeline run, in its workspace.
+
+    A stage is saved with the key of its inputs and the SHA-256 of its output
+    files. Loading returns the checkpoint only when the key matches and every
+    file is unchanged, so a rerun with other inputs or parameters, or after a
+    file was lost or half written, redoes the stage instead of using bad data.
+    """
+
+    def __init__(self, directory: str):
+        """Initialize the store with the directory the records are kept in."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _record_path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.checkpoint.json")
+
+    def data_path(self, name: str) -> str:
+        """Return the path of a checkpoint data file, e.g. the page labels."""
+        return os.path.join(self.directory, name)
+
+    def load(self, stage: str, key: str) -> Optional[StageCheckpoint]:
+        """Return the stage's checkpoint if it is valid for the key."""
+        path = self._record_path(stage)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                checkpoint = StageCheckpoint(**json.load(f))
+        except (ValueError, ValidationError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+        if checkpoint.key != key:
+            logger.info(f"Checkpoint of stage {stage} is for other inputs.")
+            return None
+        for file_path, sha256 in checkpoint.files.items():
+            if not os.path.exists(file_path) or file_sha256(file_path) != sha256:
+                logger.warning(f"Checkpoint of stage {stage}: {file_path} changed.")
+                return None
+        logger.info(f"Resuming from the checkpoint of stage {stage}.")
+        return checkpoint
+
+    def save(self, stage: str, key: str, files: Iterable[str]) -> StageCheckpoint:
+        """Record the stage as completed with its output files."""
+        checkpoint = StageCheckpoint(
+            stage=stage, key=key, files={path: file_sha256(path) for path in files}
+        )
+        write_json_atomic(self._record_path(stage), checkpoint.model_dump())
+        return checkpoint
+
+    def load_data(self, name: str):
+        """Read a JSON data file written by `save_data`."""
+        with open(self.data_path(name), "r") as f:
+            return json.load(f)
+
+    def save_data(self, name: str, data) -> str:
+        """Write a JSON data file atomically and return its path."""
+        path = self.data_path(name)
+        write_json_atomic(path, data)
+        return path
+
+    def page_journal(self, key: str) -> PageJournal:
+        """Return the page journal of the text extraction for the key."""
+        return PageJournal(self.data_path("pages.jsonl"), key)
@@ -1,4 +1,7 @@
-from typing import List, Tuple
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
 
 import numpy as np
 from pydantic import BaseModel, Field
@@ -26,3 +29,76 @@ class Document(BaseModel):
     page_range: Tuple[int, int] = Field(
         ..., description="Tuple indicating the range of pages in the document"
     )
+
+
+class PriorMatch(BaseModel):
+    job_id: str = Field(..., description="The job that indexed the earlier bundle")
+    source: str = Field(..., description="The file name of the earlier bundle")
+    document_id: Optional[int] = Field(
+        None, description="The matching document of the earlier split, if known"
+    )
+    topic_name: Optional[str] = Field(
+        None, description="Topic of the matching document, if known"
+    )
+    matched_pages: int = Field(
+        ..., description="Pages of this document that were seen in the earlier one"
+    )
+    similarity: float = Field(
+        ..., description="Mean cosine similarity of the matched pages"
+    )
+
+
+class SplitDocument(BaseModel):
+    id: int = Field(..., description="Position of the document in the split")
+    topic_name: str = Field(..., description="Topic of the set of pages")
+    page_ranges: List[Tuple[int, int]] = Field(
+        ...,
+        description="Inclusive ranges of consecutive input page numbers, in order",
+    )
+    prior_matches: List[PriorMatch] = Field(
+        default_factory=list,
+        description="Documents of earlier bundles with the same pages, best first",
+    )
+
+    @property
+    def page_numbers(self) -> List[int]:
+        return [
+            page for start, end in self.page_ranges for page in range(start, end + 1)
+        ]
+
+    @property
+    def file_name(self) -> str:
+        return f"document_{self.id}_{self.topic_name}.pdf"
+
+
+class SplitManifest(BaseModel):
+    input_file: str = Field(..., description="The path to the input PDF file")
+    input_key: Optional[str] = Field(
+        None, description="The blob store key of the input PDF, if it was uploaded"
+    )
+    page_count: int = Field(..., description="The number of pages in the input")
+    documents: List[SplitDocument] = Field(
+        ..., description="The split documents, ordered by their first page"
+    )
+
+    @property
+    def digest(self) -> str:
+        """A short hash identifying this split, e.g. to key its output files."""
+        # Matches depend on what was indexed before, not on the split itself
+        split = self.model_dump_json(
+            exclude={"documents": {"__all__": {"prior_matches"}}}
+        )
+        return hashlib.sha256(split.encode()).hexdigest()[:16]
+
+    def save(self, path: str) -> None:
+        """Write the manifest as JSON, replacing any earlier manifest atomically."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.model_dump_json(indent=2))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SplitManifest":
+        with open(path, "r") as f:
+            return cls(**json.load(f))
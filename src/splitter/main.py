@@ -1,5 +1,13 @@
+import glob
+import os
+
 import typer
+from loguru import logger
 
+from .batch import BatchRunner, collect_input_files
+from .ml_models.embedding_backends import (LocalEmbeddingBackend,
+                                           get_embedding_backend)
+from .ml_models.page_index import delete_job_pages, open_page_index
 from .pipeline import Pipeline
 from .settings import settings
 
@@ -7,16 +15,137 @@ app = typer.Typer()
 
 
 @app.command()
-def run_pipeline(input_file: str = settings.PDF_INPUT_PATH):
+def run_pipeline(
+    input_file: str = settings.PDF_INPUT_PATH,
+    distance_threshold: float = 2.0,
+    strategy: str = settings.SEGMENTATION_STRATEGY,
+    ocr_backend: str = settings.OCR_BACKEND,
+    embedding_backend: str = settings.EMBEDDING_BACKEND,
+    resume: bool = False,
+):
     """
     Run the document processing pipeline.
 
     Args:
         input_file (str): Path to the input PDF file.
-        clear_cache (bool): Whether to clear the cache before running the pipeline.
+        distance_threshold (float): Split level passed to the segmentation strategy.
+        strategy (str): Segmentation strategy.
+        ocr_backend (str): OCR backend name or route.
+        embedding_backend (str): Embedding backend name.
+        resume (bool): Resume an interrupted run from its checkpoints instead of
+            starting over.
+    """
+    pipeline = Pipeline(
+        input_file,
+        distance_threshold,
+        strategy=strategy,
+        ocr_backend=ocr_backend,
+        embedding_backend=embedding_backend,
+    )
+    manifest = pipeline.run(clear_cache=not resume)
+    output_files = pipeline.create_pdf_documents(manifest)
+    output_dir = os.path.join(pipeline.workspace.output_docs_dir, manifest.digest)
+    logger.info(f"Wrote {len(output_files)} documents to {output_dir}")
+
+
+@app.command()
+def run_batch(
+    source: str,
+    output_dir: str = "data/batch",
+    distance_threshold: float = 2.0,
+    strategy: str = settings.SEGMENTATION_STRATEGY,
+    ocr_backend: str = settings.OCR_BACKEND,
+    embedding_backend: str = settings.EMBEDDING_BACKEND,
+    max_concurrent_files: int = settings.BATCH_MAX_CONCURRENT_FILES,
+    materialize: bool = True,
+):
+    """
+    Run the pipeline over a directory of PDFs, or a file listing one PDF per line.
+
+    Args:
+        source (str): Directory searched recursively for PDFs, or a list of paths.
+        output_dir (str): Where each file's documents and the manifest are written.
+        distance_threshold (float): Split level passed to the segmentation strategy.
+        strategy (str): Segmentation strategy.
+        ocr_backend (str): OCR backend name or route.
+        embedding_backend (str): Embedding backend name.
+        max_concurrent_files (int): Files processed at once.
+        materialize (bool): Write the split PDFs, not only each file's manifest.
+    """
+    input_files = collect_input_files(source)
+    if not input_files:
+        raise typer.BadParameter(f"No PDFs found in {source}")
+
+    summary = BatchRunner(
+        output_dir,
+        distance_threshold,
+        strategy=strategy,
+        ocr_backend=ocr_backend,
+        embedding_backend=embedding_backend,
+        max_concurrent_files=max_concurrent_files,
+        materialize=materialize,
+    ).run(input_files)
+    typer.echo(summary.model_dump_json(indent=2))
+    if summary.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def fit_local_embeddings(
+    text_dir: str, output_path: str = settings.LOCAL_EMBEDDING_MODEL_PATH
+):
+    """
+    Fit the local embedding model on a stored corpus of page texts.
+
+    Args:
+        text_dir (str): Directory searched recursively for .txt page texts.
+        output_path (str): Where to store the fitted model.
+    """
+    texts = []
+    for path in sorted(
+        glob.glob(os.path.join(text_dir, "**", "*.txt"), recursive=True)
+    ):
+        with open(path, "r") as f:
+            text = f.read()
+        if text.strip():
+            texts.append(text)
+    if not texts:
+        raise typer.BadParameter(f"No page texts found in {text_dir}")
+
+    logger.info(f"Fitting the local embedding model on {len(texts)} pages")
+    LocalEmbeddingBackend(model_path=None).fit(texts).save(output_path)
+    logger.info(f"Saved the local embedding model to {output_path}")
+
+
+@app.command()
+def train_page_index(
+    embedding_backend: str = settings.EMBEDDING_BACKEND,
+    lists: int = settings.PAGE_INDEX_IVF_LISTS,
+    sample_pages: int = settings.PAGE_INDEX_TRAIN_PAGES,
+):
+    """
+    Fit the IVF lists of the page index, so that searches scan only a few lists.
+
+    Args:
+        embedding_backend (str): Embedding backend whose page index is trained.
+        lists (int): Number of IVF lists.
+        sample_pages (int): Indexed pages the lists are fitted on.
+    """
+    model = get_embedding_backend(embedding_backend).model
+    open_page_index(model).train(lists, sample_pages)
+    logger.info(f"Trained the page index of {model} with {lists} lists")
+
+
+@app.command()
+def delete_indexed_job(job_id: str):
+    """
+    Delete the pages a job added to the page index.
+
+    Args:
+        job_id (str): The web job ID, or the SHA-256 of the input of a CLI run.
     """
-    pipeline = Pipeline(input_file)
-    pipeline.run()
+    if not delete_job_pages(job_id):
+        raise typer.BadParameter(f"No indexed pages of job {job_id}")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,17 @@
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
 
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
-from sklearn.cluster import AgglomerativeClustering
-from sklearn.metrics.pairwise import cosine_similarity
+from loguru import logger
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import pdist
+
+from ..settings import settings
+
+SEGMENTATION_STRATEGIES = ("agglomerative", "boundary", "optimal")
+# Maps the default split level of 2.0 to the boundary detection threshold of 0.4
+BOUNDARY_THRESHOLD_PER_SPLIT_LEVEL = 0.2
+# Maps the default split level of 2.0 to an optimal segmentation penalty of 1.0
+OPTIMAL_PENALTY_PER_SPLIT_LEVEL = 0.5
 
 
 def custom_distance(
@@ -27,6 +35,62 @@ def custom_distance(
     return float(alpha * embedding_distance + (1 - alpha) * page_distance)
 
 
+def pairwise_distances(embeddings: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the embedding and page distances between every pair of pages.
+
+    The custom distance of any alpha is a weighted sum of the two, so they are
+    computed once and reused for every alpha, e.g. across a parameter grid.
+
+    Args:
+        embeddings (List[np.ndarray]): List of page embeddings in page order.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The condensed Euclidean embedding distances
+            and the condensed page distances, in `pdist` order.
+    """
+    points = np.asarray(embeddings, dtype=np.float64)
+    page_numbers = np.arange(len(points), dtype=np.float64).reshape(-1, 1)
+    return pdist(points), pdist(page_numbers, "cityblock")
+
+
+def agglomerative_linkage(
+    embedding_distances: np.ndarray, page_distances: np.ndarray, alpha: float = 0.85
+) -> np.ndarray:
+    """
+    Build the average linkage merge tree under the custom distance.
+
+    Args:
+        embedding_distances (np.ndarray): Condensed embedding distances from `pairwise_distances`.
+        page_distances (np.ndarray): Condensed page distances from `pairwise_distances`.
+        alpha (float, optional): Weighting factor between embedding distance and page distance. Defaults to 0.85.
+
+    Returns:
+        np.ndarray: The linkage matrix, which `cut_linkage` cuts at any threshold.
+    """
+    distances = alpha * embedding_distances + (1 - alpha) * page_distances
+    return linkage(distances, method="average")
+
+
+def cut_linkage(linkage_matrix: np.ndarray, distance_threshold: float) -> np.ndarray:
+    """
+    Form flat clusters from a merge tree.
+
+    Clusters are merged only while their distance is below the threshold, as in
+    scikit-learn's AgglomerativeClustering with `distance_threshold`.
+
+    Args:
+        linkage_matrix (np.ndarray): The linkage matrix from `agglomerative_linkage`.
+        distance_threshold (float): Threshold to apply when forming flat clusters.
+
+    Returns:
+        np.ndarray: The cluster label of each page, starting at 0.
+    """
+    # fcluster also merges at exactly the threshold
+    threshold = np.nextafter(distance_threshold, -np.inf)
+    return fcluster(linkage_matrix, threshold, criterion="distance") - 1
+
+
 def perform_agglomerative_clustering(
     embeddings: List[np.ndarray],
     alpha: float = 0.85,
@@ -35,6 +99,9 @@ def perform_agglomerative_clustering(
     """
     Perform agglomerative clustering on the given embeddings with a custom distance metric.
 
+    The distance between two pages is `custom_distance`, computed for all pairs at
+    once with vectorized `pdist` metrics.
+
     Args:
         embeddings (List[np.ndarray]): List of embeddings to cluster.
         alpha (float, optional): Weighting factor between embedding distance and page distance. Defaults to 0.85.
@@ -43,23 +110,103 @@ def perform_agglomerative_clustering(
     Returns:
         np.ndarray: The final clustering labels after post-processing.
     """
-    page_numbers = np.arange(len(embeddings)).reshape(-1, 1)
-    embeddings_with_pages = np.hstack((page_numbers, np.array(embeddings)))
+    if len(embeddings) < 2:
+        return np.zeros(len(embeddings), dtype=int)
 
-    # Compute the custom distance matrix
-    distance_matrix = squareform(
-        pdist(embeddings_with_pages, lambda x, y: custom_distance(x, y, alpha))
-    )
+    embedding_distances, page_distances = pairwise_distances(embeddings)
+    linkage_matrix = agglomerative_linkage(embedding_distances, page_distances, alpha)
+    return cut_linkage(linkage_matrix, distance_threshold)
 
-    clustering = AgglomerativeClustering(
-        n_clusters=None,
-        distance_threshold=distance_threshold,
-        metric="precomputed",
-        linkage="average",
-    )
-    labels = clustering.fit_predict(distance_matrix)
 
-    return labels
+class BoundaryDetector:
+    """
+    Online boundary detection over a stream of page embeddings.
+
+    A new segment starts whenever a page's cosine similarity to the running
+    average of the current segment drops below `1 - threshold`. Only the running
+    sum of the current segment and its squared norm are kept, so memory is O(d)
+    whatever the number of pages, and each page costs a single dot product.
+    """
+
+    def __init__(self, threshold: float = 0.4):
+        """Initialize the detector with the threshold for starting a new segment."""
+        self.threshold = threshold
+        self.page_count = 0
+        self.segment_start = 0
+        self._sum: np.ndarray | None = None
+        self._sum_norm_sq = 0.0
+
+    def add(self, embedding: np.ndarray) -> Tuple[int, int] | None:
+        """
+        Add the next page and return the segment it closed, if any.
+
+        Args:
+            embedding (np.ndarray): The embedding of the next page.
+
+        Returns:
+            Tuple[int, int] | None: The (first, last) page numbers of the segment
+                that ended before this page, or None if the page continues it.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        page_number = self.page_count
+        self.page_count += 1
+        norm_sq = float(embedding @ embedding)
+
+        if self._sum is None:
+            self._start_segment(page_number, embedding, norm_sq)
+            return None
+
+        # The segment average points the same way as its sum
+        dot = float(embedding @ self._sum)
+        denominator = np.sqrt(norm_sq * self._sum_norm_sq)
+        similarity = dot / denominator if denominator > 0 else 0.0
+
+        if similarity < (1 - self.threshold):
+            closed = (self.segment_start, page_number - 1)
+            self._start_segment(page_number, embedding, norm_sq)
+            return closed
+
+        self._sum += embedding
+        self._sum_norm_sq += 2 * dot + norm_sq
+        return None
+
+    def close(self) -> Tuple[int, int] | None:
+        """Close and return the last open segment, if any pages were added."""
+        if self._sum is None:
+            return None
+        closed = (self.segment_start, self.page_count - 1)
+        self._sum = None
+        self._sum_norm_sq = 0.0
+        return closed
+
+    def _start_segment(
+        self, page_number: int, embedding: np.ndarray, norm_sq: float
+    ) -> None:
+        self.segment_start = page_number
+        self._sum = embedding.copy()
+        self._sum_norm_sq = norm_sq
+
+
+def iter_boundary_segments(
+    embeddings: Iterable[np.ndarray], threshold: float = 0.4
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yield the (first, last) page numbers of each segment as soon as it closes.
+
+    Args:
+        embeddings (Iterable[np.ndarray]): Page embeddings in page order. They can
+            be produced lazily, e.g. rows of a memory-mapped matrix.
+        threshold (float, optional): Threshold for the change in average embedding
+            value to start a new segment. Defaults to 0.4.
+    """
+    detector = BoundaryDetector(threshold)
+    for embedding in embeddings:
+        closed = detector.add(embedding)
+        if closed is not None:
+            yield closed
+    closed = detector.close()
+    if closed is not None:
+        yield closed
 
 
 def perform_boundary_detection_clustering(
@@ -81,35 +228,122 @@ def perform_boundary_detection_clustering(
         threshold = 0.4
 
     labels = np.zeros(len(embeddings), dtype=int)
-    current_cluster = 0
-    current_sum = embeddings[0]
-    current_count = 1
-    current_avg = current_sum / current_count
-
-    for i in range(1, len(embeddings)):
-        new_sum = current_sum + embeddings[i]
-        new_avg = new_sum / (current_count + 1)
-
-        # Calculate cosine similarity
-        similarity = cosine_similarity(
-            np.array([embeddings[i]]), np.array([current_avg])
-        )[0][0]
-
-        if similarity < (1 - threshold):  # Cosine similarity ranges from -1 to 1
-            current_cluster += 1
-            current_sum = embeddings[i]
-            current_count = 1
-            current_avg = current_sum / current_count
-        else:
-            current_sum = new_sum
-            current_count += 1
-            current_avg = new_avg
-
-        labels[i] = current_cluster
+    for cluster, (first, last) in enumerate(
+        iter_boundary_segments(embeddings, threshold)
+    ):
+        labels[first : last + 1] = cluster
 
     return labels
 
 
+def perform_optimal_segmentation(
+    embeddings: List[np.ndarray],
+    penalty: float = 1.0,
+    max_segment_length: int = settings.OPTIMAL_MAX_SEGMENT_LENGTH,
+) -> np.ndarray:
+    """
+    Find the cost-optimal split of the page sequence into contiguous segments.
+
+    The cost of a segment is the sum of squared distances of its embeddings to the
+    segment mean, and every segment adds a fixed penalty. Segment costs are O(1)
+    from cumulative sums, and dynamic programming over segments of at most
+    `max_segment_length` pages runs in O(n * L) with a vectorized inner loop.
+    Unlike clustering, the result is always contiguous, so no post-processing is
+    needed. A document longer than `max_segment_length` pages is split into
+    several segments, and a warning is logged when a segment reaches the limit.
+
+    Args:
+        embeddings (List[np.ndarray]): List of page embeddings in page order.
+        penalty (float, optional): Cost of starting a new segment. Higher values give fewer, larger segments. Defaults to 1.0.
+        max_segment_length (int, optional): Maximum number of pages in a segment. Defaults to settings.OPTIMAL_MAX_SEGMENT_LENGTH.
+
+    Returns:
+        np.ndarray: The segment label of each page.
+    """
+    points = np.asarray(embeddings, dtype=np.float64)
+    n_pages = len(points)
+    if n_pages == 0:
+        return np.zeros(0, dtype=int)
+
+    # prefix_sum[i] is the sum of the first i embeddings, likewise for squared norms
+    prefix_sum = np.zeros((n_pages + 1, points.shape[1]))
+    np.cumsum(points, axis=0, out=prefix_sum[1:])
+    prefix_norm_sq = np.concatenate(
+        ([0.0], np.cumsum(np.einsum("ij,ij->i", points, points)))
+    )
+    prefix_sum_norm_sq = np.einsum("ij,ij->i", prefix_sum, prefix_sum)
+
+    best_cost = np.zeros(n_pages + 1)
+    best_start = np.zeros(n_pages + 1, dtype=int)
+    for end in range(1, n_pages + 1):
+        starts = np.arange(max(0, end - max_segment_length), end)
+        lengths = end - starts
+        # |S[end] - S[start]|^2 expanded so the inner loop is one matrix-vector product
+        segment_sum_norm_sq = (
+            prefix_sum_norm_sq[end]
+            - 2 * (prefix_sum[starts] @ prefix_sum[end])
+            + prefix_sum_norm_sq[starts]
+        )
+        dispersion = (
+            prefix_norm_sq[end] - prefix_norm_sq[starts]
+        ) - segment_sum_norm_sq / lengths
+        costs = best_cost[starts] + np.maximum(dispersion, 0.0) + penalty
+        best = int(np.argmin(costs))
+        best_cost[end] = costs[best]
+        best_start[end] = starts[best]
+
+    # Walk back from the last page to recover the segment starts
+    boundaries = []
+    end = n_pages
+    while end > 0:
+        boundaries.append(best_start[end])
+        end = best_start[end]
+    lengths = np.diff(np.append(boundaries[::-1], n_pages))
+    if lengths.max() >= max_segment_length:
+        logger.warning(
+            f"Segments are limited to {max_segment_length} pages, longer documents "
+            "are split (see OPTIMAL_MAX_SEGMENT_LENGTH)"
+        )
+    labels = np.zeros(n_pages, dtype=int)
+    labels[np.array(boundaries[:-1], dtype=int)] = 1
+    return np.cumsum(labels)
+
+
+def perform_segmentation(
+    embeddings: List[np.ndarray],
+    strategy: str = "agglomerative",
+    split_level: float = 2.0,
+) -> np.ndarray:
+    """
+    Split the pages into documents with the given strategy.
+
+    The split level is the user-facing granularity knob: lower values give more,
+    smaller documents with every strategy.
+
+    Args:
+        embeddings (List[np.ndarray]): List of page embeddings in page order.
+        strategy (str, optional): One of SEGMENTATION_STRATEGIES. Defaults to "agglomerative".
+        split_level (float, optional): Granularity of the split. Defaults to 2.0.
+
+    Returns:
+        np.ndarray: The document label of each page.
+    """
+    if strategy == "agglomerative":
+        return perform_agglomerative_clustering(
+            embeddings, distance_threshold=split_level
+        )
+    elif strategy == "boundary":
+        return perform_boundary_detection_clustering(
+            embeddings, threshold=split_level * BOUNDARY_THRESHOLD_PER_SPLIT_LEVEL
+        )
+    elif strategy == "optimal":
+        return perform_optimal_segmentation(
+            embeddings, penalty=split_level * OPTIMAL_PENALTY_PER_SPLIT_LEVEL
+        )
+    else:
+        raise ValueError(f"Unknown segmentation strategy: {strategy}")
+
+
 def post_process_labels(labels: np.ndarray, page_gap_threshold: int) -> np.ndarray:
     """
     Post-process the clustering labels to split clusters with large page gaps.
@@ -1,49 +1,313 @@
+import json
 import os
-import pickle
-from typing import List
+import struct
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 from loguru import logger
-from openai import OpenAI
+from pydantic import BaseModel, Field
 
+from ..processors.text_preparation import (TokenReport, chunk_texts,
+                                           get_token_counter, mean_pool)
 from ..settings import settings
+from .embedding_backends import get_embedding_backend
 
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+EMBEDDINGS_MAGIC = b"SPLEMB01"
+EMBEDDINGS_ALIGNMENT = 64
+STORAGE_DTYPES = ("float32", "float16", "int8")
 
 
-def generate_embeddings(input_file: str, texts: List[str]) -> List[np.ndarray]:
-    """Generate embeddings for a list of texts, or load from file if it exists."""
+class EmbeddingsHeader(BaseModel):
+    model: str = Field(..., description="The model that produced the embeddings")
+    dimension: int = Field(..., description="The length of each embedding vector")
+    page_count: int = Field(..., description="The number of pages (matrix rows)")
+    dtype: str = Field(..., description="Storage dtype: float32, float16 or int8")
+    scales_offset: int = Field(
+        0, description="Byte offset of the per-row int8 scales, 0 if unused"
+    )
+    data_offset: int = Field(..., description="Byte offset of the embedding matrix")
+
+
+def get_embeddings_file_path(input_file: str, directory: str = "data") -> str:
+    """Return the path of the embeddings file belonging to the input file."""
     input_file_name = os.path.basename(input_file)
     input_file_name_without_ext = os.path.splitext(input_file_name)[0]
-    embeddings_file_path = (
-        f"data/{input_file_name_without_ext}_{settings.EMBEDDINGS_FILE_SUFFIX}"
+    return os.path.join(
+        directory, f"{input_file_name_without_ext}_{settings.EMBEDDINGS_FILE_SUFFIX}"
     )
 
+
+def generate_embeddings(
+    input_file: str,
+    texts: List[str],
+    backend: str = settings.EMBEDDING_BACKEND,
+    directory: str = "data",
+    max_tokens: int = settings.EMBEDDING_MAX_TOKENS,
+    report: Optional[TokenReport] = None,
+) -> np.ndarray:
+    """
+    Generate embeddings for a list of page texts, or load from file if it exists.
+
+    Only distinct non-empty texts are embedded. Pages with identical text
+    (near-duplicates given their first copy's text by the page filter) share one
+    embedding, and pages without text (blank pages) take the embedding of the
+    closest preceding page, so they stay with the document they belong to.
+    Texts over `max_tokens` are embedded in chunks, whose embeddings are
+    mean-pooled into the page's embedding. The returned matrix is always the one
+    read back from the embeddings file, in its storage dtype (int8 dequantized).
+
+    Args:
+        input_file (str): The input PDF the texts were extracted from.
+        texts (List[str]): The text of every page.
+        backend (str, optional): Name of the embedding backend, "openai" or
+            "local". A stored file written by another model is regenerated.
+        directory (str, optional): Directory of the embeddings file.
+        max_tokens (int, optional): Token limit of each text sent to the model.
+        report (Optional[TokenReport], optional): Receives the chunk counts.
+
+    Returns:
+        np.ndarray: Memory-mapped matrix with one row per page.
+    """
+    input_file_name = os.path.basename(input_file)
+    embeddings_file_path = get_embeddings_file_path(input_file, directory)
+    embedding_backend = get_embedding_backend(backend)
+
     if os.path.exists(embeddings_file_path):
-        logger.info(f"Loading existing embeddings from {embeddings_file_path}")
-        with open(embeddings_file_path, "rb") as f:
-            return pickle.load(f)
+        stored_model = read_embeddings_header(embeddings_file_path).model
+        if stored_model == embedding_backend.model:
+            logger.info(f"Loading existing embeddings from {embeddings_file_path}")
+            return load_embeddings(input_file, directory)
+        logger.info(
+            f"Discarding embeddings from {stored_model} in {embeddings_file_path}"
+        )
+        os.remove(embeddings_file_path)
 
     logger.info(f"Creating new embeddings for {input_file_name}")
 
-    response = openai_client.embeddings.create(
-        input=texts, model="text-embedding-3-small"
+    unique_texts, page_to_unique = deduplicate_page_texts(texts)
+    if not unique_texts:
+        raise ValueError(f"No text was extracted from {input_file_name}")
+    logger.info(
+        f"Embedding {len(unique_texts)} distinct texts for {len(texts)} pages "
+        f"with {embedding_backend.model}"
     )
-    embeddings = [np.array(embedding.embedding) for embedding in response.data]
 
-    with open(embeddings_file_path, "wb") as f:
-        pickle.dump(embeddings, f)
+    chunks, owners, weights = chunk_texts(
+        unique_texts, get_token_counter(settings.EMBEDDING_MODEL), max_tokens
+    )
+    chunked = int((np.bincount(owners) > 1).sum())
+    if chunked:
+        logger.info(f"Split {chunked} long texts, embedding {len(chunks)} inputs")
+    if report is not None:
+        report.chunked_pages += chunked
+        report.embedding_chunks += len(chunks)
 
-    return embeddings
+    unique_embeddings = mean_pool(embedding_backend.embed(chunks), owners, weights)
+    embeddings = expand_page_embeddings(unique_embeddings, page_to_unique)
 
+    save_embeddings(input_file, embeddings, embedding_backend.model, directory)
 
-def save_embeddings(input_file: str, embeddings: List) -> None:
-    """Save embeddings to a file if it doesn't already exist."""
-    input_file_name = os.path.basename(input_file)
-    input_file_name_without_ext = os.path.splitext(input_file_name)[0]
-    embeddings_file_path = (
-        f"data/{input_file_name_without_ext}_{settings.EMBEDDINGS_FILE_SUFFIX}"
+    # Read back what was stored, so a fresh run segments on the same (possibly
+    # quantized) values as a run that resumes from the file.
+    return load_embeddings(input_file, directory)
+
+
+def deduplicate_page_texts(texts: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Collect the distinct non-empty page texts.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The distinct texts in order of first
+            appearance, and for every page the index of its text in that list,
+            or -1 for pages without text.
+    """
+    unique_index: Dict[str, int] = {}
+    page_to_unique = np.full(len(texts), -1, dtype=np.int64)
+    for page_number, text in enumerate(texts):
+        if not text.strip():
+            continue
+        page_to_unique[page_number] = unique_index.setdefault(text, len(unique_index))
+    return list(unique_index), page_to_unique
+
+
+def expand_page_embeddings(
+    unique_embeddings: np.ndarray, page_to_unique: np.ndarray
+) -> np.ndarray:
+    """
+    Build the per-page embedding matrix from the embeddings of the distinct texts.
+
+    Pages without text reuse the embedding of the closest preceding page with
+    text, or of the first page with text if none precedes them.
+    """
+    has_text = page_to_unique >= 0
+    if not has_text.any():
+        return np.zeros((len(page_to_unique), unique_embeddings.shape[1]), np.float32)
+
+    # Forward fill the index of the last page with text
+    positions = np.where(has_text, np.arange(len(page_to_unique)), 0)
+    np.maximum.accumulate(positions, out=positions)
+    filled = page_to_unique[positions]
+    filled[filled < 0] = page_to_unique[np.argmax(has_text)]
+    return unique_embeddings[filled]
+
+
+def quantize_embeddings(
+    embeddings: np.ndarray, dtype: str
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert a float matrix to the given storage dtype.
+
+    Args:
+        embeddings (np.ndarray): Matrix of shape (page_count, dimension).
+        dtype (str): One of "float32", "float16" or "int8".
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The stored matrix and, for int8,
+            the float32 per-row scales needed to dequantize it.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown embeddings storage dtype: {dtype}")
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if dtype != "int8":
+        return matrix.astype(dtype), None
+
+    # Symmetric per-row quantization keeps each page's direction intact
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize_embeddings(
+    data: np.ndarray, scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Convert a stored matrix back to float32."""
+    if scales is None:
+        return np.asarray(data, dtype=np.float32)
+    return data.astype(np.float32) * scales[:, None]
+
+
+def _align(offset: int) -> int:
+    return -(-offset // EMBEDDINGS_ALIGNMENT) * EMBEDDINGS_ALIGNMENT
+
+
+def write_embeddings_file(
+    path: str,
+    embeddings: np.ndarray,
+    model: str = settings.EMBEDDING_MODEL,
+    dtype: str = "float32",
+) -> EmbeddingsHeader:
+    """
+    Write embeddings to a binary file that can be memory-mapped on load.
+
+    The layout is the magic bytes, a little-endian uint32 header length, the JSON
+    header, then the (optional) int8 scales and the row-major matrix, each aligned
+    to 64 bytes.
+
+    Args:
+        path (str): Destination file path.
+        embeddings (np.ndarray): Matrix of shape (page_count, dimension).
+        model (str, optional): Name of the model that produced the embeddings.
+        dtype (str, optional): Storage dtype. Defaults to "float32".
+
+    Returns:
+        EmbeddingsHeader: The header that was written.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    data, scales = quantize_embeddings(matrix, dtype)
+
+    # The header stores its own offsets, so size it with placeholder offsets first
+    header = EmbeddingsHeader(
+        model=model,
+        dimension=matrix.shape[1],
+        page_count=matrix.shape[0],
+        dtype=dtype,
+        scales_offset=0,
+        data_offset=0,
     )
+    header_size = len(header.model_dump_json()) + 64
+    prefix_size = len(EMBEDDINGS_MAGIC) + 4 + header_size
+    if scales is not None:
+        header.scales_offset = _align(prefix_size)
+        header.data_offset = _align(header.scales_offset + scales.nbytes)
+    else:
+        header.data_offset = _align(prefix_size)
+    header_bytes = header.model_dump_json().encode("utf-8").ljust(header_size)
+
+    with open(path, "wb") as f:
+        f.write(EMBEDDINGS_MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        if scales is not None:
+            f.seek(header.scales_offset)
+            f.write(scales.tobytes())
+        f.seek(header.data_offset)
+        f.write(np.ascontiguousarray(data).tobytes())
+    return header
+
+
+def read_embeddings_header(path: str) -> EmbeddingsHeader:
+    """Read only the header of an embeddings file."""
+    with open(path, "rb") as f:
+        magic = f.read(len(EMBEDDINGS_MAGIC))
+        if magic != EMBEDDINGS_MAGIC:
+            raise ValueError(f"{path} is not an embeddings file")
+        (header_length,) = struct.unpack("<I", f.read(4))
+        return EmbeddingsHeader(**json.loads(f.read(header_length)))
+
+
+def read_embeddings_file(path: str, dequantize: bool = True) -> np.ndarray:
+    """
+    Memory-map an embeddings file.
+
+    float32 and float16 files are returned as read-only memmaps, so pages are only
+    read from disk when they are touched. int8 files are dequantized to float32
+    unless `dequantize` is False, in which case the raw int8 memmap is returned.
+
+    Args:
+        path (str): Path of the embeddings file.
+        dequantize (bool, optional): Whether to convert int8 data to float32.
+
+    Returns:
+        np.ndarray: Matrix of shape (page_count, dimension).
+    """
+    header = read_embeddings_header(path)
+    shape = (header.page_count, header.dimension)
+    if header.page_count == 0:
+        return np.empty(shape, dtype=np.float32)
+
+    data = np.memmap(
+        path, dtype=header.dtype, mode="r", offset=header.data_offset, shape=shape
+    )
+    if header.dtype != "int8" or not dequantize:
+        return data
+    return dequantize_embeddings(data, read_embeddings_scales(path))
+
+
+def read_embeddings_scales(path: str) -> Optional[np.ndarray]:
+    """Memory-map the per-row scales of an int8 embeddings file, None for floats."""
+    header = read_embeddings_header(path)
+    if header.dtype != "int8" or header.page_count == 0:
+        return None
+    return np.memmap(
+        path,
+        dtype=np.float32,
+        mode="r",
+        offset=header.scales_offset,
+        shape=(header.page_count,),
+    )
+
+
+def save_embeddings(
+    input_file: str,
+    embeddings: np.ndarray,
+    model: str = settings.EMBEDDING_MODEL,
+    directory: str = "data",
+) -> None:
+    """Save embeddings to a file if it doesn't already exist."""
+    embeddings_file_path = get_embeddings_file_path(input_file, directory)
 
     if os.path.exists(embeddings_file_path):
         logger.info(
@@ -51,17 +315,15 @@ def save_embeddings(input_file: str, embeddings: List) -> None:
         )
         return
 
-    with open(embeddings_file_path, "wb") as f:
-        pickle.dump(embeddings, f)
+    os.makedirs(os.path.dirname(embeddings_file_path), exist_ok=True)
+    write_embeddings_file(
+        embeddings_file_path,
+        embeddings,
+        model=model,
+        dtype=settings.EMBEDDINGS_STORAGE_DTYPE,
+    )
 
 
-def load_embeddings(input_file: str) -> List:
+def load_embeddings(input_file: str, directory: str = "data") -> np.ndarray:
     """Load embeddings from a file."""
-    input_file_name = os.path.basename(input_file)
-    input_file_name_without_ext = os.path.splitext(input_file_name)[0]
-    embeddings_file_path = (
-        f"data/{input_file_name_without_ext}_{settings.EMBEDDINGS_FILE_SUFFIX}"
-    )
-
-    with open(embeddings_file_path, "rb") as f:
-        return pickle.load(f)
+    return read_embeddings_file(get_embeddings_file_path(input_file, directory))
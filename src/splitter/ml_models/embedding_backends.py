@@ -0,0 +1,251 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from openai import OpenAI
+
+from ..api_scheduler import get_scheduler
+from ..processors.text_preparation import get_token_counter
+from ..settings import settings
+
+
+class EmbeddingBackend(ABC):
+    """Turns page texts into fixed-dimension float32 vectors."""
+
+    name: str
+
+    @property
+    @abstractmethod
+    def model(self) -> str:
+        """The model name recorded in the embeddings file header."""
+
+    @property
+    def shared_space(self) -> bool:
+        """Whether embeddings of different jobs can be compared, e.g. in the page index."""
+        return True
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of non-empty texts.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            np.ndarray: float32 matrix of shape (len(texts), dimension).
+        """
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """
+    OpenAI embeddings API. A batch is sent as requests of at most `max_inputs`
+    texts and `max_tokens` tokens, within the API's limits per request, which
+    go through the shared API scheduler concurrently.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        model: str = settings.EMBEDDING_MODEL,
+        max_inputs: int = settings.EMBEDDING_REQUEST_MAX_INPUTS,
+        max_tokens: int = settings.EMBEDDING_REQUEST_MAX_TOKENS,
+    ):
+        self._model = model
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        # Retries are handled by the shared API scheduler
+        self.client = OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        batches = self._batches(texts)
+        if len(batches) > 1:
+            logger.info(f"Embedding {len(texts)} texts in {len(batches)} requests")
+        with ThreadPoolExecutor(settings.EMBEDDING_MAX_CONCURRENCY) as executor:
+            return np.concatenate(list(executor.map(self._embed_batch, batches)))
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        response = get_scheduler().call(
+            "embedding",
+            self.client.embeddings.create,
+            input=texts,
+            model=self._model,
+        )
+        return np.array(
+            [embedding.embedding for embedding in response.data], dtype=np.float32
+        )
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        """Group consecutive texts into requests within the input and token limits."""
+        counter = get_token_counter(self._model)
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            tokens = counter.count(text)
+            if batch and (
+                len(batch) >= self.max_inputs or batch_tokens + tokens > self.max_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """
+    Latent semantic embeddings computed locally: hashed word and bigram counts,
+    TF-IDF weighting and a truncated SVD, all on scipy sparse matrices.
+
+    The hashing step is stateless, so only the IDF weights and the SVD basis are
+    learned. They are fitted on each job's own pages, or once on a stored corpus
+    (see `fit` and `save`) so that vectors are comparable across jobs.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        dimension: int = settings.LOCAL_EMBEDDING_DIMENSION,
+        n_features: int = settings.LOCAL_EMBEDDING_HASH_FEATURES,
+        model_path: Optional[str] = settings.LOCAL_EMBEDDING_MODEL_PATH,
+    ):
+        """Initialize the backend, loading the stored corpus model if there is one."""
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.dimension = dimension
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32,
+        )
+        self.tfidf = None
+        self.columns = None
+        self.svd = None
+        if model_path and os.path.exists(model_path):
+            self.load(model_path)
+
+    @property
+    def model(self) -> str:
+        fitted_on = "corpus" if self.is_fitted else "job"
+        return f"local-tfidf-svd-{self.dimension}-{fitted_on}"
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.svd is not None
+
+    @property
+    def shared_space(self) -> bool:
+        # A model fitted per job has a basis of its own
+        return self.is_fitted
+
+    def fit(self, texts: List[str]) -> "LocalEmbeddingBackend":
+        """Fit the IDF weights and the SVD basis on a corpus of page texts."""
+        self.tfidf, self.columns, self.svd = self._fit(self.vectorizer.transform(texts))
+        return self
+
+    def save(self, path: str) -> None:
+        """Store the fitted corpus model so later jobs can reuse it."""
+        import joblib
+
+        if not self.is_fitted:
+            raise ValueError("The local embedding model has not been fitted")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        joblib.dump(
+            {
+                "dimension": self.dimension,
+                "n_features": self.n_features,
+                "tfidf": self.tfidf,
+                "columns": self.columns,
+                "svd": self.svd,
+            },
+            path,
+        )
+
+    def load(self, path: str) -> None:
+        """Load a corpus model written by `save`."""
+        import joblib
+
+        state = joblib.load(path)
+        if state["n_features"] != self.n_features:
+            raise ValueError(
+                f"{path} was fitted with {state['n_features']} hash features, "
+                f"not {self.n_features}"
+            )
+        self.dimension = state["dimension"]
+        self.tfidf = state["tfidf"]
+        self.columns = state["columns"]
+        self.svd = state["svd"]
+        logger.info(f"Loaded local embedding model from {path}")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        counts = self.vectorizer.transform(texts)
+        if self.is_fitted:
+            tfidf, columns, svd = self.tfidf, self.columns, self.svd
+        else:
+            tfidf, columns, svd = self._fit(counts)
+        if svd is None:
+            # A single distinct page has no latent structure to learn
+            vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+            vectors[:, 0] = 1.0
+            return vectors
+        weighted = tfidf.transform(counts)[:, columns]
+        vectors = svd.transform(weighted).astype(np.float32)
+
+        # Small jobs have fewer components than the fixed dimension
+        if vectors.shape[1] < self.dimension:
+            vectors = np.pad(vectors, ((0, 0), (0, self.dimension - vectors.shape[1])))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _fit(self, counts) -> Tuple[object, np.ndarray, Optional[object]]:
+        """
+        Fit TF-IDF and an SVD with as many components as the data allows.
+
+        Only the hash buckets that occur in the data can carry weight in the SVD
+        basis, so the SVD is fitted on those columns alone. This shrinks the dense
+        work from the full hash space to the actual vocabulary.
+        """
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfTransformer
+
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(counts)
+        columns = np.unique(counts.indices)
+        n_components = min(self.dimension, counts.shape[0] - 1, len(columns) - 1)
+        if n_components < 1:
+            return tfidf, columns, None
+        svd = TruncatedSVD(n_components=n_components, random_state=0)
+        svd.fit(tfidf.transform(counts)[:, columns])
+        return tfidf, columns, svd
+
+
+EMBEDDING_BACKENDS = {
+    backend.name: backend for backend in (OpenAIEmbeddingBackend, LocalEmbeddingBackend)
+}
+
+_backends: Dict[str, EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(name: str = settings.EMBEDDING_BACKEND) -> EmbeddingBackend:
+    """Return the shared embedding backend with the given name."""
+    with _backends_lock:
+        if name not in _backends:
+            if name not in EMBEDDING_BACKENDS:
+                raise ValueError(f"Unknown embedding backend: {name}")
+            _backends[name] = EMBEDDING_BACKENDS[name]()
+        return _backends[name]
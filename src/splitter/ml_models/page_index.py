@@ -0,0 +1,649 @@
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, Field
+from scipy.sparse import csr_matrix
+
+from ..checkpoints import write_json_atomic
+from ..domain_models import PriorMatch, SplitDocument
+from ..settings import settings
+from .embedding import (read_embeddings_file, read_embeddings_scales,
+                        write_embeddings_file)
+
+STATE_FILE_NAME = "index.json"
+LOCK_FILE_NAME = "index.lock"
+# Rows multiplied at once, which bounds the float32 copy of a block of a shard
+SCAN_ROWS = 16384
+# Small shards, e.g. one per job, are merged once there are more than this many
+MAX_SMALL_SHARDS = 32
+# Shards with a larger share of deleted rows are rewritten by the next compaction
+MAX_DELETED_SHARE = 0.25
+KMEANS_ITERATIONS = 10
+
+
+class IndexedBundle(BaseModel):
+    serial: int = Field(..., description="Number of the bundle in its row ids")
+    job_id: str = Field(..., description="The job that added the bundle")
+    source: str = Field(..., description="The file name of the bundle")
+    page_count: int = Field(..., description="The number of pages indexed")
+    documents: List[SplitDocument] = Field(
+        default_factory=list, description="The split of the bundle, if known"
+    )
+
+
+class IndexShard(BaseModel):
+    name: str = Field(..., description="File name of the shard, without extension")
+    rows: int = Field(..., description="The number of rows stored")
+    deleted_rows: int = Field(0, description="Rows of bundles deleted since")
+    bundles: List[int] = Field(..., description="Serials of the bundles stored")
+
+
+class PageIndexState(BaseModel):
+    model: str = Field(..., description="The model of every indexed embedding")
+    dimension: Optional[int] = Field(None, description="Set by the first bundle")
+    next_serial: int = Field(0, description="Serial of the next bundle added")
+    next_file: int = Field(0, description="Number of the next file written")
+    bundles: List[IndexedBundle] = Field(default_factory=list)
+    shards: List[IndexShard] = Field(default_factory=list)
+    centroids: Optional[str] = Field(
+        None, description="File of the IVF list centroids, None until trained"
+    )
+
+
+class PageHits(BaseModel):
+    scores: np.ndarray = Field(
+        ..., description="Cosine similarity of the hits of each query, best first"
+    )
+    bundles: np.ndarray = Field(..., description="Serial of each hit, -1 for none")
+    pages: np.ndarray = Field(..., description="Page number of each hit, -1 for none")
+    bundle_records: Dict[int, IndexedBundle] = Field(
+        ..., description="The bundles of the hits, by serial"
+    )
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+def read_state(path: str) -> PageIndexState:
+    with open(path, "r") as f:
+        return PageIndexState.model_validate_json(f.read())
+
+
+class _Shard:
+    """The memory-mapped rows of a shard, their ids and IVF list offsets."""
+
+    def __init__(self, directory: str, record: IndexShard):
+        path = os.path.join(directory, record.name)
+        self.data = read_embeddings_file(f"{path}.bin", dequantize=False)
+        self.scales = read_embeddings_scales(f"{path}.bin")
+        # bundle serial << 32 | page number of each row
+        self.ids = np.load(f"{path}.ids.npy", mmap_mode="r")
+        lists_path = f"{path}.lists.npy"
+        self.list_offsets = np.load(lists_path) if os.path.exists(lists_path) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def blocks(self, start: int = 0, end: Optional[int] = None) -> Iterator[tuple]:
+        """Yield the rows from start to end as float32 blocks, with their ids."""
+        end = len(self) if end is None else end
+        for block_start in range(start, end, SCAN_ROWS):
+            block_end = min(block_start + SCAN_ROWS, end)
+            block = np.asarray(self.data[block_start:block_end], dtype=np.float32)
+            if self.scales is not None:
+                block *= self.scales[block_start:block_end, None]
+            yield block, np.asarray(self.ids[block_start:block_end])
+
+    def score_blocks(
+        self, queries: np.ndarray, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[tuple]:
+        """Yield the dot products of the queries with blocks of rows, with their ids."""
+        end = len(self) if end is None else end
+        for block_start in range(start, end, SCAN_ROWS):
+            block_end = min(block_start + SCAN_ROWS, end)
+            block = np.asarray(self.data[block_start:block_end], dtype=np.float32)
+            scores = queries @ block.T
+            if self.scales is not None:
+                # Cheaper than dequantizing the block
+                scores *= self.scales[block_start:block_end]
+            yield scores, np.asarray(self.ids[block_start:block_end])
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the IVF list of each vector: its most similar centroid."""
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + SCAN_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), SCAN_ROWS)
+        ]
+        or [np.zeros(0, dtype=np.int64)]
+    )
+
+
+def spherical_kmeans(
+    points: np.ndarray, n_clusters: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return the unit centroids."""
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = assign_lists(points, centroids)
+        # Sums of the points of each cluster, as a product with a one-hot matrix
+        members = csr_matrix(
+            (
+                np.ones(len(points), dtype=np.float32),
+                (assignments, np.arange(len(points))),
+            ),
+            shape=(n_clusters, len(points)),
+        )
+        centroids = np.asarray(members @ points)
+        # Empty clusters restart from random points
+        empty = np.flatnonzero(np.bincount(assignments, minlength=n_clusters) == 0)
+        centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+        centroids = normalize_rows(centroids)
+    return centroids
+
+
+def _keep_top_k(
+    scores: np.ndarray, ids: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the k highest scores of each row, unordered, and their ids."""
+    if scores.shape[1] <= k:
+        return scores, ids
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, top, 1), np.take_along_axis(ids, top, 1)
+
+
+class PageIndex:
+    """
+    Persistent index of the page embeddings of every processed bundle.
+
+    Each add writes the bundle's unit-normalized embeddings to a new shard, an
+    embeddings file (see `write_embeddings_file`) that is memory-mapped when
+    searched, with the bundle and page of every row alongside. Small shards are
+    merged into shards of up to PAGE_INDEX_SHARD_PAGES rows once there are more
+    than MAX_SMALL_SHARDS of them. A delete drops the bundle from the state at
+    once, its rows are skipped by searches, and the shards are rewritten without
+    them when they compact.
+
+    Searches are exact by default, scanning every shard in blocks with a matrix
+    product for the whole batch of queries. Once the index is trained, every
+    shard is stored sorted by IVF list, and a query only scans the contiguous rows
+    of the `nprobe` lists whose centroids are closest to it.
+
+    The state is a JSON file replaced atomically. Searches hold a shared lock on
+    the index and changes an exclusive one, so processes and threads can share
+    the index directory.
+    """
+
+    def __init__(
+        self, directory: str, model: str, dtype: str = settings.PAGE_INDEX_DTYPE
+    ):
+        """Initialize the index of the model's embeddings in the directory."""
+        self.directory = directory
+        self.model = model
+        self.dtype = dtype
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with open(os.path.join(self.directory, LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.directory, STATE_FILE_NAME)
+
+    def _load_state(self) -> PageIndexState:
+        if not os.path.exists(self._state_path()):
+            return PageIndexState(model=self.model)
+        state = read_state(self._state_path())
+        if state.model != self.model:
+            raise ValueError(
+                f"{self.directory} indexes {state.model}, not {self.model}"
+            )
+        return state
+
+    def _save_state(self, state: PageIndexState) -> None:
+        write_json_atomic(self._state_path(), state.model_dump(mode="json"))
+
+    def _remove_files(self, names: Sequence[str]) -> None:
+        for name in names:
+            for suffix in (".bin", ".ids.npy", ".lists.npy", ""):
+                path = os.path.join(self.directory, name + suffix)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    @property
+    def page_count(self) -> int:
+        """The number of pages of the indexed bundles."""
+        with self._locked(exclusive=False):
+            return sum(bundle.page_count for bundle in self._load_state().bundles)
+
+    def add(
+        self,
+        job_id: str,
+        source: str,
+        embeddings: np.ndarray,
+        documents: Sequence[SplitDocument] = (),
+    ) -> None:
+        """
+        Add the page embeddings of a bundle, replacing any earlier add of the job.
+
+        Args:
+            job_id (str): The job the pages belong to, the key to delete them by.
+            source (str): The file name of the bundle, shown with its matches.
+            embeddings (np.ndarray): Matrix with one row per page, in page order.
+            documents (Sequence[SplitDocument], optional): The split of the bundle,
+                so that matches can name the document a page belongs to.
+        """
+        vectors = normalize_rows(embeddings)
+        with self._locked(exclusive=True):
+            state = self._load_state()
+            if state.dimension is None:
+                state.dimension = vectors.shape[1]
+            elif vectors.shape[1] != state.dimension:
+                raise ValueError(
+                    f"Embeddings of dimension {vectors.shape[1]} cannot be added "
+                    f"to an index of dimension {state.dimension}"
+                )
+            # A retried job replaces the pages it added before failing
+            obsolete = self._delete_bundles(state, job_id)
+
+            bundle = IndexedBundle(
+                serial=state.next_serial,
+                job_id=job_id,
+                source=source,
+                page_count=len(vectors),
+                documents=[
+                    document.model_copy(update={"prior_matches": []})
+                    for document in documents
+                ],
+            )
+            state.next_serial += 1
+            state.bundles.append(bundle)
+            if len(vectors):
+                ids = (np.int64(bundle.serial) << 32) | np.arange(len(vectors))
+                state.shards.append(self._write_shard(state, vectors, ids))
+
+            small_shards = [
+                shard
+                for shard in state.shards
+                if shard.rows < settings.PAGE_INDEX_SHARD_PAGES
+            ]
+            if len(small_shards) > MAX_SMALL_SHARDS:
+                obsolete += self._compact(state)
+            self._save_state(state)
+            self._remove_files(obsolete)
+        logger.info(f"Indexed {len(vectors)} pages of {source} (job {job_id})")
+
+    def delete(self, job_id: str) -> bool:
+        """Delete the pages added by the job and return whether there were any."""
+        with self._locked(exclusive=True):
+            state = self._load_state()
+            if not any(bundle.job_id == job_id for bundle in state.bundles):
+                return False
+            obsolete = self._delete_bundles(state, job_id)
+            self._save_state(state)
+            self._remove_files(obsolete)
+        logger.info(f"Deleted the indexed pages of job {job_id}")
+        return True
+
+    def _delete_bundles(self, state: PageIndexState, job_id: str) -> List[str]:
+        """Drop the job's bundles from the state and return the shards left empty."""
+        serials = {bundle.serial for bundle in state.bundles if bundle.job_id == job_id}
+        if not serials:
+            return []
+        state.bundles = [b for b in state.bundles if b.serial not in serials]
+        obsolete = []
+        for shard in list(state.shards):
+            deleted = serials.intersection(shard.bundles)
+            if not deleted:
+                continue
+            shard.bundles = [
+                serial for serial in shard.bundles if serial not in deleted
+            ]
+            if not shard.bundles:
+                state.shards.remove(shard)
+                obsolete.append(shard.name)
+                continue
+            serial_of_row = _Shard(self.directory, shard).ids >> 32
+            shard.deleted_rows += int(np.isin(serial_of_row, list(deleted)).sum())
+        return obsolete
+
+    def compact(self) -> None:
+        """Merge small shards and rewrite shards with many deleted rows."""
+        with self._locked(exclusive=True):
+            state = self._load_state()
+            obsolete = self._compact(state)
+            self._save_state(state)
+            self._remove_files(obsolete)
+
+    def _compact(self, state: PageIndexState) -> List[str]:
+        shards = [
+            shard
+            for shard in state.shards
+            if shard.rows < settings.PAGE_INDEX_SHARD_PAGES
+            or shard.deleted_rows > MAX_DELETED_SHARE * shard.rows
+        ]
+        if len(shards) < 2 and not any(shard.deleted_rows for shard in shards):
+            return []
+        logger.info(f"Compacting {len(shards)} page index shards")
+        return self._rewrite(state, shards)
+
+    def _rewrite(self, state: PageIndexState, shards: List[IndexShard]) -> List[str]:
+        """Rewrite the rows of live bundles of the shards into full shards."""
+        alive = self._alive(state)
+        centroids = self._load_centroids(state)
+        pending_vectors, pending_ids, pending_rows = [], [], 0
+        written = []
+
+        def flush(rows: int) -> None:
+            nonlocal pending_vectors, pending_ids, pending_rows
+            vectors = np.concatenate(pending_vectors)
+            ids = np.concatenate(pending_ids)
+            written.append(
+                self._write_shard(state, vectors[:rows], ids[:rows], centroids)
+            )
+            pending_vectors, pending_ids = [vectors[rows:]], [ids[rows:]]
+            pending_rows = len(vectors) - rows
+
+        for record in shards:
+            for block, ids in _Shard(self.directory, record).blocks():
+                keep = alive[ids >> 32]
+                pending_vectors.append(block[keep])
+                pending_ids.append(ids[keep])
+                pending_rows += int(keep.sum())
+                while pending_rows >= settings.PAGE_INDEX_SHARD_PAGES:
+                    flush(settings.PAGE_INDEX_SHARD_PAGES)
+        if pending_rows:
+            flush(pending_rows)
+
+        state.shards = [s for s in state.shards if s not in shards] + written
+        return [shard.name for shard in shards]
+
+    def _write_shard(
+        self,
+        state: PageIndexState,
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+    ) -> IndexShard:
+        if centroids is None:
+            centroids = self._load_centroids(state)
+        name = f"shard_{state.next_file:06d}"
+        state.next_file += 1
+        path = os.path.join(self.directory, name)
+        if centroids is not None:
+            # Rows of the same list are contiguous, so a probe reads one slice
+            lists = assign_lists(vectors, centroids)
+            order = np.argsort(lists, kind="stable")
+            vectors, ids = vectors[order], ids[order]
+            offsets = np.searchsorted(lists[order], np.arange(len(centroids) + 1))
+            np.save(f"{path}.lists.npy", offsets)
+        write_embeddings_file(f"{path}.bin", vectors, self.model, self.dtype)
+        np.save(f"{path}.ids.npy", ids)
+        return IndexShard(
+            name=name, rows=len(ids), bundles=np.unique(ids >> 32).tolist()
+        )
+
+    def _alive(
+        self, state: PageIndexState, exclude_job_id: Optional[str] = None
+    ) -> np.ndarray:
+        """Whether the rows of each bundle serial are searchable."""
+        alive = np.zeros(state.next_serial, dtype=bool)
+        for bundle in state.bundles:
+            alive[bundle.serial] = bundle.job_id != exclude_job_id
+        return alive
+
+    def _load_centroids(self, state: PageIndexState) -> Optional[np.ndarray]:
+        if state.centroids is None:
+            return None
+        return np.load(os.path.join(self.directory, state.centroids))
+
+    def train(
+        self,
+        n_lists: int = settings.PAGE_INDEX_IVF_LISTS,
+        sample_pages: int = settings.PAGE_INDEX_TRAIN_PAGES,
+        seed: int = 0,
+    ) -> None:
+        """
+        Fit the IVF lists on a sample of the indexed pages and re-sort every shard.
+
+        Pages added later are sorted into the existing lists, so train again when
+        the index has grown several times over or its content has shifted.
+
+        Args:
+            n_lists (int, optional): Number of lists. About 4 * sqrt(pages) works
+                well for large indexes.
+            sample_pages (int, optional): Pages the centroids are fitted on.
+            seed (int, optional): Random seed of the sample and the clustering.
+        """
+        rng = np.random.default_rng(seed)
+        with self._locked(exclusive=True):
+            state = self._load_state()
+            alive = self._alive(state)
+            records = list(state.shards)
+            shards = [_Shard(self.directory, record) for record in records]
+            live_rows = [np.flatnonzero(alive[shard.ids >> 32]) for shard in shards]
+            total = sum(len(rows) for rows in live_rows)
+            if total < n_lists:
+                raise ValueError(f"Cannot fit {n_lists} lists on {total} pages")
+
+            # The same share of every shard, in row order for sequential reads
+            share = min(1.0, sample_pages / total)
+            sample = []
+            for shard, rows in zip(shards, live_rows):
+                picked = np.sort(
+                    rng.choice(rows, round(len(rows) * share), replace=False)
+                )
+                block = np.asarray(shard.data[picked], dtype=np.float32)
+                if shard.scales is not None:
+                    block *= shard.scales[picked, None]
+                sample.append(block)
+            points = normalize_rows(np.concatenate(sample))
+            logger.info(f"Fitting {n_lists} lists on {len(points)} pages")
+            centroids = spherical_kmeans(points, min(n_lists, len(points)), rng)
+
+            obsolete = [state.centroids] if state.centroids else []
+            state.centroids = f"centroids_{state.next_file:06d}.npy"
+            state.next_file += 1
+            np.save(os.path.join(self.directory, state.centroids), centroids)
+            obsolete += self._rewrite(state, records)
+            self._save_state(state)
+            self._remove_files(obsolete)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = settings.PAGE_INDEX_TOP_K,
+        nprobe: int = settings.PAGE_INDEX_NPROBE,
+        exclude_job_id: Optional[str] = None,
+    ) -> PageHits:
+        """
+        Find the most similar indexed pages of every query.
+
+        Args:
+            queries (np.ndarray): Matrix with one embedding per query.
+            k (int, optional): Number of hits per query.
+            nprobe (int, optional): Lists scanned per query once the index is
+                trained. 0 scans every page.
+            exclude_job_id (Optional[str], optional): A job whose pages are not
+                returned, e.g. the one asking.
+
+        Returns:
+            PageHits: The hits of each query by decreasing similarity.
+        """
+        queries = normalize_rows(queries)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        with self._locked(exclusive=False):
+            state = self._load_state()
+            alive = self._alive(state, exclude_job_id)
+            centroids = self._load_centroids(state)
+            if len(queries) and state.dimension not in (None, queries.shape[1]):
+                raise ValueError(
+                    f"Queries of dimension {queries.shape[1]} cannot search an "
+                    f"index of dimension {state.dimension}"
+                )
+            probes = None
+            if centroids is not None and 0 < nprobe < len(centroids):
+                probes = self._probe_queries(queries, centroids, nprobe)
+            for record in state.shards:
+                shard = _Shard(self.directory, record)
+                if probes is None or shard.list_offsets is None:
+                    targets = [(np.arange(len(queries)), 0, len(shard))]
+                else:
+                    targets = [
+                        (rows, shard.list_offsets[i], shard.list_offsets[i + 1])
+                        for i, rows in probes
+                    ]
+                for rows, start, end in targets:
+                    for block_scores, block_ids in shard.score_blocks(
+                        queries[rows], start, end
+                    ):
+                        block_scores[:, ~alive[block_ids >> 32]] = -np.inf
+                        block_scores, top_ids = _keep_top_k(
+                            block_scores,
+                            np.broadcast_to(block_ids, block_scores.shape),
+                            k,
+                        )
+                        scores[rows], ids[rows] = _keep_top_k(
+                            np.concatenate([scores[rows], block_scores], axis=1),
+                            np.concatenate([ids[rows], top_ids], axis=1),
+                            k,
+                        )
+            bundle_records = {bundle.serial: bundle for bundle in state.bundles}
+
+        order = np.argsort(-scores, axis=1, kind="stable")
+        # Quantized rows can score slightly over 1
+        scores = np.minimum(np.take_along_axis(scores, order, 1), 1.0)
+        ids = np.take_along_axis(ids, order, 1)
+        found = np.isfinite(scores)
+        return PageHits(
+            scores=scores,
+            bundles=np.where(found, ids >> 32, -1),
+            pages=np.where(found, ids & 0xFFFFFFFF, -1),
+            bundle_records=bundle_records,
+        )
+
+    @staticmethod
+    def _probe_queries(
+        queries: np.ndarray, centroids: np.ndarray, nprobe: int
+    ) -> List[Tuple[int, np.ndarray]]:
+        """Return every probed list with the queries probing it."""
+        probed = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)
+        probed = probed[:, :nprobe].ravel()
+        query_of_probe = np.repeat(np.arange(len(queries)), nprobe)
+        order = np.argsort(probed, kind="stable")
+        lists, starts = np.unique(probed[order], return_index=True)
+        return list(zip(lists, np.split(query_of_probe[order], starts[1:])))
+
+
+def model_directory_name(model: str) -> str:
+    return re.sub(r"[^\w.-]", "_", model)
+
+
+def open_page_index(model: str, directory: str = settings.PAGE_INDEX_DIR) -> PageIndex:
+    """Return the page index of the model's embeddings."""
+    return PageIndex(os.path.join(directory, model_directory_name(model)), model)
+
+
+def delete_job_pages(job_id: str, directory: str = settings.PAGE_INDEX_DIR) -> bool:
+    """Delete the job's pages from the page index of every model."""
+    deleted = False
+    if not os.path.isdir(directory):
+        return deleted
+    for name in sorted(os.listdir(directory)):
+        state_path = os.path.join(directory, name, STATE_FILE_NAME)
+        if not os.path.exists(state_path):
+            continue
+        model = read_state(state_path).model
+        deleted = (
+            PageIndex(os.path.join(directory, name), model).delete(job_id) or deleted
+        )
+    return deleted
+
+
+def _page_documents(bundle: IndexedBundle) -> np.ndarray:
+    """Return the position in `bundle.documents` of every page, -1 if unknown."""
+    positions = np.full(bundle.page_count, -1, dtype=int)
+    for position, document in enumerate(bundle.documents):
+        for start, end in document.page_ranges:
+            positions[start : end + 1] = position
+    return positions
+
+
+def find_prior_matches(
+    index: PageIndex,
+    embeddings: np.ndarray,
+    documents: Sequence[SplitDocument],
+    exclude_job_id: Optional[str] = None,
+    min_similarity: float = settings.PAGE_INDEX_MIN_SIMILARITY,
+    max_matches: int = settings.PAGE_INDEX_MAX_MATCHES,
+) -> None:
+    """
+    Set the matches in earlier bundles of every document of a split.
+
+    All pages are searched in one batch. An earlier document matches when some
+    of this document's pages are at least `min_similarity` similar to its pages.
+    Matches are ranked by the number of such pages, then by their similarity.
+
+    Args:
+        index (PageIndex): The index of the earlier bundles.
+        embeddings (np.ndarray): The page embeddings of the split bundle.
+        documents (Sequence[SplitDocument]): The documents of the split, whose
+            `prior_matches` are set.
+        exclude_job_id (Optional[str], optional): The job of the split, if its
+            pages may already be indexed.
+        min_similarity (float, optional): Cosine similarity of a matching page.
+        max_matches (int, optional): Matches kept per document.
+    """
+    hits = index.search(embeddings, exclude_job_id=exclude_job_id)
+    page_documents: Dict[int, np.ndarray] = {}
+    for document in documents:
+        # Best similarity of each page of the document, by earlier document
+        matched: Dict[Tuple[int, int], Dict[int, float]] = {}
+        for page in document.page_numbers:
+            for score, serial, prior_page in zip(
+                hits.scores[page], hits.bundles[page], hits.pages[page]
+            ):
+                if score < min_similarity:
+                    break
+                bundle = hits.bundle_records[int(serial)]
+                if bundle.serial not in page_documents:
+                    page_documents[bundle.serial] = _page_documents(bundle)
+                position = int(page_documents[bundle.serial][prior_page])
+                pages = matched.setdefault((bundle.serial, position), {})
+                pages[page] = max(pages.get(page, 0.0), float(score))
+
+        matches = []
+        for (serial, position), pages in matched.items():
+            bundle = hits.bundle_records[serial]
+            prior = bundle.documents[position] if position >= 0 else None
+            matches.append(
+                PriorMatch(
+                    job_id=bundle.job_id,
+                    source=bundle.source,
+                    document_id=prior.id if prior else None,
+                    topic_name=prior.topic_name if prior else None,
+                    matched_pages=len(pages),
+                    similarity=float(np.mean(list(pages.values()))),
+                )
+            )
+        matches.sort(key=lambda match: (-match.matched_pages, -match.similarity))
+        document.prior_matches = matches[:max_matches]
@@ -1,98 +1,274 @@
 import os
-import shutil
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from loguru import logger
 
-from .domain_models import Document, PageInfo
-from .ml_models.clustering import perform_agglomerative_clustering
-from .ml_models.embedding import (generate_embeddings, load_embeddings,
-                                  save_embeddings)
+from .checkpoints import (CheckpointStore, StageCheckpoint, checkpoint_key,
+                          file_sha256)
+from .domain_models import Document, PageInfo, SplitManifest
+from .ml_models.clustering import SEGMENTATION_STRATEGIES, perform_segmentation
+from .ml_models.embedding import generate_embeddings, get_embeddings_file_path
+from .ml_models.embedding_backends import get_embedding_backend
+from .ml_models.page_index import find_prior_matches, open_page_index
 from .processors.document_processor import (assign_topics_to_documents,
-                                            create_documents)
-from .processors.pdf_processor import PDFMerger
+                                            create_documents,
+                                            create_split_manifest)
+from .processors.ocr_cache import OCRCache
+from .processors.pdf_processor import SplitMaterializer
 from .processors.text_extractor import TextExtractor
+from .processors.text_preparation import TokenReport, prepare_texts
 from .settings import settings
+from .workspace import Workspace, clear_directory
 
 
 class Pipeline:
-    def __init__(self, input_file: str, distance_threshold: float) -> None:
-        """Initialize the Pipeline with the input file and text extractor."""
+    def __init__(
+        self,
+        input_file: str,
+        distance_threshold: float,
+        strategy: str = settings.SEGMENTATION_STRATEGY,
+        ocr_backend: str = settings.OCR_BACKEND,
+        embedding_backend: str = settings.EMBEDDING_BACKEND,
+        workspace: Optional[Workspace] = None,
+        ocr_cache: Optional[OCRCache] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+        job_id: Optional[str] = None,
+        source_name: Optional[str] = None,
+        page_index: bool = settings.PAGE_INDEX_ENABLED,
+    ) -> None:
+        """
+        Initialize the Pipeline with the input file and text extractor.
+
+        The distance threshold is the split level passed to the segmentation
+        strategy, see `perform_segmentation`. The OCR backend is a name or route
+        understood by `get_ocr_backend`, the embedding backend a name understood
+        by `get_embedding_backend`. Runs sharing a process pass their own
+        workspace, and may share one OCR cache and page executor. With the page
+        index, the job ID and source name identify the run's pages in it, and
+        default to the SHA-256 and the file name of the input.
+        """
+        if strategy not in SEGMENTATION_STRATEGIES:
+            raise ValueError(f"Unknown segmentation strategy: {strategy}")
         self.input_file = input_file
         self.distance_threshold = distance_threshold
-        self.text_extractor = TextExtractor()
+        self.strategy = strategy
+        self.embedding_backend = embedding_backend
+        self.job_id = job_id
+        self.source_name = source_name or os.path.basename(input_file)
+        self.page_index = page_index
+        self.workspace = workspace or Workspace()
+        self.page_count = 0
+        self.token_report = TokenReport()
+        self.text_extractor = TextExtractor(
+            ocr_cache=ocr_cache,
+            ocr_backend=ocr_backend,
+            workspace=self.workspace,
+            executor=executor,
+        )
+
+    def run(self, clear_cache: bool = True) -> SplitManifest:
+        """
+        Execute the entire pipeline process and return the split manifest.
 
-    def run(self, clear_cache: bool = True) -> List[str]:
-        """Execute the entire pipeline process."""
+        No output PDFs are written. The manifest is saved in the workspace, and
+        the documents are written on demand by a `SplitMaterializer`, see
+        `create_pdf_documents`.
+
+        Every completed stage (page texts, embeddings, page labels and topics) is
+        checkpointed in the workspace. Without `clear_cache`, a rerun in the same
+        workspace resumes after the last valid checkpoint, and text extraction
+        resumes after the last page written. A checkpoint is only used if its
+        inputs and parameters are those of this run and its files are unchanged.
+        """
+        self.workspace.create()
         if clear_cache:
             logger.info("Clearing cache.")
             self.clear_cache()
+        checkpoints = CheckpointStore(self.workspace.checkpoint_dir)
 
-        logger.info("Extracting texts from PDFs.")
-        self.text_extractor.extract_texts_from_pdfs(self.input_file)
+        texts_checkpoint = self.extract_texts(checkpoints)
 
         logger.info("Reading extracted texts.")
         texts = self.text_extractor.read_extracted_texts()
+        self.page_count = len(texts)
         logger.info(f"Number of texts extracted: {len(texts)}")
+        # Normalized texts are what the embedding and topic models see
+        self.token_report = TokenReport()
+        texts = prepare_texts(texts, self.token_report)
 
-        logger.info("Generating embeddings.")
-        embeddings = generate_embeddings(self.input_file, texts)
-        save_embeddings(self.input_file, embeddings)
-        embeddings = load_embeddings(self.input_file)
+        embeddings, embeddings_checkpoint = self.embed_texts(
+            checkpoints, texts_checkpoint, texts
+        )
 
         page_infos = self.create_page_infos(embeddings)
 
-        logger.info("Performing clustering.")
-        clusters = perform_agglomerative_clustering(
-            embeddings, distance_threshold=self.distance_threshold
+        clusters, clusters_checkpoint = self.segment_pages(
+            checkpoints, embeddings_checkpoint, embeddings
         )
 
         documents = create_documents(page_infos, clusters)
 
         logger.info(f"Number of documents created: {len(documents)}")
-        logger.info("Assigning topics to documents.")
-        documents = assign_topics_to_documents(documents, texts)
+        documents = self.assign_topics(
+            checkpoints, clusters_checkpoint, documents, texts
+        )
 
         self.output_pdf_split_results(documents)
+        self.token_report.log()
 
-        output_files = self.create_pdf_documents(documents)
+        manifest = create_split_manifest(self.input_file, documents, len(texts))
+        if self.page_index:
+            self.match_prior_bundles(manifest, embeddings)
+        manifest.save(self.workspace.manifest_path)
 
         logger.info("Pipeline execution completed.")
-        return output_files
+        return manifest
 
-    def clear_cache(self) -> None:
-        """Clear the temporary and output directories and delete .pkl files from data/."""
-        directories_to_clear = [
-            settings.TEMP_PDF_PAGES_DIR,
-            settings.TEMP_IMAGE_DIR,
-            settings.TXT_OUTPUT_DIR,
-            settings.OUTPUT_DOCS_DIR,
-        ]
-        for directory in directories_to_clear:
-            if os.path.exists(directory):
-                for filename in os.listdir(directory):
-                    file_path = os.path.join(directory, filename)
-                    try:
-                        if os.path.isfile(file_path) or os.path.islink(file_path):
-                            os.unlink(file_path)
-                        elif os.path.isdir(file_path):
-                            shutil.rmtree(file_path)
-                    except Exception as e:
-                        logger.error(f"Failed to delete {file_path}. Reason: {e}")
+    def extract_texts(self, checkpoints: CheckpointStore) -> StageCheckpoint:
+        """Extract the page texts unless checkpointed, resuming by page."""
+        key = checkpoint_key(
+            file_sha256(self.input_file),
+            self.text_extractor.ocr.name,
+            self.text_extractor.render_profile,
+            self.text_extractor.page_filter is not None,
+        )
+        checkpoint = checkpoints.load("texts", key)
+        if checkpoint is not None:
+            return checkpoint
+
+        journal = checkpoints.page_journal(key)
+        if not len(journal):
+            # Texts of another input must not be read as pages of this one
+            clear_directory(self.workspace.txt_output_dir)
+        logger.info("Extracting texts from PDFs.")
+        self.text_extractor.extract_texts_from_pdfs(self.input_file, journal)
+        return checkpoints.save("texts", key, self.text_extractor.list_text_files())
+
+    def embed_texts(
+        self,
+        checkpoints: CheckpointStore,
+        texts_checkpoint: StageCheckpoint,
+        texts: List[str],
+    ) -> Tuple[np.ndarray, StageCheckpoint]:
+        """Generate the page embeddings unless checkpointed."""
+        key = checkpoint_key(
+            texts_checkpoint.digest,
+            self.embedding_backend,
+            settings.TEXT_NORMALIZATION_ENABLED,
+            settings.EMBEDDING_MAX_TOKENS,
+        )
+        checkpoint = checkpoints.load("embeddings", key)
+        embeddings_file = get_embeddings_file_path(
+            self.input_file, self.workspace.embeddings_dir
+        )
+        if checkpoint is None and os.path.exists(embeddings_file):
+            # Embeddings of other texts would otherwise be loaded as they are
+            os.remove(embeddings_file)
+
+        logger.info("Generating embeddings.")
+        embeddings = generate_embeddings(
+            self.input_file,
+            texts,
+            backend=self.embedding_backend,
+            directory=self.workspace.embeddings_dir,
+            report=self.token_report,
+        )
+        if checkpoint is None:
+            checkpoint = checkpoints.save("embeddings", key, [embeddings_file])
+        return embeddings, checkpoint
+
+    def segment_pages(
+        self,
+        checkpoints: CheckpointStore,
+        embeddings_checkpoint: StageCheckpoint,
+        embeddings: np.ndarray,
+    ) -> Tuple[np.ndarray, StageCheckpoint]:
+        """Label every page with its document unless checkpointed."""
+        key = checkpoint_key(
+            embeddings_checkpoint.digest, self.strategy, self.distance_threshold
+        )
+        checkpoint = checkpoints.load("segmentation", key)
+        if checkpoint is not None:
+            return np.array(checkpoints.load_data("clusters.json")), checkpoint
+
+        logger.info(f"Performing {self.strategy} segmentation.")
+        clusters = perform_segmentation(
+            embeddings, strategy=self.strategy, split_level=self.distance_threshold
+        )
+        path = checkpoints.save_data("clusters.json", [int(c) for c in clusters])
+        return clusters, checkpoints.save("segmentation", key, [path])
+
+    def assign_topics(
+        self,
+        checkpoints: CheckpointStore,
+        clusters_checkpoint: StageCheckpoint,
+        documents: Dict[int, Document],
+        texts: List[str],
+    ) -> Dict[int, Document]:
+        """
+        Assign a topic to every document that has no checkpointed topic.
+
+        Only generated topics are checkpointed. Documents whose topic call failed
+        keep their "Cluster N" name for this run, and are retried on resume.
+        """
+        key = checkpoint_key(
+            clusters_checkpoint.digest,
+            settings.TEXT_NORMALIZATION_ENABLED,
+            settings.TOPIC_MODEL,
+            settings.TOPIC_MAX_TOKENS,
+        )
+        topics = {}
+        if checkpoints.load("topics", key) is not None:
+            topics = checkpoints.load_data("topics.json")
+        pending = {}
+        for cluster, document in documents.items():
+            if str(cluster) in topics:
+                document.topic_name = topics[str(cluster)]
             else:
-                logger.warning(f"Directory {directory} does not exist.")
-
-        data_directory = "data"
-        if os.path.exists(data_directory):
-            for filename in os.listdir(data_directory):
-                if filename.endswith(".pkl"):
-                    file_path = os.path.join(data_directory, filename)
-                    try:
-                        os.unlink(file_path)
-                    except Exception as e:
-                        logger.error(f"Failed to delete {file_path}. Reason: {e}")
-        else:
-            logger.warning(f"Directory {data_directory} does not exist.")
+                pending[cluster] = document
+        if not pending:
+            return documents
+
+        logger.info(f"Assigning topics to {len(pending)} documents.")
+        failed: List[int] = []
+        assign_topics_to_documents(
+            pending, texts, report=self.token_report, failed=failed
+        )
+        if failed:
+            logger.warning(
+                f"No topic for {len(failed)} documents, they are retried on resume"
+            )
+        for cluster, document in pending.items():
+            if cluster not in failed:
+                topics[str(cluster)] = document.topic_name
+        path = checkpoints.save_data("topics.json", topics)
+        checkpoints.save("topics", key, [path])
+        return documents
+
+    def match_prior_bundles(
+        self, manifest: SplitManifest, embeddings: np.ndarray
+    ) -> None:
+        """Find the documents' matches in earlier bundles, then index these pages."""
+        backend = get_embedding_backend(self.embedding_backend)
+        if not backend.shared_space:
+            logger.info(f"Not indexing pages embedded by {backend.model}.")
+            return
+        job_id = self.job_id or file_sha256(self.input_file)
+        try:
+            index = open_page_index(backend.model)
+            logger.info("Searching earlier bundles for the documents.")
+            # The job's own pages are indexed already if it was interrupted before
+            find_prior_matches(index, embeddings, manifest.documents, job_id)
+            index.add(job_id, self.source_name, embeddings, manifest.documents)
+        except (OSError, ValueError) as e:
+            # The split is still good without its matches
+            logger.warning(f"Page index unavailable: {e}")
+
+    def clear_cache(self) -> None:
+        """Clear the temporary, output and checkpoint directories of the workspace."""
+        self.workspace.clear()
 
     def output_pdf_split_results(self, documents_dict: Dict[int, Document]) -> None:
         """Print the clustering results for each document."""
@@ -101,21 +277,17 @@ class Pipeline:
                 f"Document ID: {document.id}, Topic: {document.topic_name}, Page Range: {document.page_range}"
             )
 
-    def create_pdf_documents(self, documents: Dict[int, Document]) -> List[str]:
-        """Create PDF documents from the clustered pages and return their paths."""
-        pdf_merger = PDFMerger(self.input_file)
-        output_files = []
-        for id, document in documents.items():
-            output_file = os.path.join(
-                settings.OUTPUT_DOCS_DIR, f"document_{id}_{document.topic_name}.pdf"
-            )
-            page_numbers = [page.page_number for page in document.pages]
-            pdf_merger.merge_pages(page_numbers, output_file)
-            output_files.append(output_file)
-        output_files.sort()
-        return output_files
+    def create_pdf_documents(self, manifest: SplitManifest) -> List[str]:
+        """
+        Create every PDF document of the manifest and return their paths.
+
+        Documents are written under a directory named by the manifest's digest,
+        so a rerun with another split never reuses the files of an earlier one.
+        """
+        output_dir = os.path.join(self.workspace.output_docs_dir, manifest.digest)
+        return SplitMaterializer(manifest, output_dir).materialize_all()
 
-    def create_page_infos(self, embeddings: List) -> List[PageInfo]:
+    def create_page_infos(self, embeddings: np.ndarray) -> List[PageInfo]:
         """Create PageInfo objects from the embeddings."""
         return [
             PageInfo(input_pdf_path=self.input_file, page_number=i, embedding=embedding)
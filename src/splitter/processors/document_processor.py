@@ -1,16 +1,19 @@
 import random
 import uuid
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 from loguru import logger
 from openai import OpenAI
 from pydantic import BaseModel, Field
 
-from ..domain_models import Document, PageInfo
+from ..api_scheduler import get_scheduler
+from ..domain_models import Document, PageInfo, SplitDocument, SplitManifest
 from ..settings import settings
+from .text_preparation import TokenReport, fit_to_budget, get_token_counter
 
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# Retries are handled by the shared API scheduler
+openai_client = OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
 
 
 class TopicName(BaseModel):
@@ -19,8 +22,10 @@ class TopicName(BaseModel):
 
 def generate_topic(text: str) -> str:
     """Generate a topic for the given text."""
-    completion = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
+    completion = get_scheduler().call(
+        "topic",
+        openai_client.beta.chat.completions.parse,
+        model=settings.TOPIC_MODEL,
         messages=[
             {
                 "role": "system",
@@ -68,10 +73,23 @@ def create_documents(
 
 
 def assign_topics_to_documents(
-    documents_dict: Dict[int, Document], texts: List[str], strategy: str = "first_page"
+    documents_dict: Dict[int, Document],
+    texts: List[str],
+    strategy: str = "first_page",
+    max_tokens: int = settings.TOPIC_MAX_TOKENS,
+    report: Optional[TokenReport] = None,
+    failed: Optional[List[int]] = None,
 ) -> Dict[int, Document]:
-    """Assign topics to documents based on the given strategy."""
-    for document in documents_dict.values():
+    """
+    Assign topics to documents based on the given strategy.
+
+    The page texts of each prompt are trimmed to share `max_tokens` tokens, and
+    the prompt tokens before and after trimming are added to the report. Documents
+    whose topic could not be generated keep their name, and their keys are
+    appended to `failed`.
+    """
+    counter = get_token_counter(settings.TOPIC_MODEL)
+    for cluster, document in documents_dict.items():
         try:
             if strategy == "random_sample":
                 # Randomly select up to 5 pages from each document
@@ -79,15 +97,50 @@ def assign_topics_to_documents(
                     document.pages, min(5, len(document.pages))
                 )
                 page_texts = [texts[page.page_number] for page in selected_pages]
-                combined_text = " ".join(page_texts)
-                document.topic_name = generate_topic(combined_text)
             elif strategy == "first_page":
                 # Select the first page from each document
                 first_page = document.pages[0]
-                page_text = texts[first_page.page_number]
-                document.topic_name = generate_topic(page_text)
+                page_texts = [texts[first_page.page_number]]
             else:
                 raise ValueError(f"Unknown strategy: {strategy}")
+            prompt_text = fit_to_budget(page_texts, counter, max_tokens)
+            if report is not None:
+                report.topic_prompt_tokens += counter.count(" ".join(page_texts))
+                report.topic_sent_tokens += counter.count(prompt_text)
+            document.topic_name = generate_topic(prompt_text)
         except Exception as e:
             logger.error(f"An unexpected error occurred: {e}")
+            if failed is not None:
+                failed.append(cluster)
     return documents_dict
+
+
+def page_number_ranges(page_numbers: List[int]) -> List[Tuple[int, int]]:
+    """Collapse page numbers into inclusive ranges of consecutive pages."""
+    ranges: List[Tuple[int, int]] = []
+    for page_number in sorted(page_numbers):
+        if ranges and page_number == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number, page_number))
+    return ranges
+
+
+def create_split_manifest(
+    input_file: str, documents_dict: Dict[int, Document], page_count: int
+) -> SplitManifest:
+    """Describe the split documents by their topics and page ranges."""
+    return SplitManifest(
+        input_file=input_file,
+        page_count=page_count,
+        documents=[
+            SplitDocument(
+                id=id,
+                topic_name=document.topic_name,
+                page_ranges=page_number_ranges(
+                    [page.page_number for page in document.pages]
+                ),
+            )
+            for id, document in documents_dict.items()
+        ],
+    )
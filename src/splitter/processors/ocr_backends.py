@@ -0,0 +1,262 @@
+import base64
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..api_scheduler import (RetryableError, get_scheduler,
+                             raise_for_retryable_status)
+from ..settings import settings
+from .render_profiles import (ADAPTIVE, choose_render_profile, encode_image,
+                              get_render_profile, prepare_image)
+
+ROUTE_SEPARATOR = ">"
+
+
+class OCRResult(BaseModel):
+    text: str = Field(..., description="The text recognized in the image")
+    confidence: Optional[float] = Field(
+        None, description="Mean recognition confidence from 0 to 1, if reported"
+    )
+
+
+class OCRBackend(ABC):
+    """Recognizes the text in a rendered page image."""
+
+    name: str
+
+    def __init__(self, render_profile: str = settings.RENDER_PROFILE):
+        """Initialize the backend with the render profile used to prepare images."""
+        self.render_profile = render_profile
+
+    @abstractmethod
+    def recognize(self, image: np.ndarray) -> OCRResult:
+        """Recognize the text in a single page image."""
+
+
+class VisionOCRBackend(OCRBackend):
+    """Google Cloud Vision text detection."""
+
+    name = "vision"
+
+    def recognize(self, image: np.ndarray) -> OCRResult:
+        content = base64.b64encode(encode_image(image, self.render_profile))
+        request_body = {
+            "requests": [
+                {
+                    "image": {"content": content.decode("utf-8")},
+                    "features": [{"type": "TEXT_DETECTION"}],
+                }
+            ]
+        }
+        # Throttled and failed requests are retried until retries run out,
+        # then raised rather than silently losing the page's text
+        response = get_scheduler().call("ocr", self._post, request_body)
+
+        if response.status_code != 200:
+            logger.error(f"Error: {response.status_code}, {response.text}")
+            return OCRResult(text="")
+        result = response.json()["responses"][0]
+        if "textAnnotations" not in result:
+            logger.debug("No text detected in the image.")
+            return OCRResult(text="")
+        return OCRResult(text=result["textAnnotations"][0]["description"])
+
+    @staticmethod
+    def _post(request_body: dict):
+        """
+        Send a Vision API request, raising RetryableError on 429 and 5xx, and on
+        connection failures and timeouts, as for the OpenAI client.
+        """
+        import requests
+
+        url = (
+            "https://vision.googleapis.com/v1/images:annotate?key="
+            + settings.GOOGLE_API_KEY
+        )
+        try:
+            response = requests.post(
+                url, json=request_body, timeout=settings.OCR_REQUEST_TIMEOUT
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+        raise_for_retryable_status(response)
+        return response
+
+
+class TextractOCRBackend(OCRBackend):
+    """Amazon Textract document text detection. Requires boto3."""
+
+    name = "textract"
+
+    def __init__(self, render_profile: str = settings.RENDER_PROFILE):
+        super().__init__(render_profile)
+        import boto3
+
+        self.client = boto3.client(
+            "textract",
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None,
+            region_name=settings.AWS_REGION or None,
+        )
+
+    def recognize(self, image: np.ndarray) -> OCRResult:
+        image_bytes = encode_image(image, self.render_profile)
+        response = get_scheduler().call("textract", self._detect, image_bytes)
+
+        lines = [b for b in response["Blocks"] if b["BlockType"] == "LINE"]
+        if not lines:
+            logger.debug("No text detected in the image.")
+            return OCRResult(text="")
+        return OCRResult(
+            text=" ".join(line["Text"] for line in lines),
+            confidence=float(np.mean([line["Confidence"] for line in lines])) / 100,
+        )
+
+    def _detect(self, image_bytes: bytes) -> dict:
+        """Call Textract, raising RetryableError when throttled."""
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.detect_document_text(Document={"Bytes": image_bytes})
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if code in (
+                "ThrottlingException",
+                "ProvisionedThroughputExceededException",
+            ):
+                raise RetryableError(code, throttled=True) from e
+            if code == "InternalServerError":
+                raise RetryableError(code) from e
+            raise
+
+
+def _run_tesseract(image: np.ndarray, lang: str) -> Tuple[str, Optional[float]]:
+    """Run Tesseract on an image in a worker process and return text and confidence."""
+    import pytesseract
+
+    data = pytesseract.image_to_data(
+        image, lang=lang, output_type=pytesseract.Output.DICT
+    )
+    lines: Dict[Tuple[int, int, int], list] = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if confidence < 0 or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        confidences.append(confidence)
+    text = "\n".join(" ".join(words) for words in lines.values())
+    confidence = float(np.mean(confidences)) / 100 if confidences else None
+    return text, confidence
+
+
+class TesseractOCRBackend(OCRBackend):
+    """
+    Local Tesseract OCR running in a shared process pool.
+
+    Pages never leave the machine, so small jobs skip the network round trip and
+    the pipeline can run offline. Requires the tesseract binary.
+    """
+
+    name = "tesseract"
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    def __init__(
+        self,
+        render_profile: str = settings.RENDER_PROFILE,
+        lang: str = settings.TESSERACT_LANG,
+    ):
+        super().__init__(render_profile)
+        self.lang = lang
+
+    @classmethod
+    def executor(cls) -> ProcessPoolExecutor:
+        """Return the process pool shared by every Tesseract backend."""
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=settings.TESSERACT_PROCESSES or os.cpu_count()
+                )
+            return cls._executor
+
+    def recognize(self, image: np.ndarray) -> OCRResult:
+        if self.render_profile == ADAPTIVE:
+            profile = choose_render_profile(image)
+        else:
+            profile = get_render_profile(self.render_profile)
+        image = prepare_image(image, profile)
+        text, confidence = (
+            self.executor().submit(_run_tesseract, image, self.lang).result()
+        )
+        return OCRResult(text=text, confidence=confidence)
+
+
+class RoutingOCRBackend(OCRBackend):
+    """
+    Tries a primary backend first and only falls back for low-confidence pages.
+
+    With a local primary and a cloud fallback, e.g. "tesseract>vision", most
+    pages never leave the machine and the cloud is only paid for hard pages.
+    """
+
+    def __init__(
+        self,
+        primary: OCRBackend,
+        fallback: OCRBackend,
+        min_confidence: float = settings.OCR_FALLBACK_MIN_CONFIDENCE,
+    ):
+        super().__init__(primary.render_profile)
+        self.name = f"{primary.name}{ROUTE_SEPARATOR}{fallback.name}"
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+
+    def recognize(self, image: np.ndarray) -> OCRResult:
+        result = self.primary.recognize(image)
+        if result.confidence is not None and result.confidence >= self.min_confidence:
+            return result
+        logger.debug(
+            f"{self.primary.name} confidence {result.confidence} is below "
+            f"{self.min_confidence}, falling back to {self.fallback.name}."
+        )
+        return self.fallback.recognize(image)
+
+
+OCR_BACKENDS = {
+    backend.name: backend
+    for backend in (VisionOCRBackend, TextractOCRBackend, TesseractOCRBackend)
+}
+
+_backends: Dict[Tuple[str, str], OCRBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_ocr_backend(
+    name: str = settings.OCR_BACKEND, render_profile: str = settings.RENDER_PROFILE
+) -> OCRBackend:
+    """
+    Return the shared OCR backend for a name such as "vision" or a route such as
+    "tesseract>vision" (try tesseract, fall back to vision on low confidence).
+    """
+    with _backends_lock:
+        key = (name, render_profile)
+        if key not in _backends:
+            backends = []
+            for part in name.split(ROUTE_SEPARATOR):
+                if part not in OCR_BACKENDS:
+                    raise ValueError(f"Unknown OCR backend: {part}")
+                backends.append(OCR_BACKENDS[part](render_profile=render_profile))
+            backend = backends[-1]
+            for primary in reversed(backends[:-1]):
+                backend = RoutingOCRBackend(primary, backend)
+            _backends[key] = backend
+        return _backends[key]
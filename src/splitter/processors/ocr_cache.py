@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from ..settings import settings
+
+# Least recently used entries fetched at a time when evicting
+EVICT_BATCH_ROWS = 256
+# Eviction frees space down to this share of max_bytes, so it runs in batches
+EVICT_TO_RATIO = 0.9
+
+
+class OCRCache:
+    """
+    Persistent cache of OCR text keyed by page fingerprint.
+
+    Entries live in a SQLite file so they survive restarts and can be shared by
+    every worker on the host. When the stored text exceeds `max_bytes`, the least
+    recently used entries are evicted. The total size is kept up to date by
+    triggers in the database, so checking it never scans the cache.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.OCR_CACHE_PATH,
+        max_bytes: int = settings.OCR_CACHE_MAX_BYTES,
+    ):
+        """Open (or create) the cache database at the given path."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_text (
+                fingerprint TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS ocr_text_last_used ON ocr_text (last_used)"
+        )
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_text_total (size INTEGER NOT NULL)"
+            )
+            for trigger in (
+                "ocr_text_insert AFTER INSERT ON ocr_text BEGIN UPDATE "
+                "ocr_text_total SET size = size + new.size; END",
+                "ocr_text_delete AFTER DELETE ON ocr_text BEGIN UPDATE "
+                "ocr_text_total SET size = size - old.size; END",
+                "ocr_text_update AFTER UPDATE OF size ON ocr_text BEGIN UPDATE "
+                "ocr_text_total SET size = size + new.size - old.size; END",
+            ):
+                self._connection.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger}")
+            # Caches written before the total was kept are summed once
+            self._connection.execute(
+                """
+                INSERT INTO ocr_text_total
+                SELECT COALESCE(SUM(size), 0) FROM ocr_text
+                WHERE NOT EXISTS (SELECT 1 FROM ocr_text_total)
+                """
+            )
+            self._connection.execute("COMMIT")
+        except sqlite3.Error:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Return the cached text for the fingerprint, or None on a miss."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text FROM ocr_text WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE ocr_text SET last_used = ? WHERE fingerprint = ?",
+                (time.time(), fingerprint),
+            )
+        return row[0]
+
+    def put(self, fingerprint: str, text: str) -> None:
+        """Store the text for the fingerprint and evict old entries if needed."""
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE, which skips delete triggers
+            self._connection.execute(
+                """
+                INSERT INTO ocr_text VALUES (?, ?, ?, ?)
+                ON CONFLICT (fingerprint) DO UPDATE SET
+                    text = excluded.text,
+                    size = excluded.size,
+                    last_used = excluded.last_used
+                """,
+                (fingerprint, text, size, time.time()),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries once the cache is over max_bytes."""
+        (total,) = self._connection.execute(
+            "SELECT size FROM ocr_text_total"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO_RATIO
+        evicted = 0
+        while total > target:
+            rows = self._connection.execute(
+                "SELECT fingerprint, size FROM ocr_text ORDER BY last_used LIMIT ?",
+                (EVICT_BATCH_ROWS,),
+            ).fetchall()
+            if not rows:
+                break
+            stale = []
+            for fingerprint, size in rows:
+                if total <= target:
+                    break
+                stale.append((fingerprint,))
+                total -= size
+            self._connection.executemany(
+                "DELETE FROM ocr_text WHERE fingerprint = ?", stale
+            )
+            evicted += len(stale)
+        logger.debug(f"Evicted {evicted} entries from the OCR cache.")
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
@@ -0,0 +1,169 @@
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+import cv2
+import numpy as np
+from pydantic import BaseModel, Field
+
+from ..settings import settings
+from .render_profiles import to_gray
+
+CONTENT = "content"
+BLANK = "blank"
+DUPLICATE = "duplicate"
+
+
+class PageFilterResult(BaseModel):
+    page_number: int = Field(..., description="The page number within the PDF")
+    status: str = Field(..., description="One of 'content', 'blank' or 'duplicate'")
+    duplicate_of: Optional[int] = Field(
+        None, description="The page number of the first copy of a duplicate page"
+    )
+
+
+class PageFilter:
+    """
+    Cheap prefilter that runs on rendered pages before OCR.
+
+    Blank pages (blank backs, slip sheets) are detected from pixel statistics and
+    near-duplicate pages (repeated fax covers) from a perceptual difference hash.
+    The filter is thread-safe, so pages can be rendered and hashed concurrently.
+    Pages announced to `reset` are compared in page order, so the copy that is kept
+    (and sent to OCR) is always the first one, whichever thread finishes first.
+    """
+
+    def __init__(
+        self,
+        blank_max_ink_ratio: float = settings.BLANK_PAGE_MAX_INK_RATIO,
+        ink_level: int = settings.BLANK_PAGE_INK_LEVEL,
+        hash_size: int = settings.DUPLICATE_HASH_SIZE,
+        duplicate_max_distance: int = settings.DUPLICATE_HASH_MAX_DISTANCE,
+    ):
+        """Initialize the PageFilter with its blank and duplicate thresholds."""
+        # The hash is packed into 64-bit words
+        if hash_size <= 0 or hash_size % 8:
+            raise ValueError(f"Hash size must be a multiple of 8, got {hash_size}")
+        self.blank_max_ink_ratio = blank_max_ink_ratio
+        self.ink_level = ink_level
+        self.hash_size = hash_size
+        self.duplicate_max_distance = duplicate_max_distance
+        self.stats: Counter = Counter()
+        self.results: Dict[int, PageFilterResult] = {}
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._hashes = np.empty((0, hash_size * hash_size // 64), dtype=np.uint64)
+        self._hash_pages: list = []
+        self._announced: set = set()
+        self._order: list = []
+        self._next = 0
+        self._done: set = set()
+
+    def reset(self, page_numbers: Optional[Iterable[int]] = None) -> None:
+        """
+        Forget all pages seen so far, e.g. before processing a new input file.
+
+        Parameters
+        ----------
+        page_numbers : Optional[Iterable[int]]
+            The pages about to be processed. Each of them waits for the pages before
+            it to be classified or skipped, so every one of them must eventually be
+            passed to `classify` or `skip`. Other pages are compared as they come.
+        """
+        with self._lock:
+            self.stats.clear()
+            self.results = {}
+            self._hashes = self._hashes[:0]
+            self._hash_pages = []
+            self._announced = set(page_numbers or ())
+            self._order = sorted(self._announced)
+            self._next = 0
+            self._done = set()
+            self._turn.notify_all()
+
+    def skip(self, page_number: int) -> None:
+        """Let the pages after a page go on without classifying it (no-op if done)."""
+        with self._lock:
+            self._mark_done(page_number)
+
+    def classify(self, page_number: int, image: np.ndarray) -> PageFilterResult:
+        """
+        Classify a rendered page as content, blank or a duplicate of an earlier page.
+
+        Parameters
+        ----------
+        page_number : int
+            The page number within the PDF.
+        image : np.ndarray
+            The rendered page as a grayscale or RGB array.
+
+        Returns
+        -------
+        PageFilterResult
+            The classification of the page.
+        """
+        gray = to_gray(image)
+        page_hash = None if self.is_blank(gray) else self.perceptual_hash(gray)
+
+        with self._turn:
+            self._turn.wait_for(lambda: self._is_turn_of(page_number))
+            if page_hash is None:
+                result = PageFilterResult(page_number=page_number, status=BLANK)
+            else:
+                duplicate_of = self._find_duplicate(page_hash)
+                if duplicate_of is None:
+                    self._hashes = np.vstack([self._hashes, page_hash])
+                    self._hash_pages.append(page_number)
+                    result = PageFilterResult(page_number=page_number, status=CONTENT)
+                else:
+                    result = PageFilterResult(
+                        page_number=page_number,
+                        status=DUPLICATE,
+                        duplicate_of=duplicate_of,
+                    )
+            self.stats[result.status] += 1
+            self.results[page_number] = result
+            self._mark_done(page_number)
+        return result
+
+    def is_blank(self, gray: np.ndarray) -> bool:
+        """Return whether the share of ink pixels away from the edges is negligible."""
+        height, width = gray.shape
+        # Scanner edges and punch holes are ignored, and every other pixel is plenty
+        margin_y, margin_x = height // 20, width // 20
+        body = gray[margin_y : height - margin_y : 2, margin_x : width - margin_x : 2]
+        if body.size == 0:
+            return True
+        ink_ratio = np.count_nonzero(body < self.ink_level) / body.size
+        return bool(ink_ratio <= self.blank_max_ink_ratio)
+
+    def perceptual_hash(self, gray: np.ndarray) -> np.ndarray:
+        """Compute a difference hash of the page packed into uint64 words."""
+        small = cv2.resize(
+            gray, (self.hash_size + 1, self.hash_size), interpolation=cv2.INTER_AREA
+        )
+        bits = small[:, 1:] > small[:, :-1]
+        return np.packbits(bits.ravel()).view(np.uint64)
+
+    def _is_turn_of(self, page_number: int) -> bool:
+        """Return whether every announced page before the page is done."""
+        if page_number not in self._announced or page_number in self._done:
+            return True
+        return self._order[self._next] == page_number
+
+    def _mark_done(self, page_number: int) -> None:
+        """Record a page as done and wake the pages waiting for it."""
+        self._done.add(page_number)
+        while self._next < len(self._order) and self._order[self._next] in self._done:
+            self._next += 1
+        self._turn.notify_all()
+
+    def _find_duplicate(self, page_hash: np.ndarray) -> Optional[int]:
+        """Return the page number of the closest earlier page within the distance."""
+        if not self._hash_pages:
+            return None
+        distances = np.bitwise_count(self._hashes ^ page_hash).sum(axis=1)
+        closest = int(np.argmin(distances))
+        if distances[closest] > self.duplicate_max_distance:
+            return None
+        return self._hash_pages[closest]
@@ -1,11 +1,84 @@
+import hashlib
 import os
-from typing import List
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from pypdf import PdfReader, PdfWriter
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import (ArrayObject, DictionaryObject, IndirectObject,
+                           PdfObject, StreamObject)
 
+from ..blob_store import BlobStore
+from ..domain_models import SplitDocument, SplitManifest
 from ..settings import settings
 
 
+def count_pdf_pages(source: Union[str, BinaryIO]) -> int:
+    """
+    Read the page count of a PDF from its page tree root.
+
+    Only the cross-reference table, the trailer and the root /Pages node are read,
+    no page or content stream is parsed, so this is cheap even for huge files.
+    """
+    reader = PdfReader(source)
+    return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+
+def page_fingerprint(page: PageObject) -> str:
+    """
+    Hash a page's content stream, the resources it draws with and its
+    annotations, with their appearance streams.
+
+    Two pages with the same fingerprint render identically, even when they come
+    from different files, so the fingerprint can key caches of per-page results.
+    Annotations matter because they are rendered too: filled-in forms, stamps
+    and comments on the same template page must not share a fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr([float(x) for x in page.mediabox]).encode())
+    digest.update(str(page.rotation).encode())
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    _hash_pdf_object(page.get("/Resources"), digest, set())
+    digest.update(b"annots")
+    _hash_pdf_object(page.get("/Annots"), digest, set())
+    return digest.hexdigest()
+
+
+def _hash_pdf_object(
+    obj: PdfObject, digest: "hashlib._Hash", visited: Set[Tuple[int, int]]
+) -> None:
+    """Recursively feed a PDF object into the digest, following references once."""
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in visited:
+            return
+        visited.add(key)
+        obj = obj.get_object()
+
+    # Annotations point back to their page, which must not pull in the document
+    if isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Page", "/Pages"):
+        digest.update(b"page")
+        return
+    if isinstance(obj, StreamObject):
+        digest.update(b"stream")
+        digest.update(obj.get_data())
+    if isinstance(obj, DictionaryObject):
+        for name in sorted(obj.keys()):
+            digest.update(name.encode())
+            _hash_pdf_object(obj.raw_get(name), digest, visited)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"[")
+        for item in obj:
+            _hash_pdf_object(item, digest, visited)
+        digest.update(b"]")
+    elif obj is not None:
+        digest.update(repr(obj).encode())
+
+
 class PDFMerger:
     def __init__(self, input_file: str):
         """Initialize the PDFMerger with the input file."""
@@ -29,21 +102,143 @@ class PDFMerger:
             writer.write(outfile)
 
 
+@contextmanager
+def atomic_output(path: str) -> Iterator[str]:
+    """
+    Yield a unique temporary path next to `path`, moved over it on success.
+
+    Concurrent writers of the same file each write their own temporary file, so
+    readers only ever see a complete file, whichever writer replaced it last.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=f".{os.path.basename(path)}.",
+        suffix=".tmp",
+    )
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class SplitMaterializer:
+    """
+    Writes the documents of a split manifest from the source PDF on demand.
+
+    Documents are only written when first requested, and a document or ZIP that
+    has already been written is reused, so a user downloading one document never
+    pays for the others. Files are written under a unique temporary name and
+    renamed, so concurrent requests, from this or another materializer (e.g. two
+    app sessions), and interrupted ones never leave a partial file behind.
+    Files are reused by name, so the output directory must belong to this
+    manifest, e.g. be named by its digest.
+
+    With a blob store, the source PDF is fetched from the store when the
+    manifest has an input key, and every file written is also stored under the
+    manifest's digest, so other hosts serve it without writing it again.
+    """
+
+    ZIP_FILE_NAME = "all_documents.zip"
+
+    def __init__(
+        self,
+        manifest: SplitManifest,
+        output_dir: str = settings.OUTPUT_DOCS_DIR,
+        blob_store: Optional[BlobStore] = None,
+    ):
+        """Initialize the materializer with the manifest and its output directory."""
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.blob_store = blob_store
+        self.documents = {document.id: document for document in manifest.documents}
+        self._merger = None
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def document_path(self, document: SplitDocument) -> str:
+        return os.path.join(self.output_dir, document.file_name)
+
+    def blob_key(self, file_name: str) -> str:
+        return f"outputs/{self.manifest.digest}/{file_name}"
+
+    def _fetch(self, path: str) -> bool:
+        """Download a file written on another host, if the blob store has it."""
+        if self.blob_store is None:
+            return False
+        key = self.blob_key(os.path.basename(path))
+        if not self.blob_store.exists(key):
+            return False
+        with atomic_output(path) as temp_path:
+            self.blob_store.get_file(key, temp_path)
+        return True
+
+    def _store(self, path: str) -> None:
+        if self.blob_store is not None:
+            self.blob_store.put_file(path, self.blob_key(os.path.basename(path)))
+
+    def _source_file(self) -> str:
+        if self.blob_store is not None and self.manifest.input_key:
+            return self.blob_store.get_cached_file(self.manifest.input_key)
+        return self.manifest.input_file
+
+    def is_materialized(self, document_id: int) -> bool:
+        return os.path.exists(self.document_path(self.documents[document_id]))
+
+    def materialize(self, document_id: int) -> str:
+        """Return the path of a split document, writing it if needed."""
+        document = self.documents[document_id]
+        output_file = self.document_path(document)
+        with self._lock:
+            if not os.path.exists(output_file) and not self._fetch(output_file):
+                if self._merger is None:
+                    self._merger = PDFMerger(self._source_file())
+                with atomic_output(output_file) as temp_file:
+                    self._merger.merge_pages(document.page_numbers, temp_file)
+                self._store(output_file)
+        return output_file
+
+    def materialize_all(self) -> List[str]:
+        """Return the paths of every split document, writing the missing ones."""
+        return sorted(self.materialize(id) for id in self.documents)
+
+    def materialize_zip(self) -> str:
+        """Return the path of a ZIP of every split document, writing it if needed."""
+        zip_path = os.path.join(self.output_dir, self.ZIP_FILE_NAME)
+        if os.path.exists(zip_path) or self._fetch(zip_path):
+            return zip_path
+        output_files = self.materialize_all()
+        with atomic_output(zip_path) as temp_path:
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                for output_file in output_files:
+                    zip_file.write(output_file, os.path.basename(output_file))
+        self._store(zip_path)
+        return zip_path
+
+
 class PDFSplitter:
-    def __init__(self, input_file):
+    def __init__(self, input_file, output_dir: str = settings.TEMP_PDF_PAGES_DIR):
         self.input_file = input_file
+        self.output_dir = output_dir
         self.file_name = os.path.splitext(os.path.basename(input_file))[0]
-        os.makedirs(settings.TEMP_PDF_PAGES_DIR, exist_ok=True)
+        self.page_fingerprints: Dict[str, str] = {}
+        os.makedirs(output_dir, exist_ok=True)
 
-    def run(self):
+    def run(self) -> List[str]:
+        """Write each page to its own PDF and return the page file paths in order."""
+        output_filenames = []
         with open(self.input_file, "rb") as infile:
             reader = PdfReader(infile)
             for i in range(len(reader.pages)):
+                page = reader.get_page(i)
                 writer = PdfWriter()
-                writer.add_page(reader.get_page(i))
+                writer.add_page(page)
 
-                output_filename = (
-                    f"{settings.TEMP_PDF_PAGES_DIR}/{self.file_name}_page_{i + 1}.pdf"
-                )
+                output_filename = f"{self.output_dir}/{self.file_name}_page_{i + 1}.pdf"
                 with open(output_filename, "wb") as outfile:
                     writer.write(outfile)
+                self.page_fingerprints[output_filename] = page_fingerprint(page)
+                output_filenames.append(output_filename)
+        return output_filenames
@@ -0,0 +1,136 @@
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+from pydantic import BaseModel, Field
+
+ADAPTIVE = "adaptive"
+
+
+class RenderProfile(BaseModel):
+    name: str = Field(..., description="Name of the profile")
+    dpi: int = Field(..., description="Resolution the PDF page is rendered at")
+    grayscale: bool = Field(False, description="Render a single gray channel")
+    binarize: bool = Field(
+        False, description="Threshold the page to black and white (Otsu)"
+    )
+    max_long_edge: Optional[int] = Field(
+        None, description="Downscale so the longer side is at most this many pixels"
+    )
+    image_format: str = Field("jpg", description="Upload encoding, 'jpg' or 'png'")
+    jpeg_quality: int = Field(95, description="JPEG quality from 0 to 100")
+    png_compression: int = Field(3, description="PNG compression level from 0 to 9")
+
+
+RENDER_PROFILES: Dict[str, RenderProfile] = {
+    # pdf2image and OpenCV defaults, as used before render profiles existed
+    "legacy": RenderProfile(name="legacy", dpi=200),
+    # Grayscale JPEG, suited to scans and pages with photos or shading
+    "ocr": RenderProfile(
+        name="ocr", dpi=150, grayscale=True, max_long_edge=2048, jpeg_quality=80
+    ),
+    # Black and white PNG, suited to clean printed text
+    "text": RenderProfile(
+        name="text",
+        dpi=150,
+        grayscale=True,
+        binarize=True,
+        max_long_edge=2048,
+        image_format="png",
+        png_compression=9,
+    ),
+    # Smallest payload, for large clear print
+    "compact": RenderProfile(
+        name="compact", dpi=100, grayscale=True, max_long_edge=1400, jpeg_quality=70
+    ),
+}
+
+# Pages are rendered once at this profile when the profile is chosen per page
+ADAPTIVE_RENDER_PROFILE = RenderProfile(name=ADAPTIVE, dpi=150, grayscale=True)
+# Share of mid-tone pixels above which a page is treated as a photo or scan
+ADAPTIVE_MIDTONE_RATIO = 0.05
+
+
+def get_render_profile(name: str) -> RenderProfile:
+    """Return the profile used to render pages for the given profile name."""
+    if name == ADAPTIVE:
+        return ADAPTIVE_RENDER_PROFILE
+    try:
+        return RENDER_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown render profile: {name}") from None
+
+
+def choose_render_profile(image: np.ndarray) -> RenderProfile:
+    """
+    Pick the cheapest profile that keeps a page legible for OCR.
+
+    Clean text pages are almost only paper and ink, so they binarize losslessly
+    into a small PNG. Pages with many mid-tones (photos, shading, noisy scans)
+    would lose strokes when binarized and are sent as grayscale JPEG instead.
+    """
+    gray = to_gray(image)
+    sample = gray[::4, ::4]
+    midtone_ratio = np.count_nonzero((sample > 64) & (sample < 192)) / sample.size
+    if midtone_ratio > ADAPTIVE_MIDTONE_RATIO:
+        return RENDER_PROFILES["ocr"]
+    return RENDER_PROFILES["text"]
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """Convert an RGB page to a single gray channel."""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2GRAY)
+
+
+def prepare_image(image: np.ndarray, profile: RenderProfile) -> np.ndarray:
+    """Apply the profile's color reduction and downscaling to a rendered page."""
+    if profile.grayscale or profile.binarize:
+        image = to_gray(image)
+
+    height, width = image.shape[:2]
+    if profile.max_long_edge and max(height, width) > profile.max_long_edge:
+        scale = profile.max_long_edge / max(height, width)
+        image = cv2.resize(
+            image,
+            (round(width * scale), round(height * scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    if profile.binarize:
+        _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return image
+
+
+def encode_image(image: np.ndarray, profile_name: str) -> bytes:
+    """
+    Prepare and encode a rendered page for upload to OCR.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The rendered page as a grayscale or RGB array.
+    profile_name : str
+        The render profile name, or "adaptive" to choose one from the page.
+
+    Returns
+    -------
+    bytes
+        The encoded JPEG or PNG image.
+    """
+    if profile_name == ADAPTIVE:
+        profile = choose_render_profile(image)
+    else:
+        profile = get_render_profile(profile_name)
+
+    image = prepare_image(image, profile)
+    if image.ndim == 3:
+        image = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2BGR)
+
+    if profile.image_format == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, profile.png_compression]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, profile.jpeg_quality]
+    _, encoded_image = cv2.imencode(f".{profile.image_format}", image, params)
+    return encoded_image.tobytes()
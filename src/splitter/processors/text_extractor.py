@@ -1,16 +1,24 @@
 import os
-import uuid
+import re
+import threading
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 
 import cv2
 import numpy as np
 from loguru import logger
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 
+from ..checkpoints import PageJournal
 from ..settings import settings
+from ..workspace import Workspace
+from .ocr_backends import get_ocr_backend
+from .ocr_cache import OCRCache
+from .page_filter import BLANK, CONTENT, DUPLICATE, PageFilter
 from .pdf_processor import PDFSplitter
+from .render_profiles import get_render_profile
 
 
 class TextExtractor:
@@ -18,36 +26,138 @@ class TextExtractor:
     Class for extracting text from PDF documents and images.
     """
 
-    def __init__(self, delete_temp_images: bool = True):
-        """Initializes the TextExtractor with a temporary image file directory."""
-        self.temp_image_dir = str(settings.TEMP_IMAGE_DIR)
+    def __init__(
+        self,
+        delete_temp_images: bool = True,
+        ocr_cache: Optional[OCRCache] = None,
+        page_filter: Optional[PageFilter] = None,
+        render_profile: str = settings.RENDER_PROFILE,
+        render_window: int = settings.RENDER_WINDOW_PAGES,
+        ocr_backend: str = settings.OCR_BACKEND,
+        workspace: Optional[Workspace] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        """
+        Initializes the TextExtractor with the workspace it writes page files to.
+
+        Pages are rendered and sent to OCR on `executor` when one is given, so
+        several extractors can share a pool, or on a pool per input otherwise.
+        """
+        self.workspace = workspace or Workspace()
+        self.temp_image_dir = self.workspace.temp_image_dir
+        self.txt_output_dir = self.workspace.txt_output_dir
+        self.executor = executor
         self.delete_temp_images = delete_temp_images
+        get_render_profile(render_profile)  # Fail early on unknown profile names
+        self.render_profile = render_profile
+        self.render_window = render_window
+        self.ocr = get_ocr_backend(ocr_backend, render_profile)
+        if ocr_cache is None and settings.OCR_CACHE_ENABLED:
+            ocr_cache = OCRCache()
+        self.ocr_cache = ocr_cache
+        if page_filter is None and settings.PAGE_FILTER_ENABLED:
+            page_filter = PageFilter()
+        self.page_filter = page_filter
+        self.ocr_cache_stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
         os.makedirs(self.temp_image_dir, exist_ok=True)
-        os.makedirs(settings.TXT_OUTPUT_DIR, exist_ok=True)
+        os.makedirs(self.txt_output_dir, exist_ok=True)
 
-    def extract_texts_from_pdfs(self, input_file: str) -> None:
+    def extract_texts_from_pdfs(
+        self, input_file: str, journal: Optional[PageJournal] = None
+    ) -> None:
         """
         Splits the input PDF into individual pages and extracts text from each page.
 
+        Pages whose fingerprint is already in the OCR cache are not rendered or
+        sent to OCR. Cache hits and misses for this input are kept in
+        `ocr_cache_stats`. Rendered pages then go through the page filter: blank
+        pages get empty text and near-duplicates reuse the first copy's text,
+        neither being sent to OCR.
+
         Parameters
         ----------
         input_file : str
             The path to the input PDF file.
+        journal : Optional[PageJournal]
+            Records every page as its text is written. Pages the journal already
+            holds, from an interrupted earlier run, are skipped.
         """
-        splitter = PDFSplitter(input_file)
-        splitter.run()
-        pdf_files: List[str] = [
-            os.path.join(settings.TEMP_PDF_PAGES_DIR, f)
-            for f in os.listdir(settings.TEMP_PDF_PAGES_DIR)
-            if f.endswith(".pdf")
+        splitter = PDFSplitter(input_file, self.workspace.temp_pdf_pages_dir)
+        pdf_files = splitter.run()
+        # Backends and render profiles read pages differently, so each keeps its
+        # own cache entries
+        profile = get_render_profile(self.render_profile)
+        fingerprints = [
+            f"{self.ocr.name}:{profile.name}@{profile.dpi}:"
+            f"{splitter.page_fingerprints[f]}"
+            for f in pdf_files
         ]
-        with ThreadPoolExecutor() as executor:
-            executor.map(
-                TextExtractor.convert_pdf_to_text,
-                pdf_files,
-            )
-            executor.shutdown(wait=True)
+        pages = list(range(len(pdf_files)))
+        if journal is not None:
+            pages = [
+                i for i in pages if not journal.is_done(self._text_path(pdf_files[i]))
+            ]
+            if len(pages) < len(pdf_files):
+                logger.info(
+                    f"Resuming text extraction: {len(pdf_files) - len(pages)} of "
+                    f"{len(pdf_files)} pages are already done"
+                )
+        self.ocr_cache_stats.clear()
+        if self.page_filter is not None:
+            self.page_filter.reset(pages)
+        if self.executor is not None:
+            self._map_pages(self.executor, pdf_files, fingerprints, pages, journal)
+        else:
+            with ThreadPoolExecutor() as executor:
+                self._map_pages(executor, pdf_files, fingerprints, pages, journal)
         logger.debug("extract_texts_from_pdfs: all threads complete")
+        if self.ocr_cache is not None:
+            logger.info(
+                f"OCR cache: {self.ocr_cache_stats['hits']} hits, "
+                f"{self.ocr_cache_stats['misses']} misses"
+            )
+        if self.page_filter is not None:
+            self._copy_duplicate_texts(pdf_files, fingerprints, journal)
+            logger.info(
+                f"Page filter skipped {self.page_filter.stats[BLANK]} blank and "
+                f"{self.page_filter.stats[DUPLICATE]} near-duplicate pages"
+            )
+
+    def _map_pages(
+        self,
+        executor: ThreadPoolExecutor,
+        pdf_files: List[str],
+        fingerprints: List[str],
+        pages: List[int],
+        journal: Optional[PageJournal] = None,
+    ) -> None:
+        """Extract the text of the given pages on the executor."""
+
+        def convert_page(page_number: int) -> None:
+            pdf_path = pdf_files[page_number]
+            try:
+                self.convert_pdf_to_text(
+                    pdf_path, fingerprints[page_number], page_number
+                )
+            finally:
+                # Cached and failed pages are never classified, and the later
+                # pages must not wait for them
+                if self.page_filter is not None:
+                    self.page_filter.skip(page_number)
+            # Duplicates only get their text once every page is done, so they are
+            # recorded by `_copy_duplicate_texts`
+            if journal is not None and not self._is_duplicate(page_number):
+                journal.record(self._text_path(pdf_path))
+
+        # Consume the results so that exceptions in threads are raised here
+        list(executor.map(convert_page, pages))
+
+    def _is_duplicate(self, page_number: int) -> bool:
+        if self.page_filter is None:
+            return False
+        result = self.page_filter.results.get(page_number)
+        return result is not None and result.status == DUPLICATE
 
     def read_extracted_texts(self) -> List[str]:
         """
@@ -58,17 +168,30 @@ class TextExtractor:
         List[str]
             A list of strings, each containing the text from a single page.
         """
-        text_files = [
-            os.path.join(settings.TXT_OUTPUT_DIR, f)
-            for f in os.listdir(settings.TXT_OUTPUT_DIR)
-            if f.endswith(".txt")
-        ]
         texts = []
-        for text_file in text_files:
+        for text_file in self.list_text_files():
             with open(text_file, "r") as file:
                 texts.append(file.read())
         return texts
 
+    def list_text_files(self) -> List[str]:
+        """
+        Lists the extracted text files in page order.
+
+        Returns
+        -------
+        List[str]
+            The path of the text file of every page.
+        """
+        return sorted(
+            (
+                os.path.join(self.txt_output_dir, f)
+                for f in os.listdir(self.txt_output_dir)
+                if f.endswith(".txt")
+            ),
+            key=self._page_sort_key,
+        )
+
     def extract_text_from_file(self, file_path: str) -> str:
         """
         Extracts text from files in the specified directory or from a single file.
@@ -96,7 +219,7 @@ class TextExtractor:
                 ):
                     logger.debug(f"File {file} is a supported format. Extracting text.")
                     new_text = self.extract_text_from_images(
-                        self.convert_file_to_images(Path(file_path, file).as_posix())
+                        self.iter_file_images(Path(file_path, file).as_posix())
                     )
                     if new_text:
                         logger.debug(f"Extracted text from {file}.")
@@ -111,60 +234,33 @@ class TextExtractor:
                 logger.debug(
                     f"File {file_path} is a supported format. Extracting text."
                 )
-                text = self.extract_text_from_images(
-                    self.convert_file_to_images(file_path)
-                )
+                text = self.extract_text_from_images(self.iter_file_images(file_path))
         logger.debug(f"Completed text extraction from file: {file_path}")
         return text
 
-    def extract_text_from_images_textract(self, image_list: List[np.ndarray]) -> str:
+    def extract_text_from_images(self, image_list: Iterable[np.ndarray]) -> str:
         """
-        Extracts text from a list of images using Amazon Textract.
+        Extracts text from a list of images.
 
         Parameters
         ----------
-        image_list : List[np.ndarray]
-            A list of images from which to extract text.
+        image_list : Iterable[np.ndarray]
+            The images from which to extract text. Generators are consumed one
+            image at a time, and each image is released once it is recognized.
 
         Returns
         -------
         str
             The extracted text.
         """
-        import base64
-        from typing import List
-
-        import boto3
-        import cv2
-        import numpy as np
-
-        logger.debug("Starting text extraction from images using Amazon Textract.")
-
-        # Initialize the Textract client
-        textract = boto3.client(
-            "textract",
-            aws_access_key_id="YOUR_ACCESS_KEY_ID",
-            aws_secret_access_key="YOUR_SECRET_ACCESS_KEY",
-            region_name="YOUR_REGION",
-        )  # e.g., 'us-west-2'
-
+        logger.debug(f"Starting text extraction from images with {self.ocr.name}.")
         text = []
         for image in image_list:
             logger.debug("Extracting text from an image.")
-            _, encoded_image = cv2.imencode(".jpg", image)
-            image_bytes = encoded_image.tobytes()
-
-            response = textract.detect_document_text(Document={"Bytes": image_bytes})
-
-            image_text = []
-            for item in response["Blocks"]:
-                if item["BlockType"] == "LINE":
-                    image_text.append(item["Text"])
-
-            if image_text:
-                text.append(" ".join(image_text))
-            else:
-                logger.debug("No text detected in the image.")
+            result = self.ocr.recognize(image)
+            del image
+            if result.text:
+                text.append(result.text)
 
         logger.debug("Filtering out short text segments.")
         text = [x for x in text if len(x) > 1]
@@ -172,94 +268,64 @@ class TextExtractor:
         logger.debug("Completed text extraction from images.")
         return text
 
-    def extract_text_from_images(self, image_list: List[np.ndarray]) -> str:
+    def convert_file_to_images(self, file_path: str) -> List[np.ndarray]:
         """
-        Extracts text from a list of images.
+        Converts files to images for text extraction.
 
         Parameters
         ----------
-        image_list : List[np.ndarray]
-            A list of images from which to extract text.
+        file_path : str
+            The path to the file to convert to an image.
 
         Returns
         -------
-        str
-            The extracted text.
+        List[np.ndarray]
+            A list of images in numpy array format.
         """
-        import base64
-
-        import requests
-
-        VISION_API_URL = (
-            "https://vision.googleapis.com/v1/images:annotate?key="
-            + settings.GOOGLE_API_KEY
-        )
-
-        logger.debug("Starting text extraction from images.")
-        text = []
-        for image in image_list:
-            logger.debug("encoding image")
-            _, encoded_image = cv2.imencode(".jpg", image)
-            content = base64.b64encode(encoded_image).decode("utf-8")
-            logger.debug("encoded image")
-            request_body = {
-                "requests": [
-                    {
-                        "image": {"content": content},
-                        "features": [{"type": "TEXT_DETECTION"}],
-                    }
-                ]
-            }
-            logger.debug("Extracting text from an image.")
-            response = requests.post(VISION_API_URL, json=request_body)
-
-            if response.status_code == 200:
-                result = response.json()
-                if "textAnnotations" in result["responses"][0]:
-                    words = result["responses"][0]["textAnnotations"][0]["description"]
-                    text.append(words)
-                else:
-                    logger.debug("No text detected in the image.")
-            else:
-                logger.error(f"Error: {response.status_code}, {response.text}")
-
-        logger.debug("Filtering out short text segments.")
-        text = [x for x in text if len(x) > 1]
-        text = "\n".join(text)
-        logger.debug("Completed text extraction from images.")
-        return text
+        return list(self.iter_file_images(file_path))
 
-    def convert_file_to_images(self, file_path: str) -> List[np.ndarray]:
+    def iter_file_images(self, file_path: str) -> Iterator[np.ndarray]:
         """
-        Converts files to images for text extraction.
+        Renders a file one window of pages at a time and yields each page image.
+
+        Only `render_window` pages are rendered at once, and each rendered page is
+        released as soon as the consumer moves on, so peak memory does not grow
+        with the page count of the file.
 
         Parameters
         ----------
         file_path : str
-            The path to the file to convert to an image.
+            The path to the file to convert to images.
 
-        Returns
-        -------
-        List[np.ndarray]
-            A list of images in numpy array format.
+        Yields
+        ------
+        np.ndarray
+            The image of each page in numpy array format.
         """
-        image_list = []
-        temp_files = []
         if file_path.endswith(".pdf"):
-            images = convert_from_path(file_path)
-            for page in images:
-                temp_image_filedir = os.path.join(
-                    self.temp_image_dir, f"{uuid.uuid4()}.jpg"
+            # Render at the profile's resolution straight to uncompressed files, so
+            # pages are not held by the poppler pipe or degraded by a JPEG round trip
+            profile = get_render_profile(self.render_profile)
+            page_count = pdfinfo_from_path(file_path)["Pages"]
+            for first_page in range(1, page_count + 1, self.render_window):
+                pages = convert_from_path(
+                    file_path,
+                    dpi=profile.dpi,
+                    grayscale=profile.grayscale,
+                    first_page=first_page,
+                    last_page=min(first_page + self.render_window - 1, page_count),
+                    output_folder=self.temp_image_dir,
+                    fmt="ppm",
                 )
-                page.save(temp_image_filedir, "JPEG")
-                image_list.append(self.preprocess_image(temp_image_filedir))
-                temp_files.append(temp_image_filedir)
+                for page in pages:
+                    image = np.asarray(page)
+                    page.close()
+                    if self.delete_temp_images:
+                        os.remove(page.filename)
+                    yield image
+                del pages
         elif file_path.endswith(".png") or file_path.endswith(".jpg"):
-            image_list.append(self.preprocess_image(file_path))
-        if self.delete_temp_images:
-            for temp_file in temp_files:
-                os.remove(temp_file)
-        return image_list
+            yield self.preprocess_image(file_path)
 
     def preprocess_image(self, file_path: str) -> np.ndarray:
         """
@@ -279,8 +345,12 @@ class TextExtractor:
         image = image[..., ::-1]  # Convert BGR to RGB
         return image
 
-    @classmethod
-    def convert_pdf_to_text(cls, pdf_path: str) -> None:
+    def convert_pdf_to_text(
+        self,
+        pdf_path: str,
+        fingerprint: Optional[str] = None,
+        page_number: Optional[int] = None,
+    ) -> None:
         """
         Converts a PDF file to text and saves it to the output directory.
 
@@ -288,21 +358,30 @@ class TextExtractor:
         ----------
         pdf_path : str
             The path to the PDF file to convert.
+        fingerprint : Optional[str]
+            The page fingerprint used as the OCR cache key. The cache is skipped
+            when it is not given.
+        page_number : Optional[int]
+            The page number within the input PDF. The page filter is skipped when
+            it is not given.
         """
         logger.debug(f"convert_pdf_to_text: Starting processing for {pdf_path}")
 
-        # Initialize TextExtractor
-        logger.debug("Initializing TextExtractor instance.")
-        text_extractor = cls()
-
-        # Extract text from the PDF file
-        logger.debug(f"Extracting text from file: {pdf_path}")
-        text = text_extractor.extract_text_from_file(pdf_path)
-        logger.debug("extraction done")
+        text = self._get_cached_text(fingerprint)
+        if text is None:
+            # Extract text from the PDF file
+            logger.debug(f"Extracting text from file: {pdf_path}")
+            if self.page_filter is not None and page_number is not None:
+                text = self._extract_filtered_page_text(pdf_path, page_number)
+            else:
+                text = self.extract_text_from_file(pdf_path)
+            logger.debug("extraction done")
+            # Empty text may be a failed OCR request, so it is never cached
+            if self.ocr_cache is not None and fingerprint is not None and text:
+                self.ocr_cache.put(fingerprint, text)
 
         # Generate the output text file path
-        txt_filename = os.path.splitext(os.path.basename(pdf_path))[0] + ".txt"
-        txt_path = os.path.join(settings.TXT_OUTPUT_DIR, txt_filename)
+        txt_path = self._text_path(pdf_path)
         logger.debug(f"Generated text file path: {txt_path}")
 
         # Write the extracted text to the output file
@@ -311,3 +390,54 @@ class TextExtractor:
             txt_file.write(text)
 
         logger.debug(f"convert_pdf_to_text: Completed processing for {pdf_path}")
+
+    def _get_cached_text(self, fingerprint: Optional[str]) -> Optional[str]:
+        """Look up the fingerprint in the OCR cache and record the hit or miss."""
+        if self.ocr_cache is None or fingerprint is None:
+            return None
+        text = self.ocr_cache.get(fingerprint)
+        with self._stats_lock:
+            self.ocr_cache_stats["hits" if text is not None else "misses"] += 1
+        return text
+
+    def _extract_filtered_page_text(self, pdf_path: str, page_number: int) -> str:
+        """Render a single-page PDF and only send it to OCR if it has new content."""
+        images = self.convert_file_to_images(pdf_path)
+        if not images:
+            return ""
+        result = self.page_filter.classify(page_number, images[0])
+        if result.status != CONTENT:
+            logger.debug(f"Page {page_number} is {result.status}, skipping OCR.")
+            return ""
+        return self.extract_text_from_images(images)
+
+    def _copy_duplicate_texts(
+        self,
+        pdf_files: List[str],
+        fingerprints: List[str],
+        journal: Optional[PageJournal] = None,
+    ):
+        """Give every near-duplicate page the text of its first copy."""
+        for result in self.page_filter.results.values():
+            if result.status != DUPLICATE:
+                continue
+            with open(self._text_path(pdf_files[result.duplicate_of]), "r") as f:
+                text = f.read()
+            txt_path = self._text_path(pdf_files[result.page_number])
+            with open(txt_path, "w") as f:
+                f.write(text)
+            if self.ocr_cache is not None and text:
+                self.ocr_cache.put(fingerprints[result.page_number], text)
+            if journal is not None:
+                journal.record(txt_path)
+
+    def _text_path(self, pdf_path: str) -> str:
+        """Return the text output path for a single-page PDF."""
+        txt_filename = os.path.splitext(os.path.basename(pdf_path))[0] + ".txt"
+        return os.path.join(self.txt_output_dir, txt_filename)
+
+    @staticmethod
+    def _page_sort_key(text_file: str):
+        """Sort page text files by page number rather than lexically."""
+        match = re.search(r"_page_(\d+)\.txt$", text_file)
+        return (0, int(match.group(1))) if match else (1, text_file)
@@ -0,0 +1,372 @@
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from ..settings import settings
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f\u200b-\u200f\ufeff]")
+_HYPHENATED_BREAK = re.compile(r"(\w)-[ \t]*\n[ \t]*(\w)")
+_SPACES = re.compile(r"[^\S\n]+")
+_REPEATED_SYMBOLS = re.compile(r"([^\w\s])\1{3,}")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_WORDS = re.compile(r"\S+\s*")
+_SYMBOLS = re.compile(r"[\W_]")
+
+
+class TokenReport(BaseModel):
+    pages: int = Field(0, description="Pages prepared")
+    raw_tokens: int = Field(0, description="Tokens of the page texts as extracted")
+    normalized_tokens: int = Field(0, description="Tokens after normalization")
+    chunked_pages: int = Field(
+        0, description="Distinct page texts split into chunks for embedding"
+    )
+    embedding_chunks: int = Field(0, description="Texts sent to the embedding model")
+    topic_prompt_tokens: int = Field(
+        0, description="Tokens of the topic prompts before trimming to the budget"
+    )
+    topic_sent_tokens: int = Field(0, description="Tokens of the topic prompts sent")
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens removed by normalization plus those trimmed from topic prompts."""
+        return (self.raw_tokens - self.normalized_tokens) + (
+            self.topic_prompt_tokens - self.topic_sent_tokens
+        )
+
+    def log(self) -> None:
+        logger.info(
+            f"Text preparation: {self.raw_tokens} -> {self.normalized_tokens} page "
+            f"tokens, {self.chunked_pages} pages chunked into "
+            f"{self.embedding_chunks} embedding inputs, topic prompts "
+            f"{self.topic_prompt_tokens} -> {self.topic_sent_tokens} tokens, "
+            f"{self.tokens_saved} tokens saved"
+        )
+
+
+class TokenCounter:
+    """
+    Counts, splits and truncates text by model tokens without calling an API.
+
+    Uses the model's tiktoken encoding when tiktoken is installed and its
+    encoding can be loaded. Otherwise tokens are estimated per word as half a
+    token per UTF-8 byte of letters and digits, plus a token per other
+    character. That is about three times the count of English text, and above
+    the count of digit runs, codes and OCR debris, which take fewer characters
+    per token. It is still an estimate, not a bound, so EMBEDDING_MAX_TOKENS
+    leaves headroom below the embedding model's input limit.
+    """
+
+    def __init__(self, model: str):
+        """Initialize the counter with the encoding of the model, if available."""
+        self.model = model
+        self.encoding = None
+        try:
+            import tiktoken
+        except ImportError:
+            return
+        try:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # Encodings are downloaded on first use, which fails offline
+            logger.warning(f"Could not load the tiktoken encoding of {model}: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        """
+        Count the tokens of a text.
+
+        Parameters
+        ----------
+        text : str
+            The text to count.
+
+        Returns
+        -------
+        int
+            The exact token count, or a high estimate without tiktoken.
+        """
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return sum(self._word_costs(text)[1])
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        """
+        Split a text into consecutive chunks of at most `max_tokens` tokens.
+
+        Without tiktoken, chunks end between words, and a word estimated at more
+        than `max_tokens` on its own is cut between characters.
+
+        Parameters
+        ----------
+        text : str
+            The text to split.
+        max_tokens : int
+            The token limit of each chunk.
+
+        Returns
+        -------
+        List[str]
+            The chunks in order, a single chunk when the text is within the limit.
+        """
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return [text]
+            return [
+                self.encoding.decode(tokens[start : start + max_tokens])
+                for start in range(0, len(tokens), max_tokens)
+            ]
+
+        words, costs = self._word_costs(text)
+        if sum(costs) <= max_tokens:
+            return [text]
+        chunks, chunk, chunk_tokens = [], [], 0
+        for word, cost in self._split_long_words(words, costs, max_tokens):
+            if chunk and chunk_tokens + cost > max_tokens:
+                chunks.append("".join(chunk))
+                chunk, chunk_tokens = [], 0
+            chunk.append(word)
+            chunk_tokens += cost
+        chunks.append("".join(chunk))
+        return chunks
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the leading `max_tokens` tokens of a text."""
+        if max_tokens <= 0:
+            return ""
+        return self.split(text, max_tokens)[0]
+
+    @staticmethod
+    def _word_cost(word: str) -> int:
+        word = word.rstrip()
+        symbols = len(_SYMBOLS.findall(word))
+        return math.ceil((len(word.encode()) - symbols) / 2) + symbols
+
+    @classmethod
+    def _word_costs(cls, text: str) -> Tuple[List[str], List[int]]:
+        words = _WORDS.findall(text)
+        return words, [cls._word_cost(word) for word in words]
+
+    @classmethod
+    def _split_long_words(
+        cls, words: List[str], costs: List[int], max_tokens: int
+    ) -> Iterator[Tuple[str, int]]:
+        # A run without whitespace (URL, base64, CJK, OCR debris) can cost more
+        # than a chunk holds on its own, so it is cut between characters
+        for word, cost in zip(words, costs):
+            if cost <= max_tokens:
+                yield word, cost
+                continue
+            start, letter_bytes, symbols = 0, 0, 0
+            for end, char in enumerate(word):
+                symbol = int(_SYMBOLS.match(char) is not None)
+                size = len(char.encode()) - symbol
+                cost = math.ceil((letter_bytes + size) / 2) + symbols + symbol
+                if end > start and cost > max_tokens:
+                    yield word[start:end], cls._word_cost(word[start:end])
+                    start, letter_bytes, symbols = end, 0, 0
+                letter_bytes += size
+                symbols += symbol
+            yield word[start:], cls._word_cost(word[start:])
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Return the shared token counter for the model."""
+    with _counters_lock:
+        if model not in _counters:
+            _counters[model] = TokenCounter(model)
+            if not _counters[model].exact:
+                logger.info("tiktoken is not available, estimating token counts.")
+        return _counters[model]
+
+
+def normalize_text(text: str) -> str:
+    """
+    Clean up OCR output before it is embedded or sent in a prompt.
+
+    Applies Unicode compatibility normalization (ligatures, full-width forms),
+    removes control and zero-width characters, joins words hyphenated across line
+    breaks, collapses runs of spaces, repeated symbols (dot leaders, rules) and
+    blank lines, and drops lines of stray marks with hardly any letters or digits.
+
+    Parameters
+    ----------
+    text : str
+        The text of a page as extracted.
+
+    Returns
+    -------
+    str
+        The normalized text.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = _CONTROL_CHARS.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = _REPEATED_SYMBOLS.sub(r"\1\1\1", text)
+    lines = []
+    for line in _SPACES.sub(" ", text).split("\n"):
+        line = line.strip()
+        if not line:
+            lines.append("")
+        elif not _is_noise_line(line):
+            lines.append(line)
+    # Noise lines are gone, so a hyphenated word is joined across them too
+    text = _HYPHENATED_BREAK.sub(r"\1\2", "\n".join(lines))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def _is_noise_line(line: str) -> bool:
+    """Whether a line is mostly stray marks, e.g. '| ~ ; ,' from specks or rules."""
+    alphanumeric = sum(character.isalnum() for character in line)
+    visible = sum(not character.isspace() for character in line)
+    return alphanumeric < 2 or alphanumeric < 0.3 * visible
+
+
+def prepare_texts(texts: List[str], report: TokenReport) -> List[str]:
+    """
+    Normalize the page texts, unless disabled, and count their tokens.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The text of every page as extracted.
+    report : TokenReport
+        Receives the page and token counts before and after normalization.
+
+    Returns
+    -------
+    List[str]
+        The text of every page, normalized.
+    """
+    counter = get_token_counter(settings.EMBEDDING_MODEL)
+    prepared = (
+        [normalize_text(text) for text in texts]
+        if settings.TEXT_NORMALIZATION_ENABLED
+        else list(texts)
+    )
+    report.pages += len(texts)
+    report.raw_tokens += sum(counter.count(text) for text in texts)
+    report.normalized_tokens += sum(counter.count(text) for text in prepared)
+    return prepared
+
+
+def chunk_texts(
+    texts: List[str], counter: TokenCounter, max_tokens: int
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Split every text that is over the token limit into chunks.
+
+    Raises a ValueError if a chunk still counts more than `max_tokens`, rather
+    than sending the model an input it would reject.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The texts to chunk.
+    counter : TokenCounter
+        The token counter of the model the chunks are sent to.
+    max_tokens : int
+        The token limit of each chunk.
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray, np.ndarray]
+        The chunks in order, the index of the text each chunk belongs to, and the
+        token count of each chunk.
+    """
+    chunks, owners, weights = [], [], []
+    for index, text in enumerate(texts):
+        for chunk in counter.split(text, max_tokens):
+            tokens = counter.count(chunk)
+            if tokens > max_tokens:
+                raise ValueError(
+                    f"Chunk of text {index} has {tokens} tokens, over the limit "
+                    f"of {max_tokens}"
+                )
+            chunks.append(chunk)
+            owners.append(index)
+            weights.append(max(tokens, 1))
+    return chunks, np.array(owners, dtype=np.int64), np.array(weights, np.float32)
+
+
+def mean_pool(
+    chunk_embeddings: np.ndarray, owners: np.ndarray, weights: np.ndarray
+) -> np.ndarray:
+    """
+    Pool the embeddings of each text's chunks into one unit vector per text.
+
+    Chunks are weighted by their token count, so a short trailing chunk does not
+    count as much as a full one.
+
+    Parameters
+    ----------
+    chunk_embeddings : np.ndarray
+        Matrix with one row per chunk, the chunks of each text being consecutive.
+    owners : np.ndarray
+        Sorted index of the text of each chunk, as returned by `chunk_texts`.
+    weights : np.ndarray
+        Weight of each chunk.
+
+    Returns
+    -------
+    np.ndarray
+        float32 matrix with one row per text.
+    """
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    pooled = np.add.reduceat(chunk_embeddings * weights[:, None], starts, axis=0)
+    pooled /= np.add.reduceat(weights, starts)[:, None]
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (pooled / norms).astype(np.float32)
+
+
+def fit_to_budget(texts: List[str], counter: TokenCounter, max_tokens: int) -> str:
+    """
+    Trim texts to share a token budget and join them.
+
+    The budget is split evenly, and the share a short text does not use goes to
+    the longer ones, so a single page is only trimmed when it is over the budget.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The texts that make up a prompt, e.g. sampled pages of a document.
+    counter : TokenCounter
+        The token counter of the model the prompt is sent to.
+    max_tokens : int
+        The token budget of the joined text.
+
+    Returns
+    -------
+    str
+        The trimmed texts joined by spaces.
+    """
+    counts = [counter.count(text) for text in texts]
+    shares = [0] * len(texts)
+    remaining = max_tokens
+    # Shortest first, so that each text's unused share is passed on
+    order = sorted(range(len(texts)), key=lambda i: counts[i])
+    for position, index in enumerate(order):
+        share = remaining // (len(texts) - position)
+        shares[index] = min(counts[index], share)
+        remaining -= shares[index]
+    return " ".join(
+        text if share >= count else counter.truncate(text, share)
+        for text, count, share in zip(texts, counts, shares)
+        if share > 0
+    )
@@ -4,15 +4,152 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""
     GOOGLE_API_KEY: str = ""
+    AWS_ACCESS_KEY_ID: str = ""
+    AWS_SECRET_ACCESS_KEY: str = ""
+    AWS_REGION: str = ""
 
     PDF_INPUT_PATH: str = ""
+    REDIS_URL: str = "redis://localhost:6379"
+
+    # Outbound API limits. Rates are shared by all workers through Redis and
+    # concurrency is per worker process, adapted down on 429s and slow responses.
+    OCR_REQUESTS_PER_SECOND: float = 10.0
+    OCR_MAX_CONCURRENCY: int = 8
+    OCR_TARGET_LATENCY: float = 10.0
+    # A Vision request with no response for this long is abandoned and retried
+    OCR_REQUEST_TIMEOUT: float = 60.0
+    EMBEDDING_REQUESTS_PER_SECOND: float = 5.0
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_TARGET_LATENCY: float = 30.0
+    TEXTRACT_REQUESTS_PER_SECOND: float = 5.0
+    TEXTRACT_MAX_CONCURRENCY: int = 4
+    TEXTRACT_TARGET_LATENCY: float = 10.0
+    TOPIC_REQUESTS_PER_SECOND: float = 5.0
+    TOPIC_MAX_CONCURRENCY: int = 4
+    TOPIC_TARGET_LATENCY: float = 15.0
+    API_MAX_RETRIES: int = 6
+    API_BACKOFF_BASE_SECONDS: float = 0.5
+    API_BACKOFF_MAX_SECONDS: float = 60.0
+
+    # Web jobs are routed by page count into the "small", "medium" and "large"
+    # queues. Workers serve them in JOB_QUEUE_PRIORITY order, except that a queue
+    # whose oldest job has waited longer than its limit is served first.
+    JOB_SMALL_MAX_PAGES: int = 20
+    JOB_MEDIUM_MAX_PAGES: int = 300
+    JOB_MEDIUM_MAX_WAIT_SECONDS: float = 120.0
+    JOB_LARGE_MAX_WAIT_SECONDS: float = 600.0
+    JOB_QUEUE_PRIORITY: str = "small,medium,large"
+    # Each web job runs in its own workspace under JOB_WORKSPACE_DIR, and a job
+    # interrupted by a worker restart is retried, resuming from its checkpoints
+    JOB_WORKSPACE_DIR: str = "data/jobs"
+    JOB_MAX_RETRIES: int = 2
 
     TEMP_PDF_PAGES_DIR: str = "data/temp_pdf_pages"
     TEMP_IMAGE_DIR: str = "data/temp_images"
     TXT_OUTPUT_DIR: str = "data/txt_pages"
     OUTPUT_DOCS_DIR: str = "data/output_docs"
+    CHECKPOINT_DIR: str = "data/checkpoints"
+
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_PATH: str = "data/cache/ocr_cache.sqlite3"
+    OCR_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # "vision", "textract", "tesseract", or a route such as "tesseract>vision"
+    # that only sends pages below the confidence threshold to the next backend
+    OCR_BACKEND: str = "vision"
+    OCR_FALLBACK_MIN_CONFIDENCE: float = 0.75
+    TESSERACT_LANG: str = "eng"
+    # Size of the shared Tesseract process pool, 0 for one process per CPU
+    TESSERACT_PROCESSES: int = 0
+
+    # Where uploads and outputs are shared between the web app and the workers:
+    # "local" (a directory, BLOB_STORE_PATH) or "s3" (S3_BUCKET, any S3-compatible
+    # endpoint with S3_ENDPOINT_URL)
+    BLOB_STORE: str = "local"
+    BLOB_STORE_PATH: str = "data/blobs"
+    # Local copies of input blobs, the least recently used removed above the size
+    BLOB_CACHE_DIR: str = "data/blob_cache"
+    BLOB_CACHE_MAX_BYTES: int = 4 * 1024 * 1024 * 1024
+    BLOB_CHUNK_BYTES: int = 8 * 1024 * 1024
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: str = ""
+
+    # Files processed at once by run-batch
+    BATCH_MAX_CONCURRENT_FILES: int = 4
+    # Threads rendering and OCRing pages for all files of a batch, 0 for default
+    BATCH_PAGE_WORKERS: int = 0
+
+    # A name from RENDER_PROFILES, or "adaptive" to choose one per page. "legacy"
+    # sends the same 200 DPI color pages as before; compare the OCR accuracy of
+    # the smaller profiles with `python -m benchmarks.render_profiles` first
+    RENDER_PROFILE: str = "legacy"
+    # Pages rendered at once when extracting text from a multi-page file
+    RENDER_WINDOW_PAGES: int = 1
+
+    PAGE_FILTER_ENABLED: bool = True
+    # Pages with at most this share of pixels darker than the ink level are blank
+    BLANK_PAGE_MAX_INK_RATIO: float = 0.001
+    BLANK_PAGE_INK_LEVEL: int = 160
+    # Difference hash of DUPLICATE_HASH_SIZE^2 bits, compared by Hamming distance.
+    # The size must be a multiple of 8, so the hash packs into 64-bit words
+    DUPLICATE_HASH_SIZE: int = 16
+    DUPLICATE_HASH_MAX_DISTANCE: int = 6
+
+    # "agglomerative", "optimal" (contiguous, dynamic programming) or "boundary"
+    # (the O(n) online fast path)
+    SEGMENTATION_STRATEGY: str = "agglomerative"
+    # Longest document the optimal segmentation can produce, which bounds it to
+    # O(n * L). Longer documents are split into parts of at most this many pages
+    OPTIMAL_MAX_SEGMENT_LENGTH: int = 250
+
+    # "openai" (EMBEDDING_MODEL through the API) or "local" (TF-IDF + SVD, offline)
+    EMBEDDING_BACKEND: str = "openai"
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    # Texts are sent in requests within the API's limits of 2048 inputs and
+    # 300k tokens per request, with headroom in case the token estimate is low
+    EMBEDDING_REQUEST_MAX_INPUTS: int = 2048
+    EMBEDDING_REQUEST_MAX_TOKENS: int = 250_000
+    # Page texts are normalized before embedding and topic generation. Pages over
+    # EMBEDDING_MAX_TOKENS are embedded in chunks that are mean-pooled, and topic
+    # prompts are trimmed to TOPIC_MAX_TOKENS. Tokens are counted with tiktoken
+    # when it is installed, else estimated on the high side. EMBEDDING_MAX_TOKENS
+    # leaves headroom below the 8191-token input limit in case the estimate is low.
+    TEXT_NORMALIZATION_ENABLED: bool = True
+    EMBEDDING_MAX_TOKENS: int = 7000
+    TOPIC_MODEL: str = "gpt-4o-mini"
+    TOPIC_MAX_TOKENS: int = 1000
+    LOCAL_EMBEDDING_DIMENSION: int = 256
+    LOCAL_EMBEDDING_HASH_FEATURES: int = 2**18
+    # Model fitted on a stored corpus; when missing the model is fitted per job
+    LOCAL_EMBEDDING_MODEL_PATH: str = "data/models/local_embedding.joblib"
+    EMBEDDINGS_FILE_SUFFIX: str = "embeddings.bin"
+    # float32, float16 or int8 (per-row scaled)
+    EMBEDDINGS_STORAGE_DTYPE: str = "float32"
 
-    EMBEDDINGS_FILE_SUFFIX: str = "embeddings.pkl"
+    # The page embeddings of every run are added to a persistent index under
+    # PAGE_INDEX_DIR, one per embedding model, to find the documents of each split
+    # that were seen in earlier bundles. A page is seen when an indexed page has a
+    # cosine similarity of at least PAGE_INDEX_MIN_SIMILARITY.
+    PAGE_INDEX_ENABLED: bool = True
+    PAGE_INDEX_DIR: str = "data/page_index"
+    # Set when PAGE_INDEX_DIR is persistent storage mounted on every worker host,
+    # e.g. a network volume with flock support. Web workers only use the index
+    # then: on ephemeral disks, such as Heroku dynos, it is wiped on restart and
+    # each host keeps an index of its own jobs only.
+    PAGE_INDEX_SHARED: bool = False
+    # float32, float16 or int8, as for embeddings files. int8 is a quarter of the
+    # size of float32 and the quickest to scan
+    PAGE_INDEX_DTYPE: str = "int8"
+    PAGE_INDEX_SHARD_PAGES: int = 100_000
+    PAGE_INDEX_TOP_K: int = 5
+    PAGE_INDEX_MIN_SIMILARITY: float = 0.95
+    PAGE_INDEX_MAX_MATCHES: int = 3
+    # Once trained (`train-page-index`), queries only scan the PAGE_INDEX_NPROBE
+    # closest of PAGE_INDEX_IVF_LISTS lists instead of every page
+    PAGE_INDEX_IVF_LISTS: int = 1024
+    PAGE_INDEX_NPROBE: int = 16
+    PAGE_INDEX_TRAIN_PAGES: int = 50_000
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,102 @@
+import os
+import shutil
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from .settings import settings
+
+MANIFEST_FILE_NAME = "split_manifest.json"
+
+
+class Workspace(BaseModel):
+    """
+    The directories a pipeline run writes its intermediate and output files to.
+
+    The default workspace is the shared data/ layout used by the web worker.
+    Runs that share a process, such as a batch, each get their own workspace so
+    they never read or clear each other's files.
+    """
+
+    temp_pdf_pages_dir: str = Field(
+        settings.TEMP_PDF_PAGES_DIR, description="Single-page PDFs of the input"
+    )
+    temp_image_dir: str = Field(
+        settings.TEMP_IMAGE_DIR, description="Page images while they are rendered"
+    )
+    txt_output_dir: str = Field(
+        settings.TXT_OUTPUT_DIR, description="Extracted text of each page"
+    )
+    output_docs_dir: str = Field(
+        settings.OUTPUT_DOCS_DIR, description="The split output documents"
+    )
+    embeddings_dir: str = Field("data", description="Embeddings files")
+    checkpoint_dir: str = Field(
+        settings.CHECKPOINT_DIR, description="Checkpoints of the completed stages"
+    )
+
+    @classmethod
+    def for_job(cls, root: str) -> "Workspace":
+        """Return a workspace with every directory under the given root."""
+        return cls(
+            temp_pdf_pages_dir=os.path.join(root, "temp_pdf_pages"),
+            temp_image_dir=os.path.join(root, "temp_images"),
+            txt_output_dir=os.path.join(root, "txt_pages"),
+            output_docs_dir=os.path.join(root, "output_docs"),
+            embeddings_dir=root,
+            checkpoint_dir=os.path.join(root, "checkpoints"),
+        )
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.output_docs_dir, MANIFEST_FILE_NAME)
+
+    @property
+    def temp_dirs(self):
+        return [self.temp_pdf_pages_dir, self.temp_image_dir, self.txt_output_dir]
+
+    def create(self) -> None:
+        """Create every directory of the workspace."""
+        for directory in self.temp_dirs + [
+            self.output_docs_dir,
+            self.embeddings_dir,
+            self.checkpoint_dir,
+        ]:
+            os.makedirs(directory, exist_ok=True)
+
+    def clear(self) -> None:
+        """Clear the temporary, output and checkpoint directories and embeddings."""
+        for directory in self.temp_dirs + [self.output_docs_dir, self.checkpoint_dir]:
+            clear_directory(directory)
+
+        if os.path.exists(self.embeddings_dir):
+            for filename in os.listdir(self.embeddings_dir):
+                if filename.endswith(settings.EMBEDDINGS_FILE_SUFFIX):
+                    file_path = os.path.join(self.embeddings_dir, filename)
+                    try:
+                        os.unlink(file_path)
+                    except Exception as e:
+                        logger.error(f"Failed to delete {file_path}. Reason: {e}")
+        else:
+            logger.warning(f"Directory {self.embeddings_dir} does not exist.")
+
+    def clear_temp(self) -> None:
+        """Delete the per-page files once the output documents have been written."""
+        for directory in self.temp_dirs:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def clear_directory(directory: str) -> None:
+    """Delete everything inside a directory, keeping the directory itself."""
+    if not os.path.exists(directory):
+        logger.warning(f"Directory {directory} does not exist.")
+        return
+    for filename in os.listdir(directory):
+        file_path = os.path.join(directory, filename)
+        try:
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+        except Exception as e:
+            logger.error(f"Failed to delete {file_path}. Reason: {e}")
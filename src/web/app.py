@@ -1,17 +1,23 @@
-import io
 import os
 import time
-import uuid
-import zipfile
 
 import redis
 import streamlit as st
-from rq import Queue
+from pypdf.errors import PyPdfError
+from rq import Callback, Retry
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
+
+from src.splitter.blob_store import get_blob_store
+from src.splitter.domain_models import PriorMatch, SplitManifest
+from src.splitter.processors.pdf_processor import (SplitMaterializer,
+                                                   count_pdf_pages)
+from src.splitter.settings import settings
+from src.web.job_queues import ENDED_JOB_STATUSES, cancel_job, enqueue_job
 
 # Connect to Redis
 redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
 redis_conn = redis.from_url(redis_url)
-queue = Queue(connection=redis_conn)
 
 
 def main():
@@ -25,49 +31,65 @@ def main():
 
     if uploaded_file is not None:
 
-        # Ensure the directory exists
-        temp_dir = "data/input_pdf"
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # Save the uploaded file to a temporary location
-        temp_file_path = os.path.join("data/input_pdf", uploaded_file.name)
-        with open(temp_file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        st.write(f"Uploaded file: {uploaded_file.name}")
-
-        if not os.path.exists(temp_file_path):
-            st.error(f"File not found: {temp_file_path}")
-            return
+        # Store the upload under its content hash, so workers on any host can fetch
+        # it and same-named uploads never overwrite each other
+        input_key = st.session_state.get("input_key")
+        page_count = st.session_state.get("page_count")
+        if st.session_state.get("uploaded_file_id") != uploaded_file.file_id:
+            # The page count only reads the page tree root, so it is cheap to get
+            # here and decides which queue the job waits in
+            uploaded_file.seek(0)
+            try:
+                page_count = count_pdf_pages(uploaded_file)
+            except (PyPdfError, KeyError, TypeError, ValueError):
+                st.error(
+                    f"{uploaded_file.name} could not be read as a PDF. "
+                    "It may be damaged or incomplete."
+                )
+                st.stop()
+            uploaded_file.seek(0)
+            input_key = get_blob_store().put_content(uploaded_file, "inputs", ".pdf")
+            st.session_state["input_key"] = input_key
+            st.session_state["page_count"] = page_count
+            st.session_state["uploaded_file_id"] = uploaded_file.file_id
+        st.write(f"Uploaded file: {uploaded_file.name} ({page_count} pages)")
 
         if st.button("Run Pipeline"):
             split_level = st.session_state.get("split_level", 2.0)
-            enqueue_pipeline(temp_file_path, split_level)
-
-            # Check job status
-            job_id = st.session_state.get("job_id")
-            if job_id:
-                job = queue.fetch_job(job_id)
-                if job:
-                    job = display_job_status(job)
-                    if job.is_finished:
-                        st.session_state["job_result"] = job.result
-                        display_success_message()
-                        st.session_state["displayed_links"] = (
-                            True  # Set flag to indicate links have been displayed
-                        )
-                        st.session_state["output_files"] = (
-                            job.result
-                        )  # Store output files in session state
-                        display_download_links(st.session_state["output_files"])
-                        del st.session_state["job_id"]
-                        st.query_params.clear()
+            strategy = st.session_state.get("strategy", "agglomerative")
+            ocr_backend = st.session_state.get("ocr_backend", "vision")
+            enqueue_pipeline(
+                input_key,
+                page_count,
+                split_level,
+                strategy,
+                ocr_backend,
+                uploaded_file.name,
+            )
+
+        # Follow the job across reruns, so that the cancel button keeps working
+        job_id = st.session_state.get("job_id")
+        if job_id:
+            try:
+                job = Job.fetch(job_id, connection=redis_conn)
+            except NoSuchJobError:
+                st.error("Job not found")
+            else:
+                job = display_job_status(job)
+                if job.is_finished:
+                    # Only the manifest is returned, documents are written on demand
+                    st.session_state["manifest"] = job.result
+                    display_success_message()
+                elif job.is_failed:
+                    st.error("The pipeline failed. Please try again.")
                 else:
-                    st.error("Job not found")
+                    st.warning("The job was cancelled.")
+            del st.session_state["job_id"]
+            st.query_params.clear()
 
-    # Display download links if output files are in session state and links have not been displayed yet
-    if "output_files" in st.session_state and not st.session_state.get("displayed_links", False):
-        display_download_links(st.session_state["output_files"])
-        st.session_state["displayed_links"] = True  # Set flag to indicate links have been displayed
+    # Download links stay available across reruns, e.g. after a download
+    if "manifest" in st.session_state:
+        display_download_links(SplitManifest(**st.session_state["manifest"]))
 
 
 def set_page_config():
@@ -105,26 +127,77 @@ def display_sidebar():
         step=0.1,
         key="split_level",
     )
+    st.sidebar.write(
+        f"""
+    The segmentation strategy decides how pages are grouped.
+    - **agglomerative** compares every page with every other page.
+    - **optimal** finds the best split into runs of consecutive pages. Documents are always contiguous, and longer ones are split into parts of at most {settings.OPTIMAL_MAX_SEGMENT_LENGTH} pages.
+    - **boundary** scans the pages once and starts a new document when the content changes. Use it for very large productions (thousands of pages).
+    """
+    )
+    st.sidebar.selectbox(
+        "Segmentation Strategy",
+        options=["agglomerative", "optimal", "boundary"],
+        index=0,
+        key="strategy",
+    )
+    st.sidebar.write("### OCR")
+    st.sidebar.selectbox(
+        "OCR Backend",
+        options=["vision", "tesseract", "tesseract>vision", "textract"],
+        index=0,
+        key="ocr_backend",
+        help=(
+            "tesseract>vision reads pages locally and only sends low-confidence "
+            "pages to Google Vision."
+        ),
+    )
 
 
-def enqueue_pipeline(file_path: str, split_level: float):
-    """Enqueue the pipeline job to process the uploaded PDF file."""
-    job = queue.enqueue("src.web.worker.run_pipeline", file_path, split_level)
+def enqueue_pipeline(
+    input_key: str,
+    page_count: int,
+    split_level: float,
+    strategy: str,
+    ocr_backend: str,
+    file_name: str,
+):
+    """Enqueue the pipeline job on the queue for the size of the uploaded PDF."""
+    job = enqueue_job(
+        redis_conn,
+        page_count,
+        "src.web.worker.run_pipeline",
+        input_key,
+        split_level,
+        strategy,
+        ocr_backend,
+        file_name,
+        # A job interrupted by a worker restart is retried and resumes from its
+        # checkpoints
+        retry=Retry(max=settings.JOB_MAX_RETRIES),
+        # Cancelled jobs, and jobs that failed for good, leave no workspace behind
+        on_stopped=Callback("src.web.worker.remove_stopped_job_workspace"),
+        on_failure=Callback("src.web.worker.remove_failed_job_workspace"),
+    )
     st.session_state["job_id"] = job.id
-    st.session_state["prev_status"] = None  # Initialize previous status
-    st.success(f"Task started with job ID: {job.id}")
+    st.success(f"Task started with job ID: {job.id} (queue: {job.origin})")
     st.query_params.job_id = job.id
 
 
 def display_job_status(job):
-    """Display the status of the job and wait until it is finished."""
-    while not job.is_finished:
+    """Display the status of the job until it has ended, with a cancel button."""
+    if st.button("Cancel Job", key=f"cancel_{job.id}"):
+        cancel_job(redis_conn, job.id)
+    status = st.empty()
+    while job.get_status() not in ENDED_JOB_STATUSES:
         current_status = job.get_status()
-        if current_status != st.session_state.get("prev_status"):
-            st.session_state["prev_status"] = current_status
-            st.info(f"Job Status: {current_status}")
+        position = job.get_position() if current_status == JobStatus.QUEUED else None
+        if position is not None:
+            status.info(f"Job Status: {current_status} (position {position + 1})")
+        else:
+            status.info(f"Job Status: {current_status}")
         time.sleep(5)  # Wait for 5 seconds before checking again
-        job = queue.fetch_job(job.id)  # Re-fetch the job to get the latest status
+    status.info(f"Job Status: {job.get_status()}")
     return job
 
 
@@ -141,49 +214,91 @@ def display_success_message():
     )
 
 
-def create_zip(output_files):
-    """Create a ZIP file containing all the output files."""
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for output_file in output_files:
-            with open(output_file, "rb") as f:
-                zip_file.writestr(os.path.basename(output_file), f.read())
-    zip_buffer.seek(0)
-    return zip_buffer
+def format_page_ranges(page_ranges) -> str:
+    """Format 0-based page ranges as 1-based page numbers, e.g. 'pages 1-3, 7'."""
+    parts = [
+        f"{start + 1}" if start == end else f"{start + 1}-{end + 1}"
+        for start, end in page_ranges
+    ]
+    return "pages " + ", ".join(parts)
+
 
+def format_prior_match(match: PriorMatch, page_count: int) -> str:
+    """Describe a match in an earlier bundle, e.g. 'doc.pdf, document 3 (Affidavit)'."""
+    text = match.source
+    if match.document_id is not None:
+        text += f", document {match.document_id}"
+        if match.topic_name:
+            text += f" ({match.topic_name})"
+    return (
+        f"{text}: {match.matched_pages} of {page_count} pages, "
+        f"similarity {match.similarity:.2f}"
+    )
+
+
+def display_download_links(manifest: SplitManifest):
+    """
+    List the split documents, writing each PDF only when the user asks for it.
 
-def display_download_links(output_files):
-    """Display download links for each output file and a 'Download All' button."""
-    unique_id = str(uuid.uuid4())  # Generate a unique identifier
+    Documents that have already been prepared are offered for download straight
+    away. Everything else is written from the source PDF on the first request.
+    """
+    key_prefix = manifest.digest
+    materializer = SplitMaterializer(
+        manifest,
+        os.path.join(settings.OUTPUT_DOCS_DIR, key_prefix),
+        blob_store=get_blob_store(),
+    )
     st.markdown("<h4>Download Split Documents</h4>", unsafe_allow_html=True)
-    for idx, output_file in enumerate(output_files):
-        st.markdown(f"**Document: {os.path.basename(output_file)}**")
-        with open(output_file, "rb") as file_content:
-            st.download_button(
-                label="Download",
-                data=file_content,
-                file_name=os.path.basename(output_file),
-                mime="application/pdf",
-                key=f"download_{unique_id}_{idx}",  # Unique key for each download button
-                help="Click to download this document",
-                use_container_width=False,
+    for document in manifest.documents:
+        st.markdown(
+            f"**Document: {document.file_name}** "
+            f"({format_page_ranges(document.page_ranges)})"
+        )
+        if document.prior_matches:
+            page_count = len(document.page_numbers)
+            st.caption(
+                "Matches in prior bundles: "
+                + "; ".join(
+                    format_prior_match(match, page_count)
+                    for match in document.prior_matches
+                )
             )
+        prepare_key = f"prepare_{key_prefix}_{document.id}"
+        if materializer.is_materialized(document.id) or st.button(
+            "Prepare PDF", key=prepare_key
+        ):
+            output_file = materializer.materialize(document.id)
+            with open(output_file, "rb") as file_content:
+                st.download_button(
+                    label="Download",
+                    data=file_content,
+                    file_name=document.file_name,
+                    mime="application/pdf",
+                    key=f"download_{key_prefix}_{document.id}",
+                    help="Click to download this document",
+                    use_container_width=False,
+                )
 
     # Add spacing before the "Download All" button
     st.markdown("<br>", unsafe_allow_html=True)
 
-    # Create and provide a download button for the ZIP file
-    zip_buffer = create_zip(output_files)
-    st.download_button(
-        label="Download All",
-        data=zip_buffer,
-        file_name="all_documents.zip",
-        mime="application/zip",
-        key=f"download_all_{unique_id}",  # Unique key for the download all button
-        help="Click to download all documents as a ZIP file",
-        use_container_width=False,
-    )
+    if st.session_state.get(f"zip_{key_prefix}") or st.button(
+        "Prepare All as ZIP", key=f"prepare_zip_{key_prefix}"
+    ):
+        st.session_state[f"zip_{key_prefix}"] = True
+        zip_path = materializer.materialize_zip()
+        with open(zip_path, "rb") as zip_content:
+            st.download_button(
+                label="Download All",
+                data=zip_content,
+                file_name="all_documents.zip",
+                mime="application/zip",
+                key=f"download_all_{key_prefix}",
+                help="Click to download all documents as a ZIP file",
+                use_container_width=False,
+            )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,155 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from loguru import logger
+from pydantic import BaseModel, Field
+from redis import Redis
+from rq import Queue, Worker
+from rq.command import send_stop_job_command
+from rq.exceptions import InvalidJobOperation, NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import utcnow
+
+from src.splitter.settings import settings
+
+# Statuses of jobs that will not run again
+ENDED_JOB_STATUSES = (
+    JobStatus.FINISHED,
+    JobStatus.FAILED,
+    JobStatus.STOPPED,
+    JobStatus.CANCELED,
+)
+
+
+class QueueTier(BaseModel):
+    name: str = Field(..., description="Name of the RQ queue")
+    max_pages: Optional[int] = Field(
+        ..., description="Largest page count routed here, None for no limit"
+    )
+    max_wait_seconds: Optional[float] = Field(
+        ...,
+        description="Wait of the oldest job after which the queue is served first",
+    )
+
+
+def queue_tiers() -> List[QueueTier]:
+    """Return the size tiers from the settings, smallest jobs first."""
+    return [
+        QueueTier(
+            name="small",
+            max_pages=settings.JOB_SMALL_MAX_PAGES,
+            max_wait_seconds=None,
+        ),
+        QueueTier(
+            name="medium",
+            max_pages=settings.JOB_MEDIUM_MAX_PAGES,
+            max_wait_seconds=settings.JOB_MEDIUM_MAX_WAIT_SECONDS,
+        ),
+        QueueTier(
+            name="large",
+            max_pages=None,
+            max_wait_seconds=settings.JOB_LARGE_MAX_WAIT_SECONDS,
+        ),
+    ]
+
+
+def priority_queue_names() -> List[str]:
+    """Return the queue names from JOB_QUEUE_PRIORITY, highest priority first."""
+    return [
+        name.strip() for name in settings.JOB_QUEUE_PRIORITY.split(",") if name.strip()
+    ]
+
+
+def queue_name_for_pages(page_count: int) -> str:
+    """Return the queue of the smallest tier that takes the page count."""
+    for tier in queue_tiers():
+        if tier.max_pages is None or page_count <= tier.max_pages:
+            return tier.name
+    return queue_tiers()[-1].name
+
+
+def enqueue_job(connection: Redis, page_count: int, func: str, *args, **kwargs) -> Job:
+    """Enqueue a job on the queue of its size tier, recording the page count."""
+    queue = Queue(queue_name_for_pages(page_count), connection=connection)
+    job = queue.enqueue(func, *args, meta={"page_count": page_count}, **kwargs)
+    logger.info(f"Enqueued job {job.id} ({page_count} pages) on {queue.name}")
+    return job
+
+
+def cancel_job(connection: Redis, job_id: str) -> bool:
+    """
+    Cancel a job, whether it is still queued or already running.
+
+    Returns:
+        bool: Whether the job was queued or running and is now being cancelled.
+    """
+    try:
+        job = Job.fetch(job_id, connection=connection)
+    except NoSuchJobError:
+        return False
+    status = job.get_status()
+    if status == JobStatus.STARTED:
+        # The worker running it kills the work horse when it receives the command
+        try:
+            send_stop_job_command(connection, job_id)
+        except InvalidJobOperation:
+            return False
+        return True
+    if status in (JobStatus.QUEUED, JobStatus.DEFERRED, JobStatus.SCHEDULED):
+        job.cancel()
+        return True
+    return False
+
+
+def oldest_wait_seconds(queue: Queue, now: Optional[datetime] = None) -> float:
+    """Seconds the job at the head of the queue has been waiting, 0 when empty."""
+    job_ids = queue.get_job_ids(0, 1)
+    if not job_ids:
+        return 0.0
+    job = queue.fetch_job(job_ids[0])
+    if job is None or job.enqueued_at is None:
+        return 0.0
+    now = now or utcnow()
+    return max(0.0, (now - job.enqueued_at).total_seconds())
+
+
+def order_queues(
+    queues: Sequence[Queue],
+    max_wait_seconds: Dict[str, Optional[float]],
+    now: Optional[datetime] = None,
+) -> List[Queue]:
+    """
+    Order queues for the next dequeue: by priority, with aging.
+
+    Queues keep their priority order, except that a queue whose oldest job has
+    waited longer than its limit is served first, so a steady stream of small
+    jobs can delay large ones but never starve them. Among several overdue
+    queues the most overdue goes first.
+    """
+    overdue = []
+    for queue in queues:
+        limit = max_wait_seconds.get(queue.name)
+        if limit is None:
+            continue
+        waited = oldest_wait_seconds(queue, now)
+        if waited > limit:
+            overdue.append((waited - limit, queue))
+    overdue.sort(key=lambda item: item[0], reverse=True)
+    promoted = [queue for _, queue in overdue]
+    return promoted + [queue for queue in queues if queue not in promoted]
+
+
+class TieredWorker(Worker):
+    """
+    RQ worker that serves its queues in priority order with aging.
+
+    The queues are given highest priority first, e.g. small, medium, large, and
+    reordered with `order_queues` before every dequeue.
+    """
+
+    def dequeue_job_and_maintain_ttl(
+        self, timeout: Optional[int], max_idle_time: Optional[int] = None
+    ):
+        limits = {tier.name: tier.max_wait_seconds for tier in queue_tiers()}
+        self._ordered_queues = order_queues(self.queues, limits)
+        return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
@@ -1,43 +1,147 @@
 import os
+import shutil
+import sys
 
 import redis
 from loguru import logger
-from rq import Connection, Queue, Worker
+from rq import Connection, Queue, get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.registry import clean_registries
 
+from src.splitter.blob_store import get_blob_store
 from src.splitter.pipeline import Pipeline
+from src.splitter.settings import settings
+from src.splitter.workspace import MANIFEST_FILE_NAME, Workspace
+from src.web.job_queues import (ENDED_JOB_STATUSES, TieredWorker,
+                                priority_queue_names)
 
 # Connect to Redis
 redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
 redis_conn = redis.from_url(redis_url)
 
-# Define the queue
-queue = Queue(connection=redis_conn)
 
+def job_workspace_dir(job_id: str) -> str:
+    return os.path.join(settings.JOB_WORKSPACE_DIR, job_id)
 
-def run_pipeline(temp_file_path, distance_threshold):
-    if not os.path.exists(temp_file_path):
-        raise FileNotFoundError(f"File not found: {temp_file_path}")
 
-    pipeline = Pipeline(temp_file_path, distance_threshold)
+def remove_stopped_job_workspace(job, connection):
+    """Remove the workspace of a cancelled job. Stopped jobs are never retried."""
+    shutil.rmtree(job_workspace_dir(job.id), ignore_errors=True)
+
+
+def remove_failed_job_workspace(job, connection, *exc_info):
+    """
+    Remove the workspace of a failed job, unless it will be retried.
+
+    Also runs for a job abandoned by a worker that died, when the registries
+    are cleaned. The workspace is only removed if the cleaning worker is on the
+    same host; otherwise the sweep at worker start removes it.
+    """
+    if not job.retries_left:
+        shutil.rmtree(job_workspace_dir(job.id), ignore_errors=True)
+
+
+def sweep_job_workspaces(connection) -> None:
+    """Remove the workspaces of jobs that have ended or expired."""
+    if not os.path.isdir(settings.JOB_WORKSPACE_DIR):
+        return
+    for job_id in os.listdir(settings.JOB_WORKSPACE_DIR):
+        try:
+            status = Job.fetch(job_id, connection=connection).get_status()
+        except NoSuchJobError:
+            status = None
+        if status is None or status in ENDED_JOB_STATUSES:
+            logger.info(
+                f"Removing the workspace of job {job_id} ({status or 'expired'})"
+            )
+            shutil.rmtree(job_workspace_dir(job_id), ignore_errors=True)
+
+
+def worker_page_index_enabled() -> bool:
+    """Whether jobs use the page index, which must be shared by every worker."""
+    return settings.PAGE_INDEX_ENABLED and settings.PAGE_INDEX_SHARED
+
+
+def run_pipeline(
+    input_key,
+    distance_threshold,
+    strategy="agglomerative",
+    ocr_backend="vision",
+    file_name=None,
+):
+    """
+    Split the uploaded PDF stored under the blob key and return the manifest.
+
+    With a shared page index, the manifest lists each document's matches in
+    bundles processed before, and the pages are indexed under the job's ID, with
+    the uploaded file name.
+    """
+    blob_store = get_blob_store()
+    if not blob_store.exists(input_key):
+        raise FileNotFoundError(f"Blob not found: {input_key}")
+    # Inputs are content-addressed, so a cached local copy is always current
+    input_file = blob_store.get_cached_file(input_key)
+
+    # Each job has its own workspace, named after the job, so that a job retried
+    # after a worker restart resumes from the checkpoints of the interrupted run
+    job = get_current_job()
+    job_dir = job_workspace_dir(job.id if job else input_key.replace("/", "_"))
+    pipeline = Pipeline(
+        input_file,
+        distance_threshold,
+        strategy=strategy,
+        ocr_backend=ocr_backend,
+        workspace=Workspace.for_job(job_dir),
+        job_id=job.id if job else None,
+        source_name=file_name,
+        page_index=worker_page_index_enabled(),
+    )
     try:
-        output_files = pipeline.run()
+        manifest = pipeline.run(clear_cache=False)
     except Exception as e:
         logger.error(f"Pipeline failed: {e}")
-        logger.error(f"logging contents of data/ dir below:\n")
-        # Log the contents of the data directory
-        data_directory = "data"
-        if os.path.exists(data_directory):
-            for root, dirs, files in os.walk(data_directory):
+        logger.error(f"logging contents of {job_dir} dir below:\n")
+        # Log the contents of the job directory
+        if os.path.exists(job_dir):
+            for root, dirs, files in os.walk(job_dir):
                 for name in files:
                     logger.info(f"File: {os.path.join(root, name)}")
                 for name in dirs:
                     logger.info(f"Directory: {os.path.join(root, name)}")
+        # Keep the checkpoints for the retry, if there is one
+        if job is None or not job.retries_left:
+            shutil.rmtree(job_dir, ignore_errors=True)
         raise
 
-    return output_files
+    manifest.input_key = input_key
+    manifest.save(pipeline.workspace.manifest_path)
+    blob_store.put_file(
+        pipeline.workspace.manifest_path,
+        f"outputs/{manifest.digest}/{MANIFEST_FILE_NAME}",
+    )
+
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+    # The web app writes the documents from the manifest when they are requested
+    return manifest.model_dump()
 
 
 if __name__ == "__main__":
+    # Queues to serve, highest priority first, e.g. `python -m src.web.worker large`
+    # for a worker dedicated to large jobs
+    queue_names = sys.argv[1:] or priority_queue_names()
     with Connection(redis_conn):
-        worker = Worker([queue])
+        queues = [Queue(name) for name in queue_names]
+        # Jobs abandoned by a worker that died are retried or failed first, so
+        # that the sweep keeps the workspaces of the retried ones only
+        for queue in queues:
+            clean_registries(queue)
+        sweep_job_workspaces(redis_conn)
+        if settings.PAGE_INDEX_ENABLED and not settings.PAGE_INDEX_SHARED:
+            logger.warning(
+                "Page index off: set PAGE_INDEX_SHARED once PAGE_INDEX_DIR is "
+                "persistent storage shared by every worker host."
+            )
+        worker = TieredWorker(queues)
         worker.work()